@@ -0,0 +1,56 @@
+"""add readers search indexes: lower(email) prefix and name trigrams, built concurrently
+
+lower(email) индексируется в COLLATE "C", а не с text_pattern_ops: так индекс отдает совпадения префикса
+уже упорядоченными, и первые N читаются без сортировки всех совпадений.
+Триграммный индекс имени без fastupdate: новые читатели сразу попадают в дерево, а не в список ожидания,
+который каждый поиск читает целиком до ближайшей очистки.
+Статистика имени собирается по выборке побольше: частоту подстроки ILIKE планировщик оценивает по гистограмме,
+и на грубой оценке редкую подстроку ищет последовательным чтением таблицы до первых совпадений.
+
+Revision ID: 0f1fb83f7b49
+Revises: 12b90ebc113b
+Create Date: 2026-10-18 21:36:20.518734
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = '0f1fb83f7b49'
+down_revision: Union[str, None] = '12b90ebc113b'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    op.execute("ALTER TABLE readers ALTER COLUMN name SET STATISTICS 1000")
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'readers_email_lower_idx',
+            'readers',
+            [sa.text('(lower(email) COLLATE "C")')],
+            postgresql_concurrently=True,
+            if_not_exists=True
+        )
+        op.create_index(
+            'readers_name_trgm_idx',
+            'readers',
+            ['name'],
+            postgresql_using='gin',
+            postgresql_ops={'name': 'gin_trgm_ops'},
+            postgresql_with={'fastupdate': 'off'},
+            postgresql_concurrently=True,
+            if_not_exists=True
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        for name in ('readers_name_trgm_idx', 'readers_email_lower_idx'):
+            op.drop_index(name, table_name='readers', postgresql_concurrently=True, if_exists=True)
+    op.execute("ALTER TABLE readers ALTER COLUMN name SET STATISTICS -1")
@@ -0,0 +1,40 @@
+"""add readers (name, id) index for keyset pagination of readers, built concurrently
+
+Revision ID: 12b90ebc113b
+Revises: d0bb6d4dec72
+Create Date: 2026-10-18 21:07:53.640218
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = '12b90ebc113b'
+down_revision: Union[str, None] = 'd0bb6d4dec72'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'readers_name_id_idx',
+            'readers',
+            ['name', 'id'],
+            postgresql_include=['email'],
+            postgresql_concurrently=True,
+            if_not_exists=True
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            'readers_name_id_idx',
+            table_name='readers',
+            postgresql_concurrently=True,
+            if_exists=True
+        )
@@ -0,0 +1,44 @@
+"""add partial indexes on open loans (return_date IS NULL), built concurrently
+
+Revision ID: 249a6514b363
+Revises: edfb335dfe9e
+Create Date: 2026-10-18 17:05:31.640218
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = '249a6514b363'
+down_revision: Union[str, None] = 'edfb335dfe9e'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# CONCURRENTLY не блокирует выдачи на время построения, но не работает внутри транзакции
+OPEN_LOANS_INDEXES = (
+    ('borrowed_books_open_reader_book_idx', ['reader_id', 'book_id']),
+    ('borrowed_books_open_book_idx', ['book_id']),
+)
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    with op.get_context().autocommit_block():
+        for name, columns in OPEN_LOANS_INDEXES:
+            op.create_index(
+                name,
+                'borrowed_books',
+                columns,
+                postgresql_where=sa.text('return_date IS NULL'),
+                postgresql_concurrently=True,
+                if_not_exists=True  # повторный запуск после прерванного построения
+            )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        for name, _ in reversed(OPEN_LOANS_INDEXES):
+            op.drop_index(name, table_name='borrowed_books', postgresql_concurrently=True, if_exists=True)
@@ -0,0 +1,45 @@
+"""add updated_at to books
+
+Revision ID: 2e27621fea25
+Revises: 55e9bb62f968
+Create Date: 2026-10-18 13:05:47.730215
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = '2e27621fea25'
+down_revision: Union[str, None] = '55e9bb62f968'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column(
+        'books',
+        sa.Column('updated_at', sa.DateTime(timezone=True), nullable=False, server_default=sa.func.now())
+    )
+    op.execute("""
+        CREATE FUNCTION touch_updated_at() RETURNS trigger AS $$
+        BEGIN
+            NEW.updated_at = now();
+            RETURN NEW;
+        END;
+        $$ LANGUAGE plpgsql
+    """)
+    op.execute("""
+        CREATE TRIGGER books_touch_updated_at
+        BEFORE UPDATE ON books
+        FOR EACH ROW EXECUTE FUNCTION touch_updated_at()
+    """)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.execute("DROP TRIGGER books_touch_updated_at ON books")
+    op.execute("DROP FUNCTION touch_updated_at()")
+    op.drop_column('books', 'updated_at')
@@ -0,0 +1,61 @@
+"""add (reader_id, borrow_date, id) index on borrowed_books for per-reader loan history
+
+CREATE INDEX CONCURRENTLY на секционированной таблице не работает, а обычный блокирует выдачи
+на все время построения. Поэтому индекс создается на самой таблице без секций (ON ONLY, он пока невалиден),
+в каждой секции строится CONCURRENTLY и подключается к нему - после подключения последней
+индекс таблицы становится валидным. Секции, созданные позже, получают индекс сами.
+
+Revision ID: 308ee8edcb56
+Revises: 47e2b5b1fb94
+Create Date: 2026-10-18 19:58:17.204415
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = '308ee8edcb56'
+down_revision: Union[str, None] = '47e2b5b1fb94'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+INDEX = 'borrowed_books_reader_borrow_date_id_idx'
+COLUMNS = '(reader_id, borrow_date, id)'
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.execute(f"CREATE INDEX IF NOT EXISTS {INDEX} ON ONLY borrowed_books {COLUMNS}")
+    partitions = op.get_bind().execute(sa.text("""
+        SELECT inhrelid::regclass::text FROM pg_inherits WHERE inhparent = 'borrowed_books'::regclass
+    """)).scalars().all()
+    with op.get_context().autocommit_block():
+        for partition in partitions:
+            name = f"{partition}_{INDEX.removeprefix('borrowed_books_')}"
+            # повторный запуск после прерванного построения: невалидный индекс удаляется и строится заново
+            op.execute(f"""
+                DO $$
+                BEGIN
+                    IF EXISTS (SELECT FROM pg_index WHERE indexrelid = to_regclass('{name}') AND NOT indisvalid) THEN
+                        DROP INDEX {name};
+                    END IF;
+                END
+                $$
+            """)
+            op.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {partition} {COLUMNS}")
+            op.execute(f"""
+                DO $$
+                BEGIN
+                    IF NOT EXISTS (SELECT FROM pg_inherits WHERE inhrelid = '{name}'::regclass) THEN
+                        ALTER INDEX {INDEX} ATTACH PARTITION {name};
+                    END IF;
+                END
+                $$
+            """)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.execute(f"DROP INDEX IF EXISTS {INDEX}")  # индексы секций удаляются вместе с ним
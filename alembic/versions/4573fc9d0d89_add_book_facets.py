@@ -0,0 +1,89 @@
+"""add book_facets summary table maintained by statement-level triggers
+
+Revision ID: 4573fc9d0d89
+Revises: 5df65d4dca04
+Create Date: 2026-10-18 15:02:44.183920
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = '4573fc9d0d89'
+down_revision: Union[str, None] = '5df65d4dca04'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Дельта счетчиков по строкам books (author, year, quantity, sign).
+# Строки фасетов блокируются в одном порядке (ORDER BY facet, value), чтобы не ловить взаимоблокировки,
+# а нулевые дельты (обычная выдача, не последний экземпляр) вообще не трогают таблицу фасетов.
+MERGE_DELTA = """
+    INSERT INTO book_facets (facet, value, total, available)
+    SELECT f.facet, f.value, sum(d.sign), sum(d.sign * (d.quantity > 0)::int)
+    FROM ({rows}) AS d (author, year, quantity, sign)
+    CROSS JOIN LATERAL (
+        VALUES ('catalog', 'all'), ('author', d.author), ('decade', (d.year / 10 * 10)::text)
+    ) AS f (facet, value)
+    WHERE f.value IS NOT NULL
+    GROUP BY f.facet, f.value
+    HAVING sum(d.sign) <> 0 OR sum(d.sign * (d.quantity > 0)::int) <> 0
+    ORDER BY f.facet, f.value
+    ON CONFLICT (facet, value) DO UPDATE
+    SET total = book_facets.total + EXCLUDED.total,
+        available = book_facets.available + EXCLUDED.available
+"""
+
+NEW_ROWS = "SELECT author, year, quantity, 1 FROM new_rows"
+OLD_ROWS = "SELECT author, year, quantity, -1 FROM old_rows"
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        'book_facets',
+        sa.Column('facet', sa.String(16), primary_key=True),
+        sa.Column('value', sa.String(100), primary_key=True),
+        sa.Column('total', sa.Integer, nullable=False, server_default='0'),
+        sa.Column('available', sa.Integer, nullable=False, server_default='0')
+    )
+    op.execute(f"""
+        CREATE FUNCTION book_facets_apply() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'INSERT' THEN
+                {MERGE_DELTA.format(rows=NEW_ROWS)};
+            ELSIF TG_OP = 'DELETE' THEN
+                {MERGE_DELTA.format(rows=OLD_ROWS)};
+            ELSE
+                {MERGE_DELTA.format(rows=f"{NEW_ROWS} UNION ALL {OLD_ROWS}")};
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+    """)
+    op.execute("""
+        CREATE TRIGGER books_facets_insert
+        AFTER INSERT ON books REFERENCING NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION book_facets_apply()
+    """)
+    op.execute("""
+        CREATE TRIGGER books_facets_update
+        AFTER UPDATE ON books REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION book_facets_apply()
+    """)
+    op.execute("""
+        CREATE TRIGGER books_facets_delete
+        AFTER DELETE ON books REFERENCING OLD TABLE AS old_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION book_facets_apply()
+    """)
+    op.execute(MERGE_DELTA.format(rows="SELECT author, year, quantity, 1 FROM books"))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.execute("DROP TRIGGER books_facets_delete ON books")
+    op.execute("DROP TRIGGER books_facets_update ON books")
+    op.execute("DROP TRIGGER books_facets_insert ON books")
+    op.execute("DROP FUNCTION book_facets_apply()")
+    op.drop_table('book_facets')
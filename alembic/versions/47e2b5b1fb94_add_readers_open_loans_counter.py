@@ -0,0 +1,62 @@
+"""add readers.open_loans counter of books on hand, backfilled from borrowed_books
+
+Счетчик ведут выдача и возврат в том же запросе, CHECK не дает параллельным выдачам превысить лимит.
+Сверить счетчик с borrowed_books: `python -m src.maintenance check-open-loans [--fix]`.
+
+Revision ID: 47e2b5b1fb94
+Revises: 899669a3beeb
+Create Date: 2026-10-18 19:24:06.512337
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = '47e2b5b1fb94'
+down_revision: Union[str, None] = '899669a3beeb'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+BORROWED_LIMIT = 3
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # DEFAULT константой не переписывает таблицу
+    op.add_column('readers', sa.Column('open_loans', sa.Integer, nullable=False, server_default='0'))
+    op.execute("""
+        UPDATE readers
+        SET open_loans = loans.open_loans
+        FROM (
+            SELECT reader_id, count(*) AS open_loans
+            FROM borrowed_books
+            WHERE return_date IS NULL
+            GROUP BY reader_id
+        ) AS loans
+        WHERE loans.reader_id = readers.id
+    """)  # частичный индекс borrowed_books_open_reader_book_idx, читается только открытая часть истории
+    op.execute(f"""
+        ALTER TABLE readers ADD CONSTRAINT readers_open_loans_check
+        CHECK (open_loans BETWEEN 0 AND {BORROWED_LIMIT}) NOT VALID
+    """)
+    # старая проверка лимита шла по снимку и могла пропустить лишнюю выдачу, такие читатели не ломают миграцию:
+    # ограничение действует для новых изменений, а проверяется целиком, когда долг вернут
+    op.execute(f"""
+        DO $$
+        BEGIN
+            IF EXISTS (SELECT FROM readers WHERE open_loans > {BORROWED_LIMIT}) THEN
+                RAISE NOTICE 'readers over the limit, readers_open_loans_check left NOT VALID';
+            ELSE
+                ALTER TABLE readers VALIDATE CONSTRAINT readers_open_loans_check;
+            END IF;
+        END
+        $$
+    """)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_constraint('readers_open_loans_check', 'readers', type_='check')
+    op.drop_column('readers', 'open_loans')
@@ -0,0 +1,93 @@
+"""add full-text and trigram search over books
+
+search_vector - обычная колонка, которую ведет триггер books_search_vector; существующие книги
+заполняются пачками, индексы строятся CONCURRENTLY - каталог не блокируется на время миграции.
+
+Revision ID: 55e9bb62f968
+Revises: 9fd3d0db6cac
+Create Date: 2026-10-18 11:40:05.118734
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects.postgresql import TSVECTOR
+
+# revision identifiers, used by Alembic.
+revision: str = '55e9bb62f968'
+down_revision: Union[str, None] = '9fd3d0db6cac'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+SEARCH_VECTOR = (
+    "setweight(to_tsvector('simple', coalesce({row}title, '')), 'A') || "
+    "setweight(to_tsvector('simple', coalesce({row}author, '')), 'B') || "
+    "setweight(to_tsvector('simple', coalesce({row}description, '')), 'C')"
+)
+BACKFILL_BATCH = 10_000
+SEARCH_INDEXES = (
+    ('books_search_vector_idx', 'search_vector', {}),
+    ('books_title_trgm_idx', 'title', {'title': 'gin_trgm_ops'}),
+    ('books_author_trgm_idx', 'author', {'author': 'gin_trgm_ops'}),
+)
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    # STORED GENERATED колонка переписала бы всю таблицу под ACCESS EXCLUSIVE,
+    # nullable колонка без DEFAULT добавляется мгновенно, новые и измененные строки заполняет триггер
+    op.add_column('books', sa.Column('search_vector', TSVECTOR, nullable=True))
+    op.execute(f"""
+        CREATE FUNCTION books_search_vector() RETURNS trigger AS $$
+        BEGIN
+            NEW.search_vector = {SEARCH_VECTOR.format(row="NEW.")};
+            RETURN NEW;
+        END;
+        $$ LANGUAGE plpgsql
+    """)
+    op.execute("""
+        CREATE TRIGGER books_search_vector
+        BEFORE INSERT OR UPDATE OF title, author, description ON books
+        FOR EACH ROW EXECUTE FUNCTION books_search_vector()
+    """)
+    with op.get_context().autocommit_block():
+        # существующие строки - пачками по id, каждая пачка - своя транзакция с короткими блокировками строк
+        connection = op.get_bind()
+        last_id = 0
+        while last_id is not None:
+            last_id = connection.execute(
+                sa.text(f"""
+                    WITH batch AS (
+                        SELECT id FROM books WHERE id > :last_id ORDER BY id LIMIT :batch
+                    ), filled AS (
+                        UPDATE books SET search_vector = {SEARCH_VECTOR.format(row="")}
+                        FROM batch
+                        WHERE books.id = batch.id AND books.search_vector IS NULL
+                    )
+                    SELECT max(id) FROM batch
+                """),
+                {"last_id": last_id, "batch": BACKFILL_BATCH}
+            ).scalar()
+        for name, column, ops in SEARCH_INDEXES:
+            op.create_index(
+                name,
+                'books',
+                [column],
+                postgresql_using='gin',
+                postgresql_ops=ops,
+                postgresql_concurrently=True,
+                if_not_exists=True  # повторный запуск после прерванного построения
+            )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        for name, _, _ in reversed(SEARCH_INDEXES):
+            op.drop_index(name, table_name='books', postgresql_concurrently=True, if_exists=True)
+    op.execute("DROP TRIGGER books_search_vector ON books")
+    op.execute("DROP FUNCTION books_search_vector()")
+    op.drop_column('books', 'search_vector')
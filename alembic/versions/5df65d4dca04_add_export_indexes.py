@@ -0,0 +1,44 @@
+"""add borrowed_books.updated_at and updated_at indexes for incremental export, built concurrently
+
+Revision ID: 5df65d4dca04
+Revises: 2e27621fea25
+Create Date: 2026-10-18 14:21:09.551842
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = '5df65d4dca04'
+down_revision: Union[str, None] = '2e27621fea25'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column(
+        'borrowed_books',
+        sa.Column('updated_at', sa.DateTime(timezone=True), nullable=False, server_default=sa.func.now())
+    )
+    op.execute("""
+        CREATE TRIGGER borrowed_books_touch_updated_at
+        BEFORE UPDATE ON borrowed_books
+        FOR EACH ROW EXECUTE FUNCTION touch_updated_at()
+    """)
+    with op.get_context().autocommit_block():
+        for table in ('books', 'borrowed_books'):
+            op.create_index(
+                f'{table}_updated_at_idx', table, ['updated_at'], postgresql_concurrently=True, if_not_exists=True
+            )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        for table in ('borrowed_books', 'books'):
+            op.drop_index(f'{table}_updated_at_idx', table_name=table, postgresql_concurrently=True, if_exists=True)
+    op.execute("DROP TRIGGER borrowed_books_touch_updated_at ON borrowed_books")
+    op.drop_column('borrowed_books', 'updated_at')
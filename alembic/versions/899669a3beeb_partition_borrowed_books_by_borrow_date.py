@@ -0,0 +1,120 @@
+"""partition borrowed_books by borrow_date range
+
+Существующая таблица не копируется: она подключается секцией borrowed_books_history
+на диапазон (MINVALUE, начало следующего года), новые выдачи идут в годовые секции borrowed_books_yYYYY,
+все, чему не нашлось секции, - в borrowed_books_default.
+Годовые секции создает и старые архивирует `python -m src.maintenance`.
+
+Revision ID: 899669a3beeb
+Revises: a52f8d38600c
+Create Date: 2026-10-18 18:32:40.118504
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = '899669a3beeb'
+down_revision: Union[str, None] = 'a52f8d38600c'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+INDEXES = (
+    ('borrowed_books_open_reader_book_idx', '(reader_id, book_id) WHERE return_date IS NULL'),
+    ('borrowed_books_open_book_idx', '(book_id) WHERE return_date IS NULL'),
+    ('borrowed_books_borrow_date_id_idx', '(borrow_date, id)'),
+    ('borrowed_books_updated_at_idx', '(updated_at)'),
+)
+
+FOREIGN_KEYS = (
+    ('fk_borrowed_books_book_id', 'book_id', 'books'),
+    ('fk_borrowed_books_reader_id', 'reader_id', 'readers'),
+)
+
+
+def _history(name: str) -> str:
+    return name.replace('borrowed_books_', 'borrowed_books_history_', 1)
+
+
+def _create_dependents() -> None:
+    """ Внешние ключи, индексы и триггер таблицы borrowed_books (для секционированной копируются в секции) """
+    for name, column, referent in FOREIGN_KEYS:
+        op.execute(f"""
+            ALTER TABLE borrowed_books ADD CONSTRAINT {name}
+            FOREIGN KEY ({column}) REFERENCES {referent} (id) ON UPDATE CASCADE
+        """)
+    for name, definition in INDEXES:
+        op.execute(f"CREATE INDEX {name} ON borrowed_books {definition}")
+    op.execute("""
+        CREATE TRIGGER borrowed_books_touch_updated_at
+        BEFORE UPDATE ON borrowed_books
+        FOR EACH ROW EXECUTE FUNCTION touch_updated_at()
+    """)
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # старая таблица становится секцией истории: освобождаем имена, ключи и триггер переходят к новой
+    op.execute("ALTER TABLE borrowed_books RENAME TO borrowed_books_history")
+    for name, _ in INDEXES:
+        op.execute(f"ALTER INDEX {name} RENAME TO {_history(name)}")  # совпадут с индексами новой и подключатся
+    for name, _, _ in FOREIGN_KEYS:
+        op.execute(f"ALTER TABLE borrowed_books_history DROP CONSTRAINT {name}")
+    op.execute("DROP TRIGGER borrowed_books_touch_updated_at ON borrowed_books_history")
+    op.execute("ALTER TABLE borrowed_books_history DROP CONSTRAINT borrowed_books_pkey")
+    op.execute("ALTER TABLE borrowed_books_history ALTER COLUMN id DROP DEFAULT")
+
+    # первичный ключ секционированной таблицы обязан включать ключ секционирования
+    op.execute("""
+        CREATE TABLE borrowed_books (
+            id integer NOT NULL DEFAULT nextval('borrowed_books_id_seq'),
+            book_id integer NOT NULL,
+            reader_id integer NOT NULL,
+            borrow_date timestamp without time zone NOT NULL DEFAULT now(),
+            return_date timestamp without time zone,
+            updated_at timestamp with time zone NOT NULL DEFAULT now(),
+            CONSTRAINT borrowed_books_pkey PRIMARY KEY (id, borrow_date)
+        ) PARTITION BY RANGE (borrow_date)
+    """)
+    op.execute("ALTER SEQUENCE borrowed_books_id_seq OWNED BY borrowed_books.id")
+    _create_dependents()
+
+    # CHECK заранее доказывает границу секции, ATTACH не сканирует таблицу повторно
+    op.execute("""
+        DO $$
+        DECLARE
+            bound timestamp := date_trunc(
+                'year', greatest((SELECT max(borrow_date) FROM borrowed_books_history), localtimestamp)
+            ) + interval '1 year';
+        BEGIN
+            EXECUTE format(
+                'ALTER TABLE borrowed_books_history ADD CONSTRAINT borrowed_books_history_bound CHECK (borrow_date < %L)',
+                bound
+            );
+            EXECUTE format(
+                'ALTER TABLE borrowed_books ATTACH PARTITION borrowed_books_history FOR VALUES FROM (MINVALUE) TO (%L)',
+                bound
+            );
+            ALTER TABLE borrowed_books_history DROP CONSTRAINT borrowed_books_history_bound;
+            EXECUTE format(
+                'CREATE TABLE %I PARTITION OF borrowed_books FOR VALUES FROM (%L) TO (%L)',
+                'borrowed_books_y' || extract(year FROM bound), bound, bound + interval '1 year'
+            );
+        END
+        $$
+    """)
+    op.execute("CREATE TABLE borrowed_books_default PARTITION OF borrowed_books DEFAULT")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    # обратно - обычная таблица, данные всех подключенных секций копируются (архивные остаются в схеме archive)
+    op.execute("CREATE TABLE borrowed_books_plain (LIKE borrowed_books INCLUDING DEFAULTS)")
+    op.execute("INSERT INTO borrowed_books_plain SELECT * FROM borrowed_books")
+    op.execute("ALTER SEQUENCE borrowed_books_id_seq OWNED BY NONE")
+    op.execute("DROP TABLE borrowed_books")
+    op.execute("ALTER TABLE borrowed_books_plain RENAME TO borrowed_books")
+    op.execute("ALTER SEQUENCE borrowed_books_id_seq OWNED BY borrowed_books.id")
+    op.execute("ALTER TABLE borrowed_books ADD CONSTRAINT borrowed_books_pkey PRIMARY KEY (id)")
+    _create_dependents()
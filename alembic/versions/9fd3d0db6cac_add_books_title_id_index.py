@@ -0,0 +1,36 @@
+"""add books (title, id) index for keyset pagination
+
+Revision ID: 9fd3d0db6cac
+Revises: 3307259b9040
+Create Date: 2026-10-18 10:12:31.402118
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = '9fd3d0db6cac'
+down_revision: Union[str, None] = '3307259b9040'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # CONCURRENTLY не блокирует запись в каталог на время построения, но не работает внутри транзакции
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'books_title_id_idx',
+            'books',
+            ['title', 'id'],
+            postgresql_include=['author', 'year', 'quantity'],
+            postgresql_concurrently=True,
+            if_not_exists=True  # повторный запуск после прерванного построения
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        op.drop_index('books_title_id_idx', table_name='books', postgresql_concurrently=True, if_exists=True)
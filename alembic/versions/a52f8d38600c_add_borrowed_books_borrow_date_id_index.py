@@ -0,0 +1,39 @@
+"""add (borrow_date, id) index for keyset pagination of loans, built concurrently
+
+Revision ID: a52f8d38600c
+Revises: 249a6514b363
+Create Date: 2026-10-18 17:48:12.205937
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = 'a52f8d38600c'
+down_revision: Union[str, None] = '249a6514b363'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'borrowed_books_borrow_date_id_idx',
+            'borrowed_books',
+            ['borrow_date', 'id'],
+            postgresql_concurrently=True,
+            if_not_exists=True
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            'borrowed_books_borrow_date_id_idx',
+            table_name='borrowed_books',
+            postgresql_concurrently=True,
+            if_exists=True
+        )
@@ -0,0 +1,66 @@
+"""add book_stock: remaining copies of hot books split into slots
+
+Книга с books.stock_slots = 0 работает как раньше (остаток в books.quantity).
+Для книги со слотами остаток лежит в book_stock, а books.quantity - всего экземпляров (в наличии и на руках).
+Включается и выключается через PUT /books/{book_id}/stock.
+
+Revision ID: d0bb6d4dec72
+Revises: 308ee8edcb56
+Create Date: 2026-10-18 20:41:15.274903
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = 'd0bb6d4dec72'
+down_revision: Union[str, None] = '308ee8edcb56'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # DEFAULT константой не переписывает таблицу
+    op.add_column('books', sa.Column('stock_slots', sa.Integer, nullable=False, server_default='0'))
+    op.create_table(
+        'book_stock',
+        sa.Column('book_id', sa.Integer, primary_key=True),
+        sa.Column('slot', sa.Integer, primary_key=True),
+        sa.Column('quantity', sa.Integer, nullable=False),
+        sa.Column('updated_at', sa.DateTime(timezone=True), nullable=False, server_default=sa.func.now()),
+        sa.CheckConstraint('quantity >= 0', name='book_stock_quantity_check'),
+        sa.ForeignKeyConstraint(['book_id'], ['books.id'], ondelete='CASCADE', onupdate='CASCADE')
+    )
+    # выдача из слота не меняет строку books: время изменения книги - наибольшее из книги и ее слотов
+    op.execute("""
+        CREATE TRIGGER book_stock_touch_updated_at
+        BEFORE UPDATE ON book_stock
+        FOR EACH ROW EXECUTE FUNCTION touch_updated_at()
+    """)
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'books_stock_slots_idx',
+            'books',
+            ['id'],
+            postgresql_where=sa.text('stock_slots > 0'),
+            postgresql_concurrently=True,
+            if_not_exists=True
+        )  # книги со слотами для поправки фасетов "в наличии"
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    # остаток из слотов возвращается в books.quantity
+    op.execute("""
+        UPDATE books
+        SET quantity = stock.quantity
+        FROM (SELECT book_id, sum(quantity) AS quantity FROM book_stock GROUP BY book_id) AS stock
+        WHERE stock.book_id = books.id
+    """)
+    with op.get_context().autocommit_block():
+        op.drop_index('books_stock_slots_idx', table_name='books', postgresql_concurrently=True, if_exists=True)
+    op.drop_table('book_stock')
+    op.drop_column('books', 'stock_slots')
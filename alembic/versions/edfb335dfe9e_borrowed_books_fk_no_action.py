@@ -0,0 +1,45 @@
+"""borrowed_books foreign keys: ON DELETE NO ACTION instead of CASCADE
+
+Revision ID: edfb335dfe9e
+Revises: 4573fc9d0d89
+Create Date: 2026-10-18 16:21:07.512306
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = 'edfb335dfe9e'
+down_revision: Union[str, None] = '4573fc9d0d89'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# История выдач удаляется вместе с книгой/читателем явно, в том же запросе.
+# Без каскада выдача, вставленная параллельно с удалением, дает ошибку внешнего ключа,
+# а не удаляется молча вместе с книгой.
+FOREIGN_KEYS = (
+    ('fk_borrowed_books_book_id', 'book_id', 'books'),
+    ('fk_borrowed_books_reader_id', 'reader_id', 'readers'),
+)
+
+
+def _recreate(ondelete: str) -> None:
+    for name, column, referent in FOREIGN_KEYS:
+        op.drop_constraint(name, 'borrowed_books', type_='foreignkey')
+        op.create_foreign_key(
+            name,
+            'borrowed_books', referent,
+            [column], ['id'],
+            onupdate='CASCADE', ondelete=ondelete
+        )
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    _recreate('NO ACTION')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    _recreate('CASCADE')
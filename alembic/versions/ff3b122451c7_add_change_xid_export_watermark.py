@@ -0,0 +1,90 @@
+"""add change_xid to books, borrowed_books and book_stock: commit-ordered watermark for incremental export
+
+updated_at ставит now() - начало транзакции, а не коммит: транзакция, начатая до прошлой выгрузки
+и закоммиченная после нее, получает updated_at меньше запомненного максимума и в следующую выгрузку не попадает.
+change_xid - номер (xid8) транзакции, изменившей строку. Выгрузка отдает отметку xmin своего снимка:
+все транзакции младше нее к началу выгрузки завершены и в нее попали, поэтому следующая выгрузка
+с `changed_since` = отметке ничего не теряет (незавершенные тогда транзакции придут повторно, дубли - по id).
+У book_stock change_xid тоже есть: выдача из слота меняет остаток книги, не трогая строку books.
+Старые строки остаются с change_xid NULL: после миграции нужна одна полная выгрузка.
+Индексы по updated_at служили только выгрузке и заменяются индексами по change_xid.
+
+Revision ID: ff3b122451c7
+Revises: 0f1fb83f7b49
+Create Date: 2026-10-19 10:12:47.301846
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = 'ff3b122451c7'
+down_revision: Union[str, None] = '0f1fb83f7b49'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+TABLES = ('books', 'borrowed_books', 'book_stock')
+INDEXED = ('books', 'borrowed_books')  # book_stock мала, а индекс лишил бы выдачи из слота HOT-обновлений
+
+TOUCH_UPDATED_AT = """
+    CREATE OR REPLACE FUNCTION touch_updated_at() RETURNS trigger AS $$
+    BEGIN
+        NEW.updated_at = now();{change_xid}
+        RETURN NEW;
+    END;
+    $$ LANGUAGE plpgsql
+"""
+
+
+def _create_index(table: str, column: str) -> None:
+    """ Индекс без блокировки записи. У секционированной таблицы CONCURRENTLY нельзя строить сразу:
+    индекс заводится только на родителе (ONLY), строится по секциям и подключается к родителю """
+    name = f'{table}_{column}_idx'
+    partitions = op.get_bind().execute(
+        sa.text("SELECT inhrelid::regclass::text FROM pg_inherits WHERE inhparent = CAST(:table AS regclass)"),
+        {'table': table}
+    ).scalars().all()
+    if not partitions:
+        op.create_index(name, table, [column], postgresql_concurrently=True, if_not_exists=True)
+        return
+    op.execute(f'CREATE INDEX IF NOT EXISTS {name} ON ONLY {table} ({column})')
+    for partition in partitions:
+        op.execute(f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {partition}_{column}_idx ON {partition} ({column})')
+        op.execute(f'ALTER INDEX {name} ATTACH PARTITION {partition}_{column}_idx')
+
+
+def _drop_index(table: str, column: str) -> None:
+    """ Индекс секционированной таблицы удаляется только целиком и без CONCURRENTLY """
+    partitioned = op.get_bind().scalar(
+        sa.text("SELECT relkind = 'p' FROM pg_class WHERE oid = CAST(:table AS regclass)"),
+        {'table': table}
+    )
+    op.drop_index(
+        f'{table}_{column}_idx', table_name=table, postgresql_concurrently=not partitioned, if_exists=True
+    )
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    for table in TABLES:
+        # без значения по умолчанию в ADD COLUMN таблица не переписывается, старые строки остаются NULL
+        op.execute(f'ALTER TABLE {table} ADD COLUMN change_xid xid8')
+        op.execute(f'ALTER TABLE {table} ALTER COLUMN change_xid SET DEFAULT pg_current_xact_id()')
+    op.execute(TOUCH_UPDATED_AT.format(change_xid='\n        NEW.change_xid = pg_current_xact_id();'))
+    with op.get_context().autocommit_block():
+        for table in INDEXED:
+            _create_index(table, 'change_xid')
+            _drop_index(table, 'updated_at')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        for table in INDEXED:
+            _create_index(table, 'updated_at')
+            _drop_index(table, 'change_xid')
+    op.execute(TOUCH_UPDATED_AT.format(change_xid=''))
+    for table in TABLES:
+        op.drop_column(table, 'change_xid')
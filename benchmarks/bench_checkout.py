@@ -0,0 +1,85 @@
+""" Бенчмарк выдачи одной "горячей" книги параллельными запросами.
+
+Создает книгу с `--quantity` экземплярами и `--checkouts` читателей, затем выдает книгу каждому
+читателю через DB_GiveOutBook в `--concurrency` потоков. Печатает выдачи в секунду и проверяет,
+что выдано не больше, чем было экземпляров, а остаток не ушел в минус. Созданные данные удаляются.
+
+Запуск (на отдельной базе, настройки подключения те же, что у приложения):
+python -m benchmarks.bench_checkout --checkouts 2000 --quantity 1000 --concurrency 20
+"""
+import argparse
+import asyncio
+import time
+import uuid
+
+from fastapi import HTTPException
+from sqlalchemy import insert, select, delete
+
+from src.core.infrastructures import database
+from src.core.schemas import books, readers, borrowed_books
+from src.services.borrowed_books.dto.input import INPUT_CreateBorrowedBook
+from src.services.borrowed_books.repository import DB_GiveOutBook
+
+
+async def setup(checkouts: int, quantity: int) -> tuple[int, list[int]]:
+    run = uuid.uuid4().hex[:8]
+    async with database().connect() as connection:
+        book_id = (await connection.execute(
+            insert(books).values(title=f"bench {run}", author="bench", quantity=quantity).returning(books.c.id)
+        )).scalar()
+        reader_ids = (await connection.execute(
+            insert(readers).returning(readers.c.id),
+            [{"name": "bench", "email": f"bench-{run}-{number}@bench.local"} for number in range(checkouts)]
+        )).scalars().all()
+        await connection.commit()
+    return book_id, list(reader_ids)
+
+
+async def teardown(book_id: int, reader_ids: list[int]):
+    async with database().connect() as connection:
+        await connection.execute(delete(borrowed_books).where(borrowed_books.c.book_id == book_id))
+        await connection.execute(delete(readers).where(readers.c.id.in_(reader_ids)))
+        await connection.execute(delete(books).where(books.c.id == book_id))
+        await connection.commit()
+
+
+async def main(checkouts: int, quantity: int, concurrency: int):
+    book_id, reader_ids = await setup(checkouts, quantity)
+    give_out = DB_GiveOutBook()
+    queue = iter(reader_ids)
+    outcomes: dict[str, int] = {}
+
+    async def worker():
+        for reader_id in queue:
+            try:
+                await give_out(INPUT_CreateBorrowedBook(reader_id=reader_id, book_id=book_id))
+                outcome = "given"
+            except HTTPException as e:
+                outcome = e.detail
+            outcomes[outcome] = outcomes.get(outcome, 0) + 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    elapsed = time.perf_counter() - started
+
+    async with database().connect() as connection:
+        left = (await connection.execute(select(books.c.quantity).where(books.c.id == book_id))).scalar()
+    await teardown(book_id, reader_ids)
+    await database.dispose()
+
+    given = outcomes.get("given", 0)
+    print(f"checkouts: {checkouts}, concurrency: {concurrency}, elapsed: {elapsed:.2f}s")
+    print(f"throughput: {checkouts / elapsed:.0f} requests/s, {given / elapsed:.0f} checkouts/s")
+    for outcome, number in sorted(outcomes.items()):
+        print(f"  {outcome}: {number}")
+    print(f"quantity: {quantity} -> {left}")
+    assert given == min(checkouts, quantity) and left == quantity - given, "выдано больше, чем было экземпляров"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--checkouts", type=int, default=2000)
+    parser.add_argument("--quantity", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=20)
+    arguments = parser.parse_args()
+    asyncio.run(main(arguments.checkouts, arguments.quantity, arguments.concurrency))
@@ -0,0 +1,291 @@
+""" Нагрузочный бенчмарк: `--desks` стоек выдачи одновременно работают с одной "горячей" книгой.
+
+Каждая стойка в цикле выдает книгу случайному читателю (POST /borrowed_books/), а с вероятностью
+`--return-ratio` вместо выдачи принимает ее обратно у одного из читателей, которым она уже выдана
+(PATCH /borrowed_books/). С `--slots` остаток книги перед прогоном раскладывается по слотам
+(PUT /books/{book_id}/stock), и выдачи расходятся по разным строкам. Запросы идут через HTTP API: по умолчанию в том же процессе (ASGITransport),
+с `--base-url` - на запущенный сервер (база у сервера и бенчмарка должна быть одна).
+
+Отчет: пропускная способность, задержки p50/p99 по операциям и кодам ответа, сколько соединений
+ждали блокировок (выборка pg_stat_activity каждые `--lock-sample` секунд) и сколько случилось deadlock,
+нарушения инвариантов после прогона: отрицательный остаток, экземпляры, потерянные или выданные дважды,
+больше лимита книг на руках, расхождения счетчика readers.open_loans.
+Результат сохраняется в JSON (`--output`), `--baseline` сравнивает его с прошлым прогоном.
+Созданные данные удаляются.
+
+Запуск (на отдельной базе, настройки подключения те же, что у приложения):
+python -m benchmarks.bench_contention --desks 200 --duration 10 --quantity 50
+python -m benchmarks.bench_contention --desks 200 --duration 10 --quantity 50 --slots 8
+python -m benchmarks.bench_contention --base-url http://localhost:10000 --baseline benchmarks/results/last.json
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import pathlib
+import random
+import subprocess
+import time
+import uuid
+from collections import defaultdict
+
+from httpx import ASGITransport, AsyncClient
+from sqlalchemy import insert, select, delete, func, text
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncEngine
+
+from src.app import app
+from src.core.infrastructures import database
+from src.core.schemas import books, readers, borrowed_books, librarians, BORROWED_LIMIT
+from src.core.security import TokenManager, TokenTypes
+from src.maintenance.open_loans import check_open_loans
+from src.services.books.repository import book_quantity
+
+RESULTS = pathlib.Path(__file__).parent / "results"
+
+
+class Fixture:
+    """ Данные одного прогона: книга, читатели и библиотекарь, от имени которого идут запросы """
+
+    def __init__(self, book_id: int, reader_ids: list[int], librarian_id: int):
+        self.book_id = book_id
+        self.reader_ids = reader_ids
+        self.librarian_id = librarian_id
+
+
+async def setup(engine: AsyncEngine, readers_count: int, quantity: int) -> Fixture:
+    run = uuid.uuid4().hex[:8]
+    async with engine.begin() as connection:
+        book_id = (await connection.execute(
+            insert(books).values(title=f"bench {run}", author="bench", quantity=quantity).returning(books.c.id)
+        )).scalar()
+        reader_ids = (await connection.execute(
+            insert(readers).returning(readers.c.id),
+            [{"name": "bench", "email": f"bench-{run}-{number}@bench.local"} for number in range(readers_count)]
+        )).scalars().all()
+        librarian_id = (await connection.execute(
+            insert(librarians).values(login=f"bench-{run}", password="-").returning(librarians.c.id)
+        )).scalar()
+    return Fixture(book_id, list(reader_ids), librarian_id)
+
+
+async def teardown(engine: AsyncEngine, fixture: Fixture):
+    async with engine.begin() as connection:
+        await connection.execute(delete(borrowed_books).where(borrowed_books.c.book_id == fixture.book_id))
+        await connection.execute(delete(readers).where(readers.c.id.in_(fixture.reader_ids)))
+        await connection.execute(delete(books).where(books.c.id == fixture.book_id))
+        await connection.execute(delete(librarians).where(librarians.c.id == fixture.librarian_id))
+
+
+def percentile(values: list[float], q: float) -> float:
+    """ Процентиль методом ближайшего ранга, `values` отсортированы """
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, max(0, round(q / 100 * len(values)) - 1))]
+
+
+def summarize(samples: list[tuple[float, int]], elapsed: float) -> dict:
+    latencies = sorted(latency for latency, _ in samples)
+    statuses: dict[str, int] = defaultdict(int)
+    for _, status_code in samples:
+        statuses[str(status_code)] += 1
+    return {
+        "requests": len(samples),
+        "throughput": round(len(samples) / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "max_ms": round(latencies[-1] * 1000, 2) if latencies else 0.0,
+        "statuses": dict(sorted(statuses.items()))
+    }
+
+
+async def sample_locks(engine: AsyncEngine, stop: asyncio.Event, interval: float) -> dict:
+    """ Сколько соединений этой базы ждут блокировку (строки книги, читателя), по выборкам во время прогона """
+    waiting = []
+    async with engine.connect() as connection:
+        deadlocks = text("SELECT deadlocks FROM pg_stat_database WHERE datname = current_database()")
+        deadlocks_before = (await connection.execute(deadlocks)).scalar()
+        while not stop.is_set():
+            waiting.append((await connection.execute(text(
+                "SELECT count(*) FROM pg_stat_activity "
+                "WHERE datname = current_database() AND wait_event_type = 'Lock'"
+            ))).scalar())
+            await connection.rollback()  # каждая выборка - свежий снимок статистики
+            try:
+                await asyncio.wait_for(stop.wait(), interval)
+            except asyncio.TimeoutError:
+                pass
+        deadlocks_after = (await connection.execute(deadlocks)).scalar()
+    return {
+        "samples": len(waiting),
+        "max_waiting": max(waiting, default=0),
+        "mean_waiting": round(sum(waiting) / len(waiting), 2) if waiting else 0.0,
+        "deadlocks": deadlocks_after - deadlocks_before
+    }
+
+
+async def check_invariants(engine: AsyncEngine, fixture: Fixture, quantity: int) -> dict:
+    async with engine.begin() as connection:
+        left = (await connection.execute(select(book_quantity).where(books.c.id == fixture.book_id))).scalar()
+        on_hand = (await connection.execute(
+            select(func.count())
+            .where(borrowed_books.c.book_id == fixture.book_id)
+            .where(borrowed_books.c.return_date.is_(None))
+        )).scalar()
+        per_reader = (
+            select(func.count().label("loans"))
+            .where(borrowed_books.c.reader_id.in_(fixture.reader_ids))
+            .where(borrowed_books.c.return_date.is_(None))
+            .group_by(borrowed_books.c.reader_id)
+            .subquery()
+        )
+        over_limit = (await connection.execute(
+            select(func.count()).select_from(per_reader).where(per_reader.c.loans > BORROWED_LIMIT)
+        )).scalar()
+        duplicates = (await connection.execute(
+            select(func.count()).select_from(per_reader).where(per_reader.c.loans > 1)
+        )).scalar()  # у читателя не может быть двух экземпляров одной книги
+        reader_ids = set(fixture.reader_ids)
+        mismatches = [m for m in await check_open_loans(connection) if m.reader_id in reader_ids]
+        await connection.rollback()  # check_open_loans блокирует строки читателей, ничего не меняем
+    return {
+        "quantity_left": left,
+        "on_hand": on_hand,
+        "negative_quantity": int(left < 0),
+        "lost_copies": quantity - left - on_hand,  # не 0 - экземпляр списан без выдачи или возвращен дважды
+        "readers_over_limit": over_limit,
+        "duplicate_loans": duplicates,
+        "open_loans_mismatches": len(mismatches)
+    }
+
+
+async def run(arguments: argparse.Namespace) -> dict:
+    engine = create_async_engine(database().url)  # свой пул: служебные запросы не занимают пул приложения
+    fixture = await setup(engine, arguments.readers, arguments.quantity)
+    token = TokenManager.create({"id": fixture.librarian_id}, TokenTypes.ACCESS)
+    headers = {"Authorization": f"bearer {token}"}
+    transport = None if arguments.base_url else ASGITransport(app=app, raise_app_exceptions=False)
+    samples: dict[str, list[tuple[float, int]]] = {"give_out": [], "return": []}
+    holders: list[int] = []  # читатели, у которых сейчас книга (по ответам API)
+    stop = asyncio.Event()
+
+    async def desk(client: AsyncClient, deadline: float):
+        while time.perf_counter() < deadline:
+            returning = bool(holders) and random.random() < arguments.return_ratio
+            reader_id = holders.pop(random.randrange(len(holders))) if returning else random.choice(fixture.reader_ids)
+            body = {"reader_id": reader_id, "book_id": fixture.book_id}
+            started = time.perf_counter()
+            if returning:
+                response = await client.patch("/borrowed_books/", headers=headers, json=body)
+            else:
+                response = await client.post("/borrowed_books/", headers=headers, json=body)
+            samples["return" if returning else "give_out"].append((time.perf_counter() - started, response.status_code))
+            if not returning and response.status_code == 201:
+                holders.append(reader_id)
+
+    try:
+        async with AsyncClient(
+                transport=transport,
+                base_url=arguments.base_url or "http://bench",
+                timeout=arguments.timeout
+        ) as client:
+            if arguments.slots:
+                response = await client.put(
+                    f"/books/{fixture.book_id}/stock", headers=headers, json={"slots": arguments.slots}
+                )
+                response.raise_for_status()
+            locks = asyncio.create_task(sample_locks(engine, stop, arguments.lock_sample))
+            started = time.perf_counter()
+            await asyncio.gather(*[desk(client, started + arguments.duration) for _ in range(arguments.desks)])
+            elapsed = time.perf_counter() - started
+            stop.set()
+            lock_waits = await locks
+        invariants = await check_invariants(engine, fixture, arguments.quantity)
+    finally:
+        await teardown(engine, fixture)
+        await engine.dispose()
+        await database.dispose()
+    return {
+        "benchmark": "contention",
+        "started_at": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "commit": _commit(),
+        "parameters": {
+            "desks": arguments.desks,
+            "duration": arguments.duration,
+            "quantity": arguments.quantity,
+            "readers": arguments.readers,
+            "slots": arguments.slots,
+            "return_ratio": arguments.return_ratio,
+            "target": arguments.base_url or "asgi"
+        },
+        "elapsed": round(elapsed, 2),
+        "total": summarize(samples["give_out"] + samples["return"], elapsed),
+        "operations": {operation: summarize(values, elapsed) for operation, values in samples.items()},
+        "lock_waits": lock_waits,
+        "invariants": invariants
+    }
+
+
+def _commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def violations(result: dict) -> list[str]:
+    invariants = result["invariants"]
+    return [
+        name for name in ("negative_quantity", "lost_copies", "readers_over_limit", "duplicate_loans",
+                          "open_loans_mismatches")
+        if invariants[name] != 0
+    ]
+
+
+def report(result: dict, baseline: dict | None):
+    print(f"desks: {result['parameters']['desks']}, elapsed: {result['elapsed']}s, commit: {result['commit']}")
+    print(f"{'operation':<12}{'requests':>10}{'req/s':>10}{'p50, ms':>10}{'p99, ms':>10}{'max, ms':>10}  statuses")
+    for operation, summary in {"total": result["total"], **result["operations"]}.items():
+        print(
+            f"{operation:<12}{summary['requests']:>10}{summary['throughput']:>10}{summary['p50_ms']:>10}"
+            f"{summary['p99_ms']:>10}{summary['max_ms']:>10}  {summary['statuses']}"
+        )
+    print(f"lock waits: {result['lock_waits']}")
+    print(f"invariants: {result['invariants']}")
+    if baseline is not None:
+        for metric in ("throughput", "p50_ms", "p99_ms"):
+            before, after = baseline["total"][metric], result["total"][metric]
+            change = (after - before) / before * 100 if before else 0.0
+            print(f"{metric} vs baseline ({baseline['commit']}): {before} -> {after} ({change:+.1f}%)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--desks", type=int, default=200, help="параллельных клиентов")
+    parser.add_argument("--duration", type=float, default=10.0, help="секунд нагрузки")
+    parser.add_argument("--quantity", type=int, default=50, help="экземпляров горячей книги")
+    parser.add_argument("--readers", type=int, default=2000)
+    parser.add_argument("--slots", type=int, default=0, help="слотов остатка книги (0 - остаток в строке книги)")
+    parser.add_argument("--return-ratio", type=float, default=0.4, help="доля возвратов среди операций")
+    parser.add_argument("--lock-sample", type=float, default=0.05, help="интервал выборки ожиданий блокировок, с")
+    parser.add_argument("--timeout", type=float, default=60.0, help="таймаут HTTP запроса, с")
+    parser.add_argument("--base-url", help="адрес запущенного сервера (по умолчанию приложение в процессе)")
+    parser.add_argument("--output", type=pathlib.Path, help="куда сохранить JSON (по умолчанию benchmarks/results/)")
+    parser.add_argument("--baseline", type=pathlib.Path, help="JSON прошлого прогона для сравнения")
+    arguments = parser.parse_args()
+
+    result = asyncio.run(run(arguments))
+    baseline = json.loads(arguments.baseline.read_text()) if arguments.baseline else None
+    report(result, baseline)
+    output = arguments.output or RESULTS / f"contention-{datetime.datetime.now():%Y%m%d-%H%M%S}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(result, ensure_ascii=False, indent=2))
+    print(f"saved: {output}")
+    broken = violations(result)
+    if broken:
+        raise SystemExit(f"нарушены инварианты: {', '.join(broken)}")
+
+
+if __name__ == "__main__":
+    main()
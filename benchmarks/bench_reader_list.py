@@ -0,0 +1,144 @@
+""" Бенчмарк списка читателей (GET /readers/) на большой базе.
+
+Создает `--readers` читателей по `--loans` выдач у каждого (по умолчанию 1M и 10M выдач),
+у `--with-loans` доли читателей от 1 до 3 книг на руках. Сравнивает запросы DB_GetReaderList
+(полусоединение EXISTS / NOT EXISTS, порядок (name, id)) с прежним JOIN borrowed_books
+для фильтра "только с книгами" и страницы по OFFSET с keyset-страницами на той же глубине.
+Печатает медиану времени страницы по `--repeat` запускам. Созданные данные удаляются.
+
+Запуск (на отдельной базе, настройки подключения те же, что у приложения; генерация 10M строк - минуты):
+python -m benchmarks.bench_reader_list --readers 1000000 --loans 10 --depth 100000
+python -m benchmarks.bench_reader_list --readers 10000 --loans 10 --depth 5000
+"""
+import argparse
+import asyncio
+import statistics
+import time
+import uuid
+
+from sqlalchemy import select, text, bindparam, Integer, delete
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncEngine, AsyncConnection
+
+from src.core.infrastructures import database
+from src.core.schemas import readers, borrowed_books, books
+from src.services.books.dto.input import HasBorrowings
+from src.services.readers.repository import DB_GetReaderList
+
+LEGACY_ONLY_WITH = (
+    select(readers.c.id, readers.c.name, readers.c.email)
+    .join(borrowed_books, borrowed_books.c.reader_id == readers.c.id)
+    .where(borrowed_books.c.return_date.is_(None))
+    .offset(bindparam("skip", type_=Integer))
+    .limit(bindparam("limit", type_=Integer))
+)  # как было до полусоединения: читатель повторяется по числу книг на руках, порядок не задан
+
+
+async def setup(engine: AsyncEngine, readers_count: int, loans: int, with_loans: float) -> str:
+    run = uuid.uuid4().hex[:8]
+    async with engine.begin() as connection:
+        await connection.execute(
+            text("""
+                INSERT INTO books (title, author, quantity)
+                SELECT format('bench %s %s', CAST(:run AS text), n), 'bench', 0
+                FROM generate_series(1, 1000) AS n
+            """),
+            {"run": run}
+        )
+        await connection.execute(
+            text("""
+                INSERT INTO readers (name, email, open_loans)
+                SELECT
+                    format('bench %s', md5(n::text)),
+                    format('bench-%s-%s@bench.local', CAST(:run AS text), n),
+                    CASE WHEN random() < CAST(:with_loans AS float) THEN 1 + n % 3 ELSE 0 END
+                FROM generate_series(1, CAST(:readers AS integer)) AS n
+            """),
+            {"run": run, "readers": readers_count, "with_loans": with_loans}
+        )  # имена повторяются редко, порядок (name, id) не совпадает с порядком id
+        await connection.execute(
+            text("""
+                INSERT INTO borrowed_books (book_id, reader_id, borrow_date, return_date)
+                SELECT
+                    book_ids[1 + (readers.id + k) % cardinality(book_ids)],
+                    readers.id,
+                    localtimestamp - make_interval(days => 30 * (k + 1)),
+                    CASE WHEN k < readers.open_loans THEN NULL ELSE localtimestamp - make_interval(days => 30 * k) END
+                FROM readers
+                CROSS JOIN generate_series(0, CAST(:loans AS integer) - 1) AS k
+                CROSS JOIN (
+                    SELECT array_agg(id) AS book_ids
+                    FROM books
+                    WHERE title LIKE format('bench %s %%', CAST(:run AS text))
+                ) AS bench_books
+                WHERE readers.email LIKE format('bench-%s-%%', CAST(:run AS text))
+            """),
+            {"run": run, "loans": loans}
+        )  # последние open_loans выдач каждого читателя не возвращены, счетчик readers.open_loans сходится
+    async with engine.connect() as connection:
+        await connection.execution_options(isolation_level="AUTOCOMMIT")
+        await connection.exec_driver_sql("ANALYZE readers, borrowed_books, books")
+    return run
+
+
+async def teardown(engine: AsyncEngine, run: str):
+    bench_readers = select(readers.c.id).where(readers.c.email.like(f"bench-{run}-%"))
+    async with engine.begin() as connection:
+        await connection.execute(delete(borrowed_books).where(borrowed_books.c.reader_id.in_(bench_readers)))
+        await connection.execute(delete(readers).where(readers.c.id.in_(bench_readers)))
+        await connection.execute(delete(books).where(books.c.title.like(f"bench {run} %")))
+
+
+async def measure(connection: AsyncConnection, stmt, parameters: dict, repeat: int) -> tuple[float, list]:
+    """ Медиана времени страницы, мс, и сама страница """
+    timings, rows = [], []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        rows = (await connection.execute(stmt, parameters)).fetchall()
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings), rows
+
+
+async def main(arguments: argparse.Namespace):
+    engine = create_async_engine(database().url)
+    run = await setup(engine, arguments.readers, arguments.loans, arguments.with_loans)
+    limit, depth = arguments.limit, arguments.depth
+    try:
+        print(f"readers: {arguments.readers}, loans: {arguments.readers * arguments.loans}, "
+              f"page: {limit}, depth: {depth}")
+        print(f"{'query':<48}{'p50, ms':>10}{'rows':>7}{'unique':>8}")
+        async with engine.connect() as connection:
+            cases = [
+                ("JOIN (прежний), only with, offset 0", LEGACY_ONLY_WITH, {"skip": 0, "limit": limit}),
+                (f"JOIN (прежний), only with, offset {depth}", LEGACY_ONLY_WITH, {"skip": depth, "limit": limit}),
+            ]
+            for borrowings in (None, *HasBorrowings):
+                name = borrowings.name if borrowings else "all"
+                offset_stmt = DB_GetReaderList._stmts[borrowings, False]
+                cases.append((f"EXISTS, {name}, offset 0", offset_stmt, {"skip": 0, "limit": limit}))
+                cases.append((f"EXISTS, {name}, offset {depth}", offset_stmt, {"skip": depth, "limit": limit}))
+                last = (await connection.execute(offset_stmt, {"skip": depth - 1, "limit": 1})).fetchone()
+                if last is not None:
+                    cases.append((
+                        f"EXISTS, {name}, keyset after {depth}",
+                        DB_GetReaderList._stmts[borrowings, True],
+                        {"after_name": last.name, "after_id": last.id, "limit": limit}
+                    ))
+            for title, stmt, parameters in cases:
+                elapsed, rows = await measure(connection, stmt, parameters, arguments.repeat)
+                print(f"{title:<48}{elapsed:>10.2f}{len(rows):>7}{len({row.id for row in rows}):>8}")
+            await connection.rollback()
+    finally:
+        await teardown(engine, run)
+        await engine.dispose()
+        await database.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--readers", type=int, default=1_000_000)
+    parser.add_argument("--loans", type=int, default=10, help="выдач на читателя")
+    parser.add_argument("--with-loans", type=float, default=0.3, help="доля читателей с книгами на руках")
+    parser.add_argument("--limit", type=int, default=50, help="размер страницы")
+    parser.add_argument("--depth", type=int, default=100_000, help="глубина дальней страницы")
+    parser.add_argument("--repeat", type=int, default=5)
+    asyncio.run(main(parser.parse_args()))
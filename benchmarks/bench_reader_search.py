@@ -0,0 +1,112 @@
+""" Бенчмарк поиска читателей для подсказок при вводе (GET /readers/search).
+
+Создает `--readers` читателей (по умолчанию 1M) и выполняет `--queries` запросов DB_SearchReaders
+каждого вида: начала email и начала слов имени случайной длины, как их набирают у стойки,
+и части из середины слова от 3 символов. Печатает p50 / p99 / максимум времени запроса по видам.
+Цель - p99 до 10 мс для начал. Часть из середины слова - запасная ступень без этой цели: первичный ключ
+ищет ее совпадения по оценке частоты подстроки, и при завышенной оценке читает сотни тысяч строк
+(на 1M читателей p99 около 80 мс). Созданные данные удаляются.
+
+Запуск (на отдельной базе, настройки подключения те же, что у приложения):
+python -m benchmarks.bench_reader_search --readers 1000000 --queries 2000
+"""
+import argparse
+import asyncio
+import random
+import time
+import uuid
+
+from sqlalchemy import select, text, delete, func
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncEngine
+
+from src.core.infrastructures import database
+from src.core.schemas import readers
+from src.services.readers.repository import DB_SearchReaders
+
+NAMES = ("anna", "boris", "viktor", "galina", "dmitry", "elena", "igor", "kirill", "lidia", "maria",
+         "nikolai", "olga", "pavel", "roman", "svetlana", "tatiana", "fedor", "yuri")
+SYLLABLES = ("ba", "vo", "gri", "de", "zu", "ka", "lo", "mi", "no", "pe", "ro", "sa", "ti", "fu", "che",
+             "sha", "ya", "ko", "ve", "ly")  # фамилии из трех слогов: 8000 вариантов
+
+
+async def setup(engine: AsyncEngine, readers_count: int) -> tuple[str, list[tuple[str, str]]]:
+    run = uuid.uuid4().hex[:8]
+    async with engine.begin() as connection:
+        await connection.execute(
+            text("""
+                INSERT INTO readers (name, email)
+                SELECT
+                    names[1 + n % cardinality(names)] || ' ' || initcap(
+                        syllables[1 + get_byte(hash, 0) % 20] || syllables[1 + get_byte(hash, 1) % 20]
+                        || syllables[1 + get_byte(hash, 2) % 20] || 'ov'
+                    ),
+                    format('%s.%s@bench-%s.org', substr(md5((n * 7)::text), 1, 6), n, CAST(:run AS text))
+                FROM generate_series(1, CAST(:readers AS integer)) AS n
+                CROSS JOIN LATERAL decode(md5(n::text), 'hex') AS hash  -- фамилия не зависит от порядка вставки
+                CROSS JOIN (SELECT CAST(:names AS text[]) AS names, CAST(:syllables AS text[]) AS syllables) AS bench
+            """),
+            {"run": run, "readers": readers_count, "names": list(NAMES), "syllables": list(SYLLABLES)}
+        )
+        sample = (await connection.execute(
+            select(readers.c.name, readers.c.email)
+            .where(readers.c.email.like(f"%@bench-{run}.org"))
+            .order_by(func.random())
+            .limit(1000)
+        )).fetchall()
+    async with engine.connect() as connection:
+        await connection.execution_options(isolation_level="AUTOCOMMIT")
+        await connection.exec_driver_sql("VACUUM ANALYZE readers")  # как после автоочистки, а не сразу после вставки
+    return run, [(row.name, row.email) for row in sample]
+
+
+async def teardown(engine: AsyncEngine, run: str):
+    async with engine.begin() as connection:
+        await connection.execute(delete(readers).where(readers.c.email.like(f"%@bench-{run}.org")))
+
+
+def typed_start(name: str, email: str) -> str:
+    """ Что успели набрать: начало email или начало одного из слов имени """
+    if random.random() < 0.5:
+        return email[:random.randint(1, 8)]
+    word = random.choice(name.split())
+    return word[:random.randint(1, len(word))]
+
+
+def typed_middle(name: str, email: str) -> str:
+    """ Кусок имени не с начала слова """
+    start = random.choice([index for index in range(1, len(name) - 2) if name[index - 1] != " "])
+    return name[start:start + random.randint(3, 8)]
+
+
+def percentiles(timings: list[float]) -> str:
+    timings = sorted(timings)
+    return (f"p50: {timings[len(timings) // 2]:.2f} ms, p99: {timings[int(len(timings) * 0.99)]:.2f} ms, "
+            f"max: {timings[-1]:.2f} ms")
+
+
+async def main(arguments: argparse.Namespace):
+    engine = create_async_engine(database().url)
+    run, sample = await setup(engine, arguments.readers)
+    search = DB_SearchReaders()
+    try:
+        print(f"readers: {arguments.readers}, queries: {arguments.queries}, limit: {arguments.limit}")
+        for kind, typed in (("starts", typed_start), ("middles", typed_middle)):
+            timings, found = [], 0
+            for _ in range(arguments.queries):
+                query = typed(*random.choice(sample))
+                started = time.perf_counter()
+                found += len(await search(query, arguments.limit))
+                timings.append((time.perf_counter() - started) * 1000)
+            print(f"{kind}: {percentiles(timings)}, found per query: {found / arguments.queries:.1f}")
+    finally:
+        await teardown(engine, run)
+        await engine.dispose()
+        await database.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--readers", type=int, default=1_000_000)
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--limit", type=int, default=10)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,54 @@
+""" Микробенчмарк подготовки запросов репозиториев.
+
+Сравнивает накладные расходы одного вызова без обращения к БД:
+сборка конструкции заново (как было до переноса `_stmt` в атрибуты класса)
+против готовой конструкции с параметрами. В обоих случаях запрос проходит тот же путь,
+что и в `connection.execute`: вычисление ключа кэша и поиск в кэше скомпилированных запросов.
+
+Запуск: python -m benchmarks.bench_statements
+"""
+import timeit
+
+from sqlalchemy.dialects.postgresql.psycopg import PGDialect_psycopg
+from sqlalchemy.util import LRUCache
+
+from src.services.books.repository import DB_GetBookList, _book_list_page, DB_SearchBooks, _book_search_page
+from src.services.borrowed_books.repository import DB_GiveOutBook, _give_out, DB_GetBorrowList
+from src.services.readers.repository import DB_GetReaderList, _reader_list
+
+NUMBER = 5_000
+
+dialect = PGDialect_psycopg()
+
+
+def prepare(stmt, compiled_cache: LRUCache):
+    """ То, что делает Connection перед отправкой запроса драйверу """
+    return stmt._compile_w_cache(dialect=dialect, compiled_cache=compiled_cache, column_keys=[])
+
+
+CASES = {
+    "DB_GetBookList": (
+        lambda: _book_list_page().offset(0),
+        DB_GetBookList._stmt
+    ),
+    "DB_SearchBooks": (lambda: _book_search_page()[1], DB_SearchBooks._stmt),
+    "DB_GiveOutBook": (_give_out, DB_GiveOutBook._stmt),
+    "DB_GetBorrowList": (
+        lambda: DB_GetBorrowList._stmt.__wrapped__(True, False, False, False, True, True),
+        DB_GetBorrowList._stmt(True, False, False, False, True, True)
+    ),
+    "DB_GetReaderList": (lambda: _reader_list(None, False), DB_GetReaderList._stmts[None, False]),
+}
+
+
+def main():
+    print(f"{'statement':<24}{'rebuilt, us':>14}{'prebuilt, us':>14}{'speedup':>10}")
+    for name, (build, prebuilt) in CASES.items():
+        compiled_cache = LRUCache(100)
+        rebuilt = timeit.timeit(lambda: prepare(build(), compiled_cache), number=NUMBER) / NUMBER * 1e6
+        ready = timeit.timeit(lambda: prepare(prebuilt, compiled_cache), number=NUMBER) / NUMBER * 1e6
+        print(f"{name:<24}{rebuilt:>14.1f}{ready:>14.1f}{rebuilt / ready:>9.0f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -5,9 +5,12 @@ from starlette.middleware.cors import CORSMiddleware
 
 from src.core.dependencies import D
 from src.core.infrastructures import Database
+from src.core.pagination import NEXT_CURSOR_HEADER
+from src.core.streaming import WATERMARK_HEADER
 from src.services.books.routes import book_router
 from src.services.borrowed_books.routes import borrowed_book_router
 from src.services.librarians.routes import librarian_router
+from src.services.metrics.routes import metrics_router
 from src.services.readers.routes import readers_router
 from src.services.security.routes import security_router
 
@@ -31,6 +34,7 @@ app.add_middleware(
     allow_credentials=False,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER, WATERMARK_HEADER, "ETag", "Last-Modified"],
 )
 
 app.include_router(security_router)
@@ -38,3 +42,4 @@ app.include_router(librarian_router)
 app.include_router(book_router)
 app.include_router(readers_router)
 app.include_router(borrowed_book_router)
+app.include_router(metrics_router)
@@ -0,0 +1,59 @@
+import datetime
+import hashlib
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Callable, Mapping
+
+from pydantic import BaseModel
+from starlette import status
+from starlette.requests import Request
+from starlette.responses import Response
+
+
+class Representation(BaseModel):
+    """ Готовое к отдаче JSON тело с валидаторами для условных запросов """
+    body: str
+    etag: str
+    last_modified: datetime.datetime | None = None
+
+
+def content_etag(*parts) -> str:
+    """ Сильный ETag по содержимому (одинаковый у всех воркеров, в отличие от hash()) """
+    return f'"{hashlib.blake2b(repr(parts).encode(), digest_size=16).hexdigest()}"'
+
+
+def _opaque(tag: str) -> str:
+    return tag.strip().removeprefix("W/")
+
+
+def _not_modified(request: Request, etag: str, last_modified: datetime.datetime | None) -> bool:
+    """ If-None-Match приоритетнее If-Modified-Since (RFC 9110, 13.2.2) """
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = {_opaque(tag) for tag in if_none_match.split(",")}
+        return "*" in tags or _opaque(etag) in tags
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since is None or last_modified is None:
+        return False
+    try:
+        since = parsedate_to_datetime(if_modified_since)
+    except (TypeError, ValueError):
+        return False
+    if since.tzinfo is None:  # зона "-0000" (RFC 5322) дает наивное время, а HTTP-даты всегда в UTC
+        since = since.replace(tzinfo=datetime.timezone.utc)
+    return last_modified.replace(microsecond=0) <= since
+
+
+def conditional_response(
+        request: Request,
+        etag: str,
+        render: Callable[[], str | bytes],
+        last_modified: datetime.datetime | None = None,
+        headers: Mapping[str, str] | None = None
+) -> Response:
+    """ Отвечает 304 без тела, если у клиента актуальная версия, иначе отрисовывает JSON через `render` """
+    headers = {**(headers or {}), "ETag": etag}
+    if last_modified is not None:
+        headers["Last-Modified"] = format_datetime(last_modified.astimezone(datetime.timezone.utc), usegmt=True)
+    if _not_modified(request, etag, last_modified):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(content=render(), media_type="application/json", headers=headers)
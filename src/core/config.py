@@ -18,10 +18,21 @@ class Settings(BaseSettings):
     DB_SOCKET: str = "localhost"
     DB_LOGS: bool = True
 
+    # cache
+    CACHE_BACKEND: str = "memory"  # memory - в процессе, redis - общий для всех воркеров
+    CACHE_URL: str = "redis://localhost:6379/0"
+    CACHE_MAX_SIZE: int = 10_000
+    CACHE_TTL_SECONDS: int = 60
+
+    # password hashing (bcrypt в отдельных потоках, чтобы не блокировать event loop)
+    PASSWORD_POOL_WORKERS: int = 2
+    PASSWORD_POOL_QUEUE: int = 32  # сколько вызовов ждут свободный поток, сверх этого - 503
+
     # token config
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 60
     REFRESH_TOKEN_EXPIRE_HOURS: int = 24 * 15
     TOKEN_SECRET_KEY: str = "abracadabra"
+    TOKEN_CACHE_MAX_SIZE: int = 10_000  # проверенных токенов в памяти воркера
 
 
 settings = Settings()
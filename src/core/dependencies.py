@@ -1,4 +1,4 @@
-from src.core.infrastructures import Database, database
+from src.core.infrastructures import Database, database, Cache, cache
 
 
 class D:
@@ -6,3 +6,6 @@ class D:
     def database() -> Database:
         return database
 
+    @staticmethod
+    def cache() -> Cache:
+        return cache
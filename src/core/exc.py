@@ -38,3 +38,34 @@ class AlreadyExists(ClientError):
 
 class NoDataToUpdate(ClientError):
     ...
+
+
+class InvalidCursor(ClientError):
+    def __init__(self):
+        super().__init__(detail="Неверный курсор пагинации")
+
+
+class UnsupportedMediaType(HTTPException):
+    def __init__(self, media_type: str):
+        super().__init__(
+            status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+            detail=f"Формат {media_type or '(не указан)'} не поддерживается"
+        )
+
+
+class DatabaseBusy(HTTPException):
+    def __init__(self):
+        super().__init__(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="База данных занята параллельными запросами, повторите позже",
+            headers={"Retry-After": "1"}
+        )
+
+
+class PoolBusy(HTTPException):
+    def __init__(self):
+        super().__init__(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Сервер перегружен, повторите попытку позже",
+            headers={"Retry-After": "1"}
+        )
@@ -1,5 +1,5 @@
-from src.core.infrastructures.postgresql import Database
-
+from src.core.infrastructures.cache import Cache, create_cache
 from src.core.infrastructures.postgresql import Database
 
 database = Database()
+cache = create_cache()
@@ -0,0 +1,189 @@
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Callable
+
+from loguru import logger
+
+from src.core.config import settings
+from src.core.metrics import metrics
+
+
+GENERATION_TTL = 24 * 60 * 60  # с, поколение ключа в Redis живет намного дольше любого чтения из базы
+
+
+class LRUStore:
+    """ Ограниченный по размеру словарь с вытеснением давно не используемых записей
+    и сроком жизни у каждой записи. Не потокобезопасен - рассчитан на один event loop """
+
+    def __init__(self, max_size: int, clock: Callable[[], float] = time.monotonic):
+        self._max_size = max_size
+        self._clock = clock
+        self._data: OrderedDict[str, tuple[float, Any]] = OrderedDict()
+
+    def get(self, key: str) -> Any | None:
+        item = self._data.get(key)
+        if item is None:
+            return None
+        expires_at, value = item
+        if expires_at <= self._clock():
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: Any, expires_at: float) -> int:
+        """ Возвращает количество вытесненных записей """
+        self._data[key] = (expires_at, value)
+        self._data.move_to_end(key)
+        evicted = 0
+        while len(self._data) > self._max_size:
+            self._data.popitem(last=False)
+            evicted += 1
+        return evicted
+
+    def delete(self, key: str):
+        self._data.pop(key, None)
+
+    def __len__(self):
+        return len(self._data)
+
+
+class Cache(ABC):
+    """ Кэш сериализованных ответов.
+    Чтение с заполнением (read-through) защищено поколением ключа: оно берется до чтения из базы
+    и передается в set, а каждый delete его меняет. Если между чтением из базы и set ключ сбросили,
+    set ничего не пишет - прочитанное значение могло устареть, а TTL продержал бы его в кэше до конца срока """
+
+    @abstractmethod
+    async def get(self, key: str) -> str | None: ...
+
+    @abstractmethod
+    async def generation(self, key: str) -> str: ...
+
+    @abstractmethod
+    async def set(self, key: str, value: str, generation: str | None = None): ...
+
+    @abstractmethod
+    async def delete(self, *keys: str): ...
+
+
+class MemoryCache(Cache):
+    """ Кэш в памяти процесса. Инвалидация видна только этому процессу,
+    при нескольких воркерах остальные увидят изменения по истечении TTL """
+
+    def __init__(self, max_size: int, ttl: int):
+        self._ttl = ttl
+        self._store = LRUStore(max_size)
+        # поколения сброшенных ключей - значения общего счетчика сбросов, хранятся последние max_size ключей;
+        # ключ без записи получает поколение последнего вытесненного (_floor), так вытеснение не выглядит как
+        # "сбросов не было"
+        self._max_size = max_size
+        self._generations: OrderedDict[str, int] = OrderedDict()
+        self._invalidations = 0
+        self._floor = 0
+        metrics.gauge("cache.size", lambda: len(self._store))
+
+    async def get(self, key: str) -> str | None:
+        value = self._store.get(key)
+        metrics.inc("cache.hits" if value is not None else "cache.misses")
+        return value
+
+    async def generation(self, key: str) -> str:
+        return str(self._generations.get(key, self._floor))
+
+    async def set(self, key: str, value: str, generation: str | None = None):
+        if generation is not None and generation != await self.generation(key):
+            metrics.inc("cache.stale_writes")
+            return
+        evicted = self._store.set(key, value, time.monotonic() + self._ttl)
+        if evicted:
+            metrics.inc("cache.evictions", evicted)
+
+    async def delete(self, *keys: str):
+        for key in keys:
+            self._store.delete(key)
+            self._invalidations += 1
+            self._generations[key] = self._invalidations
+            self._generations.move_to_end(key)
+        while len(self._generations) > self._max_size:
+            _, self._floor = self._generations.popitem(last=False)
+
+
+class RedisCache(Cache):
+    """ Общий для всех воркеров кэш в Redis (нужен пакет `redis`).
+    Недоступность Redis не ломает запросы - они идут в базу """
+
+    def __init__(self, url: str, ttl: int):
+        try:
+            from redis import asyncio as redis
+        except ImportError:
+            raise RuntimeError("Для CACHE_BACKEND=redis установите пакет redis")
+        self._error = redis.RedisError
+        self._watch_error = redis.WatchError
+        self._ttl = ttl
+        self._client = redis.from_url(url, decode_responses=True)
+
+    @staticmethod
+    def _generation_key(key: str) -> str:
+        return f"{key}:generation"
+
+    async def get(self, key: str) -> str | None:
+        try:
+            value = await self._client.get(key)
+        except self._error as e:
+            logger.warning(f"Кэш недоступен: {e}")
+            metrics.inc("cache.errors")
+            return None
+        metrics.inc("cache.hits" if value is not None else "cache.misses")
+        return value
+
+    async def generation(self, key: str) -> str:
+        try:
+            return await self._client.get(self._generation_key(key)) or "0"
+        except self._error as e:
+            logger.warning(f"Кэш недоступен: {e}")
+            metrics.inc("cache.errors")
+            return ""  # не совпадет ни с одним поколением, set ничего не запишет
+
+    async def set(self, key: str, value: str, generation: str | None = None):
+        try:
+            if generation is None:
+                await self._client.set(key, value, ex=self._ttl)
+                return
+            async with self._client.pipeline(transaction=True) as pipe:
+                # WATCH: если delete поменяет поколение до EXEC, транзакция не выполнится
+                await pipe.watch(self._generation_key(key))
+                if (await pipe.get(self._generation_key(key)) or "0") != generation:
+                    metrics.inc("cache.stale_writes")
+                    return
+                pipe.multi()
+                pipe.set(key, value, ex=self._ttl)
+                await pipe.execute()
+        except self._watch_error:
+            metrics.inc("cache.stale_writes")
+        except self._error as e:
+            logger.warning(f"Кэш недоступен: {e}")
+            metrics.inc("cache.errors")
+
+    async def delete(self, *keys: str):
+        if not keys:
+            return
+        try:
+            async with self._client.pipeline(transaction=True) as pipe:
+                pipe.delete(*keys)
+                for key in keys:
+                    pipe.incr(self._generation_key(key))
+                    pipe.expire(self._generation_key(key), GENERATION_TTL)
+                await pipe.execute()
+        except self._error as e:
+            logger.warning(f"Кэш недоступен: {e}")
+            metrics.inc("cache.errors")
+
+
+def create_cache() -> Cache:
+    match settings.CACHE_BACKEND:
+        case "redis":
+            return RedisCache(settings.CACHE_URL, settings.CACHE_TTL_SECONDS)
+        case _:
+            return MemoryCache(settings.CACHE_MAX_SIZE, settings.CACHE_TTL_SECONDS)
@@ -1,7 +1,23 @@
-from sqlalchemy import MetaData
+from sqlalchemy import MetaData, event
+from sqlalchemy.engine.default import CacheStats
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncEngine
 
 from src.core.config import settings
+from src.core.metrics import metrics
+from src.core.transactions import set_lock_timeout
+
+_COMPILED_CACHE_COUNTERS = {
+    CacheStats.CACHE_HIT: "sql.compiled_cache.hits",
+    CacheStats.CACHE_MISS: "sql.compiled_cache.misses",
+    CacheStats.NO_CACHE_KEY: "sql.compiled_cache.uncacheable",
+}
+
+
+def _count_compilation(connection, cursor, statement, parameters, context, executemany):
+    """ Учитывает, взят ли скомпилированный запрос из кэша движка или собран заново """
+    counter = _COMPILED_CACHE_COUNTERS.get(context.cache_hit)
+    if counter is not None:
+        metrics.inc(counter)
 
 
 class Database:
@@ -13,6 +29,9 @@ class Database:
         self.engine = create_async_engine(
             f"postgresql+psycopg://{self.__user}:{self.__password}@{self.__socket}/{self.__dbname}",
             echo=True if settings.DB_LOGS else False)
+        event.listen(self.engine.sync_engine, "after_cursor_execute", _count_compilation)
+        event.listen(self.engine.sync_engine, "begin", set_lock_timeout)
+        metrics.gauge("sql.compiled_cache.size", lambda: len(self.engine.sync_engine._compiled_cache))
 
     async def init(self, metadata: MetaData):
         async with self.engine.connect() as connection:
@@ -1,10 +1,14 @@
 import asyncio
 from abc import ABC, abstractmethod
+from typing import AsyncIterator, Sequence, Any
 
 from pydantic import BaseModel
+from sqlalchemy import Executable, RowMapping, select, func, cast, String
 from sqlalchemy.ext.asyncio import AsyncEngine
 
 from src.core.dependencies import D
+from src.core.infrastructures import Cache
+from src.core.transactions import TransactionPolicy, DEFAULT_POLICY, policy_engine, retry
 from src.core.utils import catch
 
 
@@ -28,16 +32,39 @@ class BaseService:
 class FailedConnectionDBMeta(type):
     def __new__(cls, name, bases, namespace):
         if "__call__" in namespace:
-            namespace["__call__"] = catch(namespace["__call__"])
+            namespace["__call__"] = catch(retry(namespace["__call__"]))
         return super().__new__(cls, name, bases, namespace)
 
 
 class BaseSQLRepository(BaseRepository, metaclass=FailedConnectionDBMeta):
+    transaction: TransactionPolicy = DEFAULT_POLICY  # изоляция, lock_timeout и повторы при конкурентных ошибках
+
     def __init__(self):
         super().__init__()
-        self.engine: AsyncEngine = D.database()()
+        self.engine: AsyncEngine = policy_engine(D.database()(), self.transaction)
+        self.cache: Cache = D.cache()
 
     @abstractmethod
     @catch
     async def __call__(self, *args, **kwargs):
         pass
+
+    async def _watermark(self) -> int:
+        """ Отметка для инкрементальной выгрузки по change_xid: xmin текущего снимка.
+        Все транзакции с номером меньше отметки уже завершены, поэтому запрос, начатый после нее, видит их все,
+        а следующая выгрузка с change_xid >= отметки подберет то, что было не закоммичено """
+        async with self.engine.connect() as connection:
+            return int(await connection.scalar(select(cast(func.pg_snapshot_xmin(func.pg_current_snapshot()), String))))
+
+    async def _stream(
+            self,
+            stmt: Executable,
+            parameters: dict[str, Any] | None = None,
+            partition_size: int = 1000
+    ) -> AsyncIterator[Sequence[RowMapping]]:
+        """ Читает результат серверным курсором пачками, память не зависит от размера таблицы.
+        Соединение занято, пока итератор не дочитан """
+        async with self.engine.connect() as connection:
+            result = await connection.stream(stmt, parameters, execution_options={"yield_per": partition_size})
+            async for partition in result.mappings().partitions():
+                yield partition
@@ -0,0 +1,25 @@
+from collections import defaultdict
+from typing import Callable
+
+
+class Metrics:
+    """ Счетчики и датчики процесса для `GET /metrics/`.
+    Счетчики только растут, датчики вычисляются в момент снятия показаний """
+
+    def __init__(self):
+        self._counters: dict[str, int] = defaultdict(int)
+        self._gauges: dict[str, Callable[[], float]] = {}
+
+    def inc(self, name: str, value: int = 1):
+        self._counters[name] += value
+
+    def gauge(self, name: str, getter: Callable[[], float]):
+        self._gauges[name] = getter
+
+    def snapshot(self) -> dict[str, float]:
+        result: dict[str, float] = dict(self._counters)
+        result.update({name: getter() for name, getter in self._gauges.items()})
+        return dict(sorted(result.items()))
+
+
+metrics = Metrics()
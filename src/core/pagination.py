@@ -0,0 +1,41 @@
+import base64
+from functools import lru_cache
+from typing import Any, Callable, Sequence
+
+from pydantic import TypeAdapter, ValidationError
+from pydantic_core import to_json
+from starlette.responses import Response
+
+from src.core.exc import InvalidCursor
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+@lru_cache
+def _adapter(key_type: Any) -> TypeAdapter:
+    return TypeAdapter(key_type)
+
+
+class Cursor:
+    """ Непрозрачный курсор keyset-пагинации.
+    Хранит ключ сортировки последней записи страницы (base64 от JSON),
+    следующая страница начинается строго после него без OFFSET """
+
+    @staticmethod
+    def encode(*values: Any) -> str:
+        return base64.urlsafe_b64encode(to_json(values)).decode().rstrip("=")
+
+    @staticmethod
+    def decode(token: str, key_type: Any) -> tuple:
+        try:
+            raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+            return _adapter(key_type).validate_json(raw)
+        except (ValueError, ValidationError):
+            raise InvalidCursor
+
+
+def paginate(response: Response, items: Sequence, limit: int, key: Callable[[Any], tuple]) -> Sequence:
+    """ Кладет курсор следующей страницы в заголовок ответа, если страница заполнена целиком """
+    if limit > 0 and len(items) == limit:
+        response.headers[NEXT_CURSOR_HEADER] = Cursor.encode(*key(items[-1]))
+    return items
@@ -1,9 +1,20 @@
 import datetime
 
-from sqlalchemy import MetaData, Table, Column, Integer, String, ForeignKey, DateTime, Index
+from sqlalchemy import MetaData, Table, Column, Integer, String, ForeignKey, DateTime, Index, FetchedValue, \
+    func, event, DDL, CheckConstraint
+from sqlalchemy.dialects.postgresql import TSVECTOR
+from sqlalchemy.types import UserDefinedType
 
 metadata = MetaData()
 
+
+class XID8(UserDefinedType):
+    """ Номер транзакции PostgreSQL с эпохой (xid8), монотонный и без переполнения """
+    cache_ok = True
+
+    def get_col_spec(self, **kw):
+        return "XID8"
+
 librarians = Table(
     "librarians",
     metadata,
@@ -21,7 +32,29 @@ books = Table(
     Column("author", String(100), nullable=False),
     Column("isbn", String, nullable=True),
     Column("year", Integer, nullable=True),
-    Column("quantity", Integer, nullable=False, default=1)
+    Column("quantity", Integer, nullable=False, default=1),  # для книг со слотами - сколько экземпляров всего
+    Column("stock_slots", Integer, nullable=False, server_default="0"),  # 0 - остаток в quantity, N - в book_stock
+    Column(
+        "search_vector",
+        TSVECTOR,
+        nullable=True,
+        server_default=FetchedValue(),
+        server_onupdate=FetchedValue()
+    ),  # полнотекстовый поиск по title (A), author (B), description (C), заполняет триггер books_search_vector
+    Column(
+        "updated_at",
+        DateTime(timezone=True),
+        nullable=False,
+        server_default=func.now(),
+        server_onupdate=FetchedValue()
+    ),  # обновляется триггером books_touch_updated_at
+    Column(
+        "change_xid",
+        XID8,
+        nullable=True,
+        server_default=func.pg_current_xact_id(),
+        server_onupdate=FetchedValue()
+    )  # транзакция последнего изменения (тот же триггер), отметка инкрементальной выгрузки
 )
 
 unique_isbn_idx = Index(
@@ -31,20 +64,178 @@ unique_isbn_idx = Index(
     postgresql_where=(books.c.isbn.isnot(None))
 )
 
+book_title_id_idx = Index(
+    "books_title_id_idx",
+    books.c.title,
+    books.c.id,
+    postgresql_include=["author", "year", "quantity"]
+)  # keyset-пагинация каталога, страница читается index-only scan
+
+book_search_vector_idx = Index(
+    "books_search_vector_idx",
+    books.c.search_vector,
+    postgresql_using="gin"
+)
+
+book_title_trgm_idx = Index(
+    "books_title_trgm_idx",
+    books.c.title,
+    postgresql_using="gin",
+    postgresql_ops={"title": "gin_trgm_ops"}
+)  # поиск с опечатками (pg_trgm)
+
+book_author_trgm_idx = Index(
+    "books_author_trgm_idx",
+    books.c.author,
+    postgresql_using="gin",
+    postgresql_ops={"author": "gin_trgm_ops"}
+)
+
+book_stock = Table(
+    "book_stock",
+    metadata,
+    Column("book_id", ForeignKey(books.c.id, ondelete="CASCADE", onupdate="CASCADE"), primary_key=True),
+    Column("slot", Integer, primary_key=True),
+    Column("quantity", Integer, CheckConstraint("quantity >= 0", name="book_stock_quantity_check"), nullable=False),
+    Column(
+        "updated_at",
+        DateTime(timezone=True),
+        nullable=False,
+        server_default=func.now(),
+        server_onupdate=FetchedValue()
+    ),  # обновляется триггером book_stock_touch_updated_at, Last-Modified книги - наибольший из книги и слотов
+    Column(
+        "change_xid",
+        XID8,
+        nullable=True,
+        server_default=func.pg_current_xact_id(),
+        server_onupdate=FetchedValue()
+    )  # тот же триггер; без индекса, чтобы выдачи из слота оставались HOT-обновлениями
+)  # остаток "горячей" книги по слотам: выдачи расходятся по разным строкам, а не ждут одну строку books
+
+book_facets = Table(
+    "book_facets",
+    metadata,
+    Column("facet", String(16), primary_key=True),  # catalog (весь каталог) / author / decade
+    Column("value", String(100), primary_key=True),
+    Column("total", Integer, nullable=False, default=0),  # книг (наименований)
+    Column("available", Integer, nullable=False, default=0)  # из них в наличии
+)  # поддерживается триггерами books_facets_* при каждом изменении books
+# Книги со слотами триггеры считают в наличии по quantity (всего экземпляров), разобранные целиком
+# вычитаются при чтении фасетов: их находит частичный индекс books_stock_slots_idx
+
+book_stock_slots_idx = Index(
+    "books_stock_slots_idx",
+    books.c.id,
+    postgresql_where=books.c.stock_slots > 0
+)  # книги со слотами - малая часть каталога
+
+BORROWED_LIMIT = 3  # сколько книг одновременно может быть на руках у читателя
+
 readers = Table(
     "readers",
     metadata,
     Column("id", Integer, primary_key=True, autoincrement=True),
     Column("name", String(100), nullable=False),
-    Column("email", String(360), unique=True, nullable=False)
+    Column("email", String(360), unique=True, nullable=False),
+    Column("open_loans", Integer, nullable=False, server_default="0"),  # книг на руках, ведут выдача и возврат
+    CheckConstraint(f"open_loans BETWEEN 0 AND {BORROWED_LIMIT}", name="readers_open_loans_check")
 )
 
+readers_name_id_idx = Index(
+    "readers_name_id_idx",
+    readers.c.name,
+    readers.c.id,
+    postgresql_include=["email"]
+)  # keyset-пагинация списка читателей, страница читается index-only scan
+
+readers_email_lower_id_idx = Index(
+    "readers_email_lower_id_idx",
+    func.lower(readers.c.email).collate("C"),
+    readers.c.id,
+    postgresql_include=["name", "email"]
+)  # поиск по началу email без учета регистра: в побайтовом порядке LIKE 'prefix%' - диапазон индекса
+
+readers_name_lower_id_idx = Index(
+    "readers_name_lower_id_idx",
+    func.lower(readers.c.name).collate("C"),
+    readers.c.id,
+    postgresql_include=["name", "email"]
+)  # поиск по началу имени без учета регистра
+
+readers_name_tail_lower_id_idx = Index(
+    "readers_name_tail_lower_id_idx",
+    func.lower(func.substr(readers.c.name, func.strpos(readers.c.name, " ") + 1)).collate("C"),
+    readers.c.id,
+    postgresql_include=["name", "email"]
+)  # поиск по началу второго слова имени: фамилию набирают с начала так же часто, как имя
+
+readers_name_trgm_idx = Index(
+    "readers_name_trgm_idx",
+    readers.c.name,
+    postgresql_using="gin",
+    postgresql_ops={"name": "gin_trgm_ops"},
+    postgresql_with={"fastupdate": "off"}
+)  # поиск по части имени (pg_trgm); без списка ожидания GIN время подсказки не зависит от давности очистки
+
 borrowed_books = Table(
     "borrowed_books",
     metadata,
     Column("id", Integer, primary_key=True, autoincrement=True),
-    Column("book_id", ForeignKey(books.c.id, onupdate="CASCADE", ondelete="CASCADE"), nullable=False),
-    Column("reader_id", ForeignKey(readers.c.id, onupdate="CASCADE", ondelete="CASCADE"), nullable=False),
-    Column("borrow_date", DateTime, nullable=False, default=datetime.datetime.now),
-    Column("return_date", DateTime, nullable=True, default=None)
-)
+    Column("book_id", ForeignKey(books.c.id, onupdate="CASCADE"), nullable=False),
+    Column("reader_id", ForeignKey(readers.c.id, onupdate="CASCADE"), nullable=False),
+    Column("borrow_date", DateTime, primary_key=True, nullable=False, default=datetime.datetime.now),
+    Column("return_date", DateTime, nullable=True, default=None),
+    Column(
+        "updated_at",
+        DateTime(timezone=True),
+        nullable=False,
+        server_default=func.now(),
+        server_onupdate=FetchedValue()
+    ),  # обновляется триггером borrowed_books_touch_updated_at
+    Column(
+        "change_xid",
+        XID8,
+        nullable=True,
+        server_default=func.pg_current_xact_id(),
+        server_onupdate=FetchedValue()
+    ),  # транзакция последнего изменения (тот же триггер), отметка инкрементальной выгрузки
+    postgresql_partition_by="RANGE (borrow_date)"
+)  # годовые секции borrowed_books_yYYYY ведет `python -m src.maintenance`
+
+event.listen(
+    borrowed_books,
+    "after_create",
+    DDL("CREATE TABLE borrowed_books_default PARTITION OF borrowed_books DEFAULT")
+)  # без секций в таблицу нельзя вставить ни строки
+
+book_change_xid_idx = Index("books_change_xid_idx", books.c.change_xid)  # инкрементальная выгрузка
+
+borrowed_book_change_xid_idx = Index("borrowed_books_change_xid_idx", borrowed_books.c.change_xid)
+
+# Открытые выдачи (return_date IS NULL) - малая часть истории, частичные индексы покрывают только их
+borrowed_books_open_reader_book_idx = Index(
+    "borrowed_books_open_reader_book_idx",
+    borrowed_books.c.reader_id,
+    borrowed_books.c.book_id,
+    postgresql_where=borrowed_books.c.return_date.is_(None)
+)  # лимит и повторная выдача читателю, возврат, читатели с долгами и без
+
+borrowed_books_open_book_idx = Index(
+    "borrowed_books_open_book_idx",
+    borrowed_books.c.book_id,
+    postgresql_where=borrowed_books.c.return_date.is_(None)
+)  # есть ли экземпляры книги на руках (удаление книги)
+
+borrowed_books_borrow_date_id_idx = Index(
+    "borrowed_books_borrow_date_id_idx",
+    borrowed_books.c.borrow_date,
+    borrowed_books.c.id
+)  # список выдач, новые сначала: keyset по (borrow_date, id), обратный проход индекса
+
+borrowed_books_reader_borrow_date_id_idx = Index(
+    "borrowed_books_reader_borrow_date_id_idx",
+    borrowed_books.c.reader_id,
+    borrowed_books.c.borrow_date,
+    borrowed_books.c.id
+)  # история выдач читателя: keyset по (borrow_date, id) внутри reader_id
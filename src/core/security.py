@@ -1,6 +1,12 @@
+import asyncio
 import datetime
+import hashlib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, Future
 from datetime import timedelta, timezone
 from enum import Enum, auto
+from typing import Callable, TypeVar
 
 import jwt
 import passlib.context
@@ -9,22 +15,66 @@ from fastapi.security import OAuth2PasswordBearer
 from starlette import status
 
 from src.core import config
-from src.core.exc import ExpiredSignatureError, InvalidTokenError, NotAuthorized
+from src.core.exc import ExpiredSignatureError, InvalidTokenError, NotAuthorized, PoolBusy
+from src.core.infrastructures.cache import LRUStore
+from src.core.metrics import metrics
 from src.core.types import ID, ID
 
 auth_scheme = OAuth2PasswordBearer(tokenUrl="/security/")
 
 
+T = TypeVar("T")
+
+
+class BlockingPool:
+    """ Ограниченный пул потоков для блокирующих вычислений (bcrypt отпускает GIL на время хэширования).
+    Вызовов в работе и в очереди не больше `workers + queue`, следующий получает PoolBusy (503),
+    а не ждет неограниченно. Место освобождается, когда вычисление в потоке закончилось или снято из очереди:
+    отмена ждущей корутины (клиент отключился) поток не останавливает, и место до конца вычисления занято.
+    Пул не привязан к конкретному loop """
+
+    def __init__(self, name: str, workers: int, queue: int):
+        self._workers = workers
+        self._limit = workers + queue
+        self._pending = 0
+        self._lock = threading.Lock()  # место освобождается из потока пула
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=name)
+        self._rejected = f"{name}.rejected"
+        metrics.inc(self._rejected, 0)
+        metrics.gauge(f"{name}.workers", lambda: self._workers)
+        metrics.gauge(f"{name}.busy", lambda: min(self._pending, self._workers))
+        metrics.gauge(f"{name}.queued", lambda: max(self._pending - self._workers, 0))
+
+    async def run(self, func: Callable[..., T], *args) -> T:
+        with self._lock:
+            if self._pending >= self._limit:
+                metrics.inc(self._rejected)
+                raise PoolBusy
+            self._pending += 1
+        try:
+            future = self._executor.submit(func, *args)
+        except BaseException:
+            self._release()
+            raise
+        future.add_done_callback(self._release)
+        return await asyncio.wrap_future(future)  # отмена снимает из очереди еще не начатое вычисление
+
+    def _release(self, future: Future | None = None):
+        with self._lock:
+            self._pending -= 1
+
+
 class PasswordManager:
     _context = passlib.context.CryptContext(schemes=["bcrypt"], deprecated="auto")
+    _pool = BlockingPool("password_pool", config.settings.PASSWORD_POOL_WORKERS, config.settings.PASSWORD_POOL_QUEUE)
 
     @classmethod
-    def hash(cls, password: str) -> str:
-        return cls._context.hash(password)
+    async def hash(cls, password: str) -> str:
+        return await cls._pool.run(cls._context.hash, password)
 
     @classmethod
-    def verify(cls, plain: str, hashed_str: str) -> bool:
-        return cls._context.verify(plain, hashed_str)
+    async def verify(cls, plain: str, hashed_str: str) -> bool:
+        return await cls._pool.run(cls._context.verify, plain, hashed_str)
 
 
 class TokenTypes(Enum):
@@ -37,6 +87,9 @@ class TokenManager:
     _TOKEN_SECRET_KEY = config.settings.TOKEN_SECRET_KEY
     ACCESS_TOKEN_EXPIRE_MINUTES = config.settings.ACCESS_TOKEN_EXPIRE_MINUTES
     REFRESH_TOKEN_EXPIRE_HOURS = config.settings.REFRESH_TOKEN_EXPIRE_HOURS
+    # проверенные токены: sha256 токена -> ID пользователя, запись живет до exp токена (часы time.time, как у exp)
+    _verified = LRUStore(config.settings.TOKEN_CACHE_MAX_SIZE, clock=time.time)
+    _revoked: dict[str, float] = {}  # sha256 отозванного токена -> его exp, после exp токен и так не пройдет
 
     @classmethod
     def create(cls, data: dict, token_type: TokenTypes) -> str:
@@ -55,15 +108,50 @@ class TokenManager:
                 detail="Неудачная аутентификация по вине сервера. Обратитесь в тех. отдел"
             )
 
+    @staticmethod
+    def _digest(token: str) -> str:
+        return hashlib.sha256(token.encode()).hexdigest()
+
     @classmethod
-    def decode(cls, token: str = Depends(auth_scheme)) -> ID:
+    def revoke(cls, token: str):
+        """ Отзывает токен до истечения его срока. Список отозванных хранится в памяти воркера """
+        try:
+            payload: dict = jwt.decode(token, cls._TOKEN_SECRET_KEY, cls._ALGORITHM, options={"verify_sub": False})
+        except jwt.InvalidTokenError:
+            return  # невалидный или истекший токен и так не пройдет проверку
+        now = time.time()
+        for digest in [digest for digest, expires_at in cls._revoked.items() if expires_at <= now]:
+            del cls._revoked[digest]
+        digest = cls._digest(token)
+        cls._revoked[digest] = payload.get("exp", float("inf"))
+        cls._verified.delete(digest)
+
+    @classmethod
+    async def decode(cls, token: str = Depends(auth_scheme)) -> ID:
+        """ Асинхронная, чтобы FastAPI не уводил проверку в пул потоков: повторный токен - поиск в словаре,
+        а кэш и список отозванных трогает только event loop """
+        digest = cls._digest(token)
+        if digest in cls._revoked:
+            raise InvalidTokenError
+        user_id = cls._verified.get(digest)
+        if user_id is not None:
+            metrics.inc("token_cache.hits")
+            return user_id
+        metrics.inc("token_cache.misses")
         try:
             payload: dict = jwt.decode(token, cls._TOKEN_SECRET_KEY, cls._ALGORITHM, options={"verify_sub": False})
             user_id = payload.get("id")
             if user_id is None:
                 raise NotAuthorized(detail="Вы не авторизованы")
-            return ID(user_id)
         except jwt.exceptions.ExpiredSignatureError:
             raise ExpiredSignatureError
         except jwt.InvalidTokenError:
             raise InvalidTokenError
+        if "exp" in payload:  # без exp неизвестно, до какого момента хранить запись
+            evicted = cls._verified.set(digest, ID(user_id), payload["exp"])
+            if evicted:
+                metrics.inc("token_cache.evictions", evicted)
+        return ID(user_id)
+
+
+metrics.gauge("token_cache.size", lambda: len(TokenManager._verified))
@@ -0,0 +1,192 @@
+import codecs
+import csv
+import datetime
+import io
+import json
+from enum import Enum
+from typing import AsyncIterator, Callable, Mapping, Sequence
+
+from pydantic import BaseModel, ValidationError
+
+from src.core.exc import UnsupportedMediaType
+from src.core.types import RowError
+
+CSV_MEDIA_TYPE = "text/csv"
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+JSON_MEDIA_TYPE = "application/json"
+WATERMARK_HEADER = "X-Export-Watermark"  # отметка для `changed_since` следующей инкрементальной выгрузки
+
+
+class ExportFormat(str, Enum):
+    ndjson = "ndjson"
+    csv = "csv"
+
+    @property
+    def media_type(self) -> str:
+        return NDJSON_MEDIA_TYPE if self is ExportFormat.ndjson else CSV_MEDIA_TYPE
+
+
+INVALID_ENCODING = "Невалидная кодировка, ожидается UTF-8"
+
+
+async def _lines(stream: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    """ Режет поток байт на строки не дожидаясь конца тела запроса. BOM в начале потока отбрасывается.
+    Байты, которые не декодируются как UTF-8, сохраняются суррогатами (surrogateescape):
+    кавычки и переводы строк вокруг них читаются как обычно, а запись с ними отклоняется разбором """
+    buffer, first = b"", True
+    async for chunk in stream:
+        buffer += chunk
+        if first:
+            if len(buffer) < len(codecs.BOM_UTF8) and codecs.BOM_UTF8.startswith(buffer):
+                continue  # пока не ясно, BOM ли это
+            buffer, first = buffer.removeprefix(codecs.BOM_UTF8), False
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            yield line.decode(errors="surrogateescape").rstrip("\r")
+    if first:
+        buffer = buffer.removeprefix(codecs.BOM_UTF8)
+    if buffer:
+        yield buffer.decode(errors="surrogateescape").rstrip("\r")
+
+
+def _is_utf8(text: str) -> bool:
+    try:
+        text.encode()
+    except UnicodeEncodeError:
+        return False
+    return True
+
+
+async def _csv_records(stream: AsyncIterator[bytes]) -> AsyncIterator[tuple[int, dict | str]]:
+    """ CSV с заголовком. Запись может занимать несколько строк (перевод строки внутри кавычек),
+    поэтому строки копятся пока количество кавычек нечетное. Пустые поля не передаются.
+    Вместо записи, которую не удалось разобрать, отдается текст ошибки """
+    header, pending, row = None, None, 0
+    async for line in _lines(stream):
+        pending = line if pending is None else f"{pending}\n{line}"
+        if pending.count('"') % 2:
+            continue
+        record, pending = pending, None
+        if not record.strip():
+            continue
+        if header is None:
+            if not _is_utf8(record):  # без заголовка записи не разобрать, ошибка относится ко всему файлу
+                yield 0, f"Заголовок: {INVALID_ENCODING}"
+                return
+            header = [name.strip() for name in next(csv.reader([record]))]
+            continue
+        row += 1
+        if not _is_utf8(record):
+            yield row, INVALID_ENCODING
+            continue
+        values = next(csv.reader([record]))
+        yield row, {name: value for name, value in zip(header, values) if value != ""}
+    if pending is not None:
+        yield row + 1, "Незакрытая кавычка"
+
+
+async def _ndjson_records(stream: AsyncIterator[bytes]) -> AsyncIterator[tuple[int, dict | str]]:
+    row = 0
+    async for line in _lines(stream):
+        if not line.strip():
+            continue
+        row += 1
+        if not _is_utf8(line):
+            yield row, INVALID_ENCODING
+            continue
+        try:
+            yield row, json.loads(line)
+        except json.JSONDecodeError as e:
+            yield row, f"Невалидный JSON: {e.msg}"
+
+
+async def _json_array_records(stream: AsyncIterator[bytes]) -> AsyncIterator[tuple[int, dict | str]]:
+    """ JSON массив объектов. Разбирается целиком после получения тела, для больших файлов - NDJSON """
+    body = b"".join([chunk async for chunk in stream])
+    try:
+        data = json.loads(body.decode("utf-8-sig"))
+    except UnicodeDecodeError:
+        yield 1, INVALID_ENCODING
+        return
+    except json.JSONDecodeError as e:
+        yield 1, f"Невалидный JSON: {e.msg}"
+        return
+    if not isinstance(data, list):
+        yield 1, "Ожидается JSON массив объектов"
+        return
+    for row, record in enumerate(data, start=1):
+        yield row, record if isinstance(record, dict) else "Ожидается JSON объект"
+
+
+_PARSERS: dict[str, Callable[[AsyncIterator[bytes]], AsyncIterator[tuple[int, dict | str]]]] = {
+    CSV_MEDIA_TYPE: _csv_records,
+    NDJSON_MEDIA_TYPE: _ndjson_records,
+    JSON_MEDIA_TYPE: _json_array_records,
+}
+
+
+def read_records(
+        stream: AsyncIterator[bytes],
+        content_type: str,
+        model: type[BaseModel],
+        invalid: list[RowError]
+) -> AsyncIterator[tuple[int, BaseModel]]:
+    """ Потоково разбирает тело запроса (CSV, NDJSON или JSON массив) в модели.
+    Невалидные записи не прерывают загрузку, а складываются в `invalid` """
+    media_type = content_type.split(";")[0].strip().lower()
+    parser = _PARSERS.get(media_type)
+    if parser is None:
+        raise UnsupportedMediaType(media_type)
+
+    async def records():
+        async for row, data in parser(stream):
+            if isinstance(data, str):
+                invalid.append(RowError(row=row, detail=data))
+                continue
+            try:
+                yield row, model.model_validate(data)
+            except ValidationError as e:
+                invalid.append(
+                    RowError(
+                        row=row,
+                        detail="; ".join(f"{'.'.join(map(str, error['loc']))}: {error['msg']}" for error in e.errors())
+                    )
+                )
+
+    return records()
+
+
+def _json_default(value):
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    raise TypeError(f"Тип {type(value).__name__} не сериализуется в JSON")
+
+
+def _csv_value(value):
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    return value
+
+
+async def encode_records(
+        partitions: AsyncIterator[Sequence[Mapping]],
+        export_format: ExportFormat,
+        fields: Sequence[str]
+) -> AsyncIterator[bytes]:
+    """ Кодирует поток пачек записей в NDJSON или CSV (с заголовком), одна пачка - один кусок ответа """
+    if export_format is ExportFormat.csv:
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(fields)
+        yield buffer.getvalue().encode()
+        async for partition in partitions:
+            buffer.seek(0)
+            buffer.truncate()
+            writer.writerows([_csv_value(record[field]) for field in fields] for record in partition)
+            yield buffer.getvalue().encode()
+    else:
+        async for partition in partitions:
+            yield "".join(
+                json.dumps({field: record[field] for field in fields}, default=_json_default, ensure_ascii=False) + "\n"
+                for record in partition
+            ).encode()
@@ -0,0 +1,102 @@
+""" Политика транзакций репозитория: уровень изоляции, lock_timeout и повторы при конкурентных ошибках.
+
+Репозиторий объявляет политику атрибутом класса `transaction`, BaseSQLRepository применяет ее к своему движку,
+а FailedConnectionDBMeta оборачивает `__call__` в повторы. Повторяется вызов целиком (с новой транзакцией),
+поэтому повторы включаются только у репозиториев, которые до фиксации транзакции ничего не делают вне базы.
+"""
+import asyncio
+import random
+from enum import Enum
+from functools import wraps, lru_cache
+from typing import Callable
+
+import psycopg
+import sqlalchemy
+from pydantic import BaseModel, ConfigDict, Field
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from src.core.metrics import metrics
+
+CONTENTION_ERRORS = (
+    psycopg.errors.SerializationFailure,
+    psycopg.errors.DeadlockDetected,
+    psycopg.errors.LockNotAvailable,  # NOWAIT и lock_timeout
+)
+
+
+class StaleSnapshot(Exception):
+    """ Запрос не смог ничего сделать из-за параллельной транзакции, изменения которой не видел его снимок
+    (READ COMMITTED). Ошибка конкуренции, как и ошибки базы выше: вызов повторяется с новой транзакцией """
+
+
+class Isolation(str, Enum):
+    read_committed = "READ COMMITTED"
+    repeatable_read = "REPEATABLE READ"
+    serializable = "SERIALIZABLE"
+
+
+class TransactionPolicy(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
+    isolation: Isolation | None = None  # None - уровень движка (READ COMMITTED)
+    lock_timeout: int | None = Field(None, gt=0)  # мс, None - ждать блокировку сколько угодно
+    retries: int = Field(0, ge=0)  # повторов после первой попытки
+    backoff: float = 0.02  # с, первая пауза, дальше удваивается
+    max_backoff: float = 0.5
+
+    def delay(self, attempt: int) -> float:
+        """ Пауза перед повтором: случайная до удвоенной предыдущей, параллельные вызовы расходятся во времени """
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+
+DEFAULT_POLICY = TransactionPolicy()
+
+
+def is_contention(error: BaseException) -> bool:
+    return isinstance(error, StaleSnapshot) or (
+        isinstance(error, sqlalchemy.exc.OperationalError) and isinstance(error.orig, CONTENTION_ERRORS)
+    )
+
+
+@lru_cache
+def policy_engine(engine: AsyncEngine, policy: TransactionPolicy) -> AsyncEngine:
+    """ Движок с настройками политики. Пул, диалект и кэш запросов общие с исходным движком """
+    options = {}
+    if policy.isolation is not None:
+        options["isolation_level"] = policy.isolation.value
+    if policy.lock_timeout is not None:
+        options["lock_timeout"] = policy.lock_timeout
+    return engine.execution_options(**options) if options else engine
+
+
+def set_lock_timeout(connection: sqlalchemy.Connection):
+    """ Событие begin: lock_timeout из параметров выполнения действует до конца транзакции """
+    lock_timeout = connection.get_execution_options().get("lock_timeout")
+    if lock_timeout is not None:
+        connection.exec_driver_sql(f"SET LOCAL lock_timeout = {int(lock_timeout)}")
+
+
+def retry(func: Callable):
+    """ Повторяет вызов репозитория при конкурентной ошибке базы, пока не кончатся повторы политики """
+
+    @wraps(func)
+    async def wrapper(self, *args, **kwargs):
+        policy: TransactionPolicy = self.transaction
+        name = type(self).__name__
+        attempt = 0
+        while True:
+            try:
+                return await func(self, *args, **kwargs)
+            except (sqlalchemy.exc.OperationalError, StaleSnapshot) as e:
+                if not is_contention(e):
+                    raise
+                metrics.inc(f"sql.contention.{type(getattr(e, 'orig', e)).__name__}")
+                if attempt >= policy.retries:
+                    if policy.retries:
+                        metrics.inc(f"sql.retries_exhausted.{name}")
+                    raise
+                metrics.inc(f"sql.retries.{name}")
+                await asyncio.sleep(policy.delay(attempt))
+                attempt += 1
+
+    return wrapper
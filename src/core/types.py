@@ -5,3 +5,8 @@ ID = int
 
 class IDModel(BaseModel):
     id: ID
+
+
+class RowError(BaseModel):
+    row: int = Field(..., description="Номер записи в загруженном файле")
+    detail: str = Field(..., description="Описание ошибки")
@@ -6,6 +6,8 @@ from fastapi import HTTPException, Depends
 from fastapi.security import OAuth2PasswordRequestForm
 from starlette import status
 
+from src.core.exc import DatabaseBusy
+from src.core.transactions import is_contention, StaleSnapshot
 from src.services.security.dto.input import INPUT_AuthData
 
 
@@ -14,7 +16,11 @@ def catch(func: Callable):
     async def wrapper(*args, **kwargs):
         try:
             return await func(*args, **kwargs)
-        except sqlalchemy.exc.OperationalError:
+        except StaleSnapshot:  # параллельные транзакции мешали и после повторов
+            raise DatabaseBusy()
+        except sqlalchemy.exc.OperationalError as e:
+            if is_contention(e):  # блокировку или сериализацию не получили и после повторов
+                raise DatabaseBusy()
             raise HTTPException(status_code=status.HTTP_502_BAD_GATEWAY,
                                 detail="База данных не отвечает")
         except:
@@ -0,0 +1,97 @@
+""" Обслуживание базы из командной строки (настройки подключения те же, что у приложения).
+
+python -m src.maintenance partitions
+python -m src.maintenance create-partitions --until-year 2028
+python -m src.maintenance archive-partitions --before 2026-01-01 [--refuse-open-loans] [--drop]
+python -m src.maintenance check-open-loans [--fix]
+"""
+import argparse
+import asyncio
+import datetime
+import sys
+
+from src.core.infrastructures import database
+from src.maintenance.exc import MaintenanceError
+from src.maintenance.open_loans import check_open_loans, find_duplicate_loans
+from src.maintenance.partitions import list_partitions, create_partitions, archive_partitions, OpenLoans
+
+
+async def partitions(arguments: argparse.Namespace):
+    async with database().connect() as connection:
+        for partition in await list_partitions(connection):
+            bounds = "DEFAULT" if partition.is_default else f"[{partition.lower or 'MINVALUE'}, {partition.upper})"
+            print(f"{partition.name:<32}{bounds:<48}rows: {partition.rows:<10}open: {partition.open_loans}")
+
+
+async def create(arguments: argparse.Namespace):
+    async with database().begin() as connection:
+        for name in await create_partitions(connection, arguments.until_year):
+            print(f"created {name}")
+
+
+async def archive(arguments: argparse.Namespace):
+    open_loans = OpenLoans.refuse if arguments.refuse_open_loans else OpenLoans.keep
+    async with database().begin() as connection:
+        for partition in await archive_partitions(connection, arguments.before, open_loans, arguments.drop):
+            action = "dropped" if arguments.drop else "archived"
+            print(f"{action} {partition.name}: {partition.rows} rows, {partition.open_loans} open loans kept")
+
+
+async def check(arguments: argparse.Namespace):
+    async with database().begin() as connection:
+        mismatches = await check_open_loans(connection, arguments.fix)
+        duplicates = await find_duplicate_loans(connection)
+    for mismatch in mismatches:
+        print(f"reader {mismatch.reader_id}: open_loans {mismatch.counter}, actual {mismatch.actual}")
+    for duplicate in duplicates:
+        print(f"reader {duplicate.reader_id}: book {duplicate.book_id} has {duplicate.loans} open loans")
+    if mismatches and not arguments.fix:
+        raise MaintenanceError(f"Счетчик книг на руках расходится у читателей: {len(mismatches)}")
+    print(f"fixed: {len(mismatches)}" if mismatches else "open_loans is consistent")
+    if duplicates:  # --fix их не трогает: какую из выдач закрыть, решает библиотекарь
+        raise MaintenanceError(f"Повторные открытые выдачи одной книги: {len(duplicates)}")
+
+
+async def main(arguments: argparse.Namespace):
+    try:
+        await arguments.command(arguments)
+    finally:
+        await database.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        prog="python -m src.maintenance",
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    commands = parser.add_subparsers(required=True)
+
+    command = commands.add_parser("partitions", help="секции borrowed_books")
+    command.set_defaults(command=partitions)
+
+    command = commands.add_parser("create-partitions", help="создать годовые секции заранее")
+    command.add_argument("--until-year", type=int, required=True)
+    command.set_defaults(command=create)
+
+    command = commands.add_parser("archive-partitions", help="отключить старые секции и перенести в схему archive")
+    command.add_argument("--before", type=datetime.datetime.fromisoformat, required=True)
+    command.add_argument(
+        "--refuse-open-loans",
+        action="store_true",
+        help="не архивировать секции с невозвращенными книгами (по умолчанию они переносятся в секцию DEFAULT)"
+    )
+    command.add_argument("--drop", action="store_true", help="удалить секции вместо переноса в архив")
+    command.set_defaults(command=archive)
+
+    command = commands.add_parser(
+        "check-open-loans",
+        help="сверить readers.open_loans с borrowed_books и найти повторные выдачи одной книги"
+    )
+    command.add_argument("--fix", action="store_true", help="исправить расходящиеся счетчики")
+    command.set_defaults(command=check)
+
+    try:
+        asyncio.run(main(parser.parse_args()))
+    except MaintenanceError as e:
+        sys.exit(str(e))
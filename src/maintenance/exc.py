@@ -0,0 +1,11 @@
+class MaintenanceError(Exception):
+    ...
+
+
+class PartitionHasOpenLoans(MaintenanceError):
+    def __init__(self, partition: str, open_loans: int):
+        super().__init__(f"В секции {partition} есть невозвращенные книги: {open_loans}")
+
+
+class PartitionOverlapsData(MaintenanceError):
+    ...
@@ -0,0 +1,70 @@
+""" Сверка счетчика readers.open_loans с открытыми выдачами в borrowed_books.
+
+Счетчик ведут запросы выдачи и возврата, расхождение значит, что borrowed_books меняли в обход репозиториев
+(вручную, миграцией) или выдачи шли старым кодом во время выкладки.
+Тем же путем могли появиться и две открытые выдачи одной книги одному читателю: счетчик их честно считает,
+поэтому они ищутся отдельно. Исправить их автоматически нельзя - лишнюю выдачу закрывают возвратом.
+"""
+from pydantic import BaseModel
+from sqlalchemy import select, func
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from src.core.schemas import readers, borrowed_books
+
+
+class Mismatch(BaseModel):
+    reader_id: int
+    counter: int  # значение readers.open_loans
+    actual: int  # открытых выдач в borrowed_books
+
+
+class Duplicate(BaseModel):
+    reader_id: int
+    book_id: int
+    loans: int  # открытых выдач этой книги читателю
+
+
+_actual = (
+    select(func.count())
+    .where(borrowed_books.c.reader_id == readers.c.id)
+    .where(borrowed_books.c.return_date.is_(None))
+    .scalar_subquery()
+)
+
+_mismatches = (
+    select(readers.c.id.label("reader_id"), readers.c.open_loans.label("counter"), _actual.label("actual"))
+    .where(readers.c.open_loans != _actual)
+    .order_by(readers.c.id)
+    .with_for_update(of=readers)
+)  # строки читателей блокируются: между сверкой и исправлением выдачи этим читателям ждут
+
+_fix = (
+    readers
+    .update()
+    .values(open_loans=_actual)
+    .where(readers.c.open_loans != _actual)
+)
+
+
+async def check_open_loans(connection: AsyncConnection, fix: bool = False) -> list[Mismatch]:
+    """ Находит читателей, у которых счетчик не совпадает с открытыми выдачами, и при `fix` исправляет счетчик """
+    cursor = await connection.execute(_mismatches)
+    mismatches = [Mismatch(**row) for row in cursor.mappings().fetchall()]
+    if mismatches and fix:
+        await connection.execute(_fix)
+    return mismatches
+
+
+_duplicates = (
+    select(borrowed_books.c.reader_id, borrowed_books.c.book_id, func.count().label("loans"))
+    .where(borrowed_books.c.return_date.is_(None))
+    .group_by(borrowed_books.c.reader_id, borrowed_books.c.book_id)
+    .having(func.count() > 1)
+    .order_by(borrowed_books.c.reader_id, borrowed_books.c.book_id)
+)  # по частичному индексу открытых выдач borrowed_books_open_reader_book_idx
+
+
+async def find_duplicate_loans(connection: AsyncConnection) -> list[Duplicate]:
+    """ Находит книги, которые числятся на руках у одного читателя больше одного раза """
+    cursor = await connection.execute(_duplicates)
+    return [Duplicate(**row) for row in cursor.mappings().fetchall()]
@@ -0,0 +1,151 @@
+""" Обслуживание секций borrowed_books (секционирована по диапазонам borrow_date).
+
+Годовые секции borrowed_books_yYYYY создаются заранее, все, чему нет секции, попадает в borrowed_books_default.
+Старые секции архивируются: отключаются от таблицы и переносятся в схему archive (или удаляются).
+Открытые выдачи из архивируемой секции по умолчанию остаются в работе - переезжают в borrowed_books_default,
+так что репозитории продолжают их видеть.
+"""
+import datetime
+import re
+from enum import Enum
+
+from pydantic import BaseModel
+from sqlalchemy import select, func, table, column
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from src.core.schemas import borrowed_books
+from src.maintenance.exc import PartitionHasOpenLoans, PartitionOverlapsData
+
+ARCHIVE_SCHEMA = "archive"
+DEFAULT_PARTITION = f"{borrowed_books.name}_default"
+
+_RANGE = re.compile(r"FROM \((?P<lower>.+?)\) TO \((?P<upper>.+?)\)")
+
+
+class OpenLoans(str, Enum):
+    """ Что делать с открытыми выдачами архивируемой секции """
+    keep = "keep"  # оставить в работе, перенести в секцию по умолчанию
+    refuse = "refuse"  # не архивировать такую секцию
+
+
+class Partition(BaseModel):
+    name: str
+    lower: datetime.datetime | None = None  # None - MINVALUE
+    upper: datetime.datetime | None = None
+    is_default: bool = False
+    rows: int = 0
+    open_loans: int = 0
+
+
+def _bound(value: str) -> datetime.datetime | None:
+    return None if value in ("MINVALUE", "MAXVALUE") else datetime.datetime.fromisoformat(value.strip("'"))
+
+
+def _quote(connection: AsyncConnection, name: str) -> str:
+    return connection.dialect.identifier_preparer.quote(name)
+
+
+async def list_partitions(connection: AsyncConnection) -> list[Partition]:
+    cursor = await connection.exec_driver_sql(
+        """
+        SELECT child.relname, pg_get_expr(child.relpartbound, child.oid)
+        FROM pg_inherits
+        JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+        WHERE pg_inherits.inhparent = %(parent)s::regclass
+        """,
+        {"parent": borrowed_books.name}
+    )
+    partitions = []
+    for name, bound in cursor.fetchall():
+        counts = await connection.execute(
+            select(func.count(), func.count().filter(column("return_date").is_(None)))
+            .select_from(table(name))
+        )
+        rows, open_loans = counts.one()
+        match = _RANGE.search(bound)
+        partitions.append(
+            Partition(name=name, is_default=True, rows=rows, open_loans=open_loans)
+            if match is None else
+            Partition(
+                name=name,
+                lower=_bound(match["lower"]),
+                upper=_bound(match["upper"]),
+                rows=rows,
+                open_loans=open_loans
+            )
+        )
+    return sorted(partitions, key=lambda partition: (partition.is_default, partition.lower or datetime.datetime.min))
+
+
+async def create_partitions(connection: AsyncConnection, until_year: int) -> list[str]:
+    """ Создает годовые секции после последней существующей до `until_year` включительно.
+    Строки этих лет, успевшие попасть в секцию по умолчанию, переносятся в новую секцию """
+    ranges = [partition for partition in await list_partitions(connection) if not partition.is_default]
+    if any(partition.upper is None for partition in ranges):
+        raise PartitionOverlapsData("секция без верхней границы (MAXVALUE), новые года добавить некуда")
+    year = max((partition.upper for partition in ranges), default=datetime.datetime(until_year, 1, 1)).year
+    created = []
+    for year in range(year, until_year + 1):
+        name = f"{borrowed_books.name}_y{year}"
+        lower, upper = datetime.datetime(year, 1, 1), datetime.datetime(year + 1, 1, 1)
+        await connection.exec_driver_sql(
+            f"CREATE TABLE {_quote(connection, name)} (LIKE {borrowed_books.name} INCLUDING DEFAULTS)"
+        )
+        await connection.exec_driver_sql(
+            f"""
+            WITH moved AS (
+                DELETE FROM {DEFAULT_PARTITION}
+                WHERE borrow_date >= %(lower)s AND borrow_date < %(upper)s
+                RETURNING *
+            )
+            INSERT INTO {_quote(connection, name)} SELECT * FROM moved
+            """,
+            {"lower": lower, "upper": upper}
+        )
+        await connection.exec_driver_sql(
+            f"ALTER TABLE {borrowed_books.name} ATTACH PARTITION {_quote(connection, name)} "
+            f"FOR VALUES FROM ('{lower.isoformat()}') TO ('{upper.isoformat()}')"
+        )  # DDL без параметров; индексы, внешние ключи и триггер появятся у секции при подключении
+        created.append(name)
+    return created
+
+
+async def archive_partitions(
+        connection: AsyncConnection,
+        before: datetime.datetime,
+        open_loans: OpenLoans = OpenLoans.keep,
+        drop: bool = False
+) -> list[Partition]:
+    """ Отключает секции, целиком лежащие раньше `before`, и переносит их в схему archive (или удаляет) """
+    archived = [
+        partition for partition in await list_partitions(connection)
+        if not partition.is_default and partition.upper is not None and partition.upper <= before
+    ]
+    if open_loans is OpenLoans.refuse:
+        for partition in archived:
+            if partition.open_loans:
+                raise PartitionHasOpenLoans(partition.name, partition.open_loans)
+    if archived and not drop:
+        await connection.exec_driver_sql(f"CREATE SCHEMA IF NOT EXISTS {ARCHIVE_SCHEMA}")
+    for partition in archived:
+        name = _quote(connection, partition.name)
+        await connection.exec_driver_sql(f"ALTER TABLE {borrowed_books.name} DETACH PARTITION {name}")
+        if partition.open_loans:
+            # диапазона секции больше нет, вставка уходит в секцию по умолчанию
+            await connection.exec_driver_sql(
+                f"""
+                WITH moved AS (DELETE FROM {name} WHERE return_date IS NULL RETURNING *)
+                INSERT INTO {borrowed_books.name} SELECT * FROM moved
+                """
+            )
+        if drop:
+            await connection.exec_driver_sql(f"DROP TABLE {name}")
+            continue
+        cursor = await connection.exec_driver_sql(
+            "SELECT conname FROM pg_constraint WHERE conrelid = %(table)s::regclass AND contype = 'f'",
+            {"table": partition.name}
+        )
+        for constraint in cursor.scalars().all():  # архив не должен мешать удалять книги и читателей
+            await connection.exec_driver_sql(f"ALTER TABLE {name} DROP CONSTRAINT {_quote(connection, constraint)}")
+        await connection.exec_driver_sql(f"ALTER TABLE {name} SET SCHEMA {ARCHIVE_SCHEMA}")
+    return archived
@@ -2,6 +2,8 @@ from enum import Enum
 
 from pydantic import BaseModel, Field, NonNegativeInt
 
+from src.core.types import ID
+
 
 class HasBorrowings(str, Enum):
     only_with = "only with borrowings"
@@ -24,3 +26,16 @@ class INPUT_UpdateBook(BaseModel):
     year: int | None = Field(None, description="Год издания")
     isbn: str | None = Field(None, description="ISBN")
     quantity: NonNegativeInt | None = Field(None, description="Количество")
+
+
+class INPUT_BookIds(BaseModel):
+    ids: list[ID] = Field(..., min_length=1, max_length=1000, description="ID книг")
+
+
+class INPUT_BookStock(BaseModel):
+    slots: int = Field(
+        ...,
+        ge=0,
+        le=64,
+        description="На сколько строк-слотов разложить остаток (0 - обычный остаток в одной строке книги)"
+    )
@@ -1,6 +1,6 @@
 from pydantic import BaseModel, Field, NonNegativeInt
 
-from src.core.types import ID
+from src.core.types import ID, RowError
 
 
 class OUTPUT_BookFullInfo(BaseModel):
@@ -13,9 +13,48 @@ class OUTPUT_BookFullInfo(BaseModel):
     quantity: NonNegativeInt = Field(..., description="Количество")
 
 
+class OUTPUT_BookStock(BaseModel):
+    book_id: ID = Field(..., description="Идентификатор книги")
+    slots: int = Field(..., description="Слотов остатка (0 - без слотов)")
+    quantity: NonNegativeInt = Field(..., description="Количество в наличии")
+
+
 class OUTPUT_BookShortInfo(BaseModel):
     id: ID = Field(..., description="Идентификатор книги")
     title: str = Field(..., description="Название книги")
     author: str = Field(..., description="Автор")
     year: int | None = Field(None, description="Год издания")
     is_available: bool = Field(..., description="В наличии или нет")
+
+
+class OUTPUT_BookSearchResult(OUTPUT_BookShortInfo):
+    rank: float = Field(..., description="Релевантность")
+
+
+class OUTPUT_ImportConflict(BaseModel):
+    row: int = Field(..., description="Номер записи в загруженном файле")
+    isbn: str = Field(..., description="ISBN, который уже есть в каталоге или повторяется в файле")
+
+
+class OUTPUT_BookImportReport(BaseModel):
+    created: int = Field(..., description="Количество добавленных книг")
+    conflicts: list[OUTPUT_ImportConflict] = Field([], description="Пропущенные записи с занятым ISBN")
+    invalid: list[RowError] = Field([], description="Пропущенные невалидные записи")
+
+
+class OUTPUT_FacetCount(BaseModel):
+    value: str = Field(..., description="Значение (автор или десятилетие)")
+    total: int = Field(..., description="Количество книг")
+    available: int = Field(..., description="Из них в наличии")
+
+
+class OUTPUT_BookFacets(BaseModel):
+    total: int = Field(..., description="Всего книг в каталоге")
+    available: int = Field(..., description="Книг в наличии")
+    authors: list[OUTPUT_FacetCount] = Field([], description="По авторам, самые крупные первыми")
+    decades: list[OUTPUT_FacetCount] = Field([], description="По десятилетиям года издания")
+
+
+class OUTPUT_BookBatch(BaseModel):
+    books: list[OUTPUT_BookFullInfo] = Field(..., description="Найденные книги в порядке запроса")
+    missing: list[ID] = Field([], description="ID книг, которых нет в каталоге")
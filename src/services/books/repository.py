@@ -1,32 +1,37 @@
+from typing import AsyncIterator
+
 import psycopg
 import sqlalchemy
-from sqlalchemy import CursorResult, select
-from sqlalchemy.sql.functions import count
+from sqlalchemy import CursorResult, select, tuple_, func, or_, and_, Float, cast, Table, MetaData, Column, \
+    Integer, String, text, literal_column, any_, bindparam, case, true, literal
+from sqlalchemy.dialects.postgresql import insert, ARRAY, aggregate_order_by
+from sqlalchemy.schema import CreateTable
 
+from src.core.conditional import Representation
 from src.core.exc import NoDataToUpdate
 from src.core.interfaces import BaseSQLRepository
 from src.core.types import IDModel, ID
 from src.core.schemas import borrowed_books
-from src.services.books.dto.input import INPUT_CreateBook, INPUT_UpdateBook
-from src.services.books.dto.output import OUTPUT_BookFullInfo, OUTPUT_BookShortInfo
+from src.services.books.dto.input import INPUT_CreateBook, INPUT_UpdateBook, INPUT_BookStock
+from src.services.books.dto.output import OUTPUT_BookFullInfo, OUTPUT_BookSearchResult, \
+    OUTPUT_BookImportReport, OUTPUT_ImportConflict, OUTPUT_BookFacets, OUTPUT_FacetCount, OUTPUT_BookBatch, \
+    OUTPUT_BookStock
 from src.services.books.exc import ISBNAlreadyExists, BookNotFound
-from src.core.schemas import books
+from src.core.schemas import books, book_facets, book_stock, XID8
 from src.services.borrowed_books.exc import ThereAreBorrowings
 
 
 class DB_CreateBook(BaseSQLRepository):
-    def _stmt(self, model: INPUT_CreateBook):
-        return (
-            books
-            .insert()
-            .values(**model.model_dump())
-            .returning(books.c.id)
-        )
+    _stmt = (
+        books
+        .insert()
+        .returning(books.c.id)
+    )  # значения колонок передаются параметрами при выполнении
 
     async def __call__(self, model: INPUT_CreateBook):
         async with self.engine.connect() as connection:
             try:
-                cursor: CursorResult = await connection.execute(self._stmt(model))
+                cursor: CursorResult = await connection.execute(self._stmt, model.model_dump())
             except sqlalchemy.exc.IntegrityError as e:
                 if isinstance(e.orig, psycopg.errors.UniqueViolation):
                     raise ISBNAlreadyExists(model.isbn)
@@ -34,26 +39,150 @@ class DB_CreateBook(BaseSQLRepository):
         return IDModel(id=cursor.scalar())
 
 
+# Остаток книги: quantity, а у книг со слотами (stock_slots > 0) - сумма book_stock.
+# Подзапросы коррелируют с books того запроса, в который подставлены
+book_quantity = case(
+    (
+        books.c.stock_slots > 0,
+        select(func.coalesce(func.sum(book_stock.c.quantity), 0))
+        .where(book_stock.c.book_id == books.c.id)
+        .scalar_subquery()
+    ),
+    else_=books.c.quantity
+)
+book_updated_at = func.greatest(
+    books.c.updated_at,
+    select(func.max(book_stock.c.updated_at)).where(book_stock.c.book_id == books.c.id).scalar_subquery()
+)  # выдачи и возвраты книги со слотами меняют только book_stock; greatest пропускает NULL (слотов нет)
+book_is_available = case(
+    (
+        books.c.stock_slots > 0,
+        select(book_stock.c.slot)
+        .where(book_stock.c.book_id == books.c.id)
+        .where(book_stock.c.quantity > 0)
+        .exists()
+    ),
+    else_=books.c.quantity > 0
+)
+
+
+def book_cache_key(book_id: ID) -> str:
+    """ Ключ кэша карточки книги. Все операции, меняющие книгу (в т.ч. ее количество), сбрасывают его """
+    return f"book:{book_id}"
+
+
+books_import = Table(
+    "books_import",
+    MetaData(),
+    Column("row", Integer, nullable=False),
+    Column("title", String(100), nullable=False),
+    Column("description", String(1000), nullable=True),
+    Column("author", String(100), nullable=False),
+    Column("isbn", String, nullable=True),
+    Column("year", Integer, nullable=True),
+    Column("quantity", Integer, nullable=False),
+    prefixes=["TEMPORARY"],
+    postgresql_on_commit="DROP"
+)  # промежуточная таблица импорта, живет до конца транзакции
+
+
+def _import_merge(columns: tuple[str, ...]):
+    """ Переносит записи в каталог в порядке файла, занятые ISBN пропускаются.
+    Пропущенные записи выводятся из самой вставки (ISBN нет среди вставленных или уже встречался в файле),
+    поэтому ISBN, занятый параллельной транзакцией, тоже попадает в отчет.
+    Возвращает количество добавленных книг и пропущенные записи: по строке на запись,
+    если пропусков нет - одну строку с пустыми row и isbn """
+    numbered = (
+        select(
+            books_import,
+            func.row_number().over(
+                partition_by=books_import.c.isbn,
+                order_by=books_import.c.row
+            ).label("occurrence")
+        )
+        .cte("numbered")
+    )
+    inserted = (
+        insert(books)
+        .from_select(
+            columns,
+            select(*[numbered.c[column] for column in columns])
+            .where(or_(numbered.c.isbn.is_(None), numbered.c.occurrence == 1))
+            .order_by(numbered.c.row)
+        )
+        .on_conflict_do_nothing(
+            index_elements=[books.c.isbn],
+            index_where=books.c.isbn.isnot(None)
+        )
+        .returning(books.c.isbn)
+        .cte("inserted")
+    )
+    created = select(func.count().label("created")).select_from(inserted).subquery("created")
+    conflicts = (
+        select(numbered.c.row, numbered.c.isbn)
+        .where(numbered.c.isbn.isnot(None))
+        .where(
+            or_(
+                numbered.c.occurrence > 1,
+                numbered.c.isbn.not_in(select(inserted.c.isbn).where(inserted.c.isbn.isnot(None)))
+            )
+        )
+        .subquery("conflicts")
+    )
+    return (
+        select(created.c.created, conflicts.c.row, conflicts.c.isbn)
+        .select_from(created.outerjoin(conflicts, true()))
+        .order_by(conflicts.c.row)
+    )
+
+
+class DB_ImportBooks(BaseSQLRepository):
+    """ Класс отвечает за массовую загрузку книг """
+
+    _columns = ("row", "title", "description", "author", "isbn", "year", "quantity")
+    _copy = f"COPY {books_import.name} ({', '.join(_columns)}) FROM STDIN"
+    _merge = _import_merge(_columns[1:])
+
+    async def __call__(self, records: AsyncIterator[tuple[int, INPUT_CreateBook]]):
+        async with self.engine.connect() as connection:
+            await connection.execute(CreateTable(books_import))
+            raw_connection = await connection.get_raw_connection()
+            async with raw_connection.driver_connection.cursor() as raw_cursor:
+                async with raw_cursor.copy(self._copy) as copy:
+                    async for row, model in records:
+                        await copy.write_row((row, *(getattr(model, column) for column in self._columns[1:])))
+            await connection.execute(text(f"ANALYZE {books_import.name}"))
+            cursor: CursorResult = await connection.execute(self._merge)
+            rows = cursor.fetchall()
+            await connection.commit()
+        return OUTPUT_BookImportReport(
+            created=rows[0].created,
+            conflicts=[OUTPUT_ImportConflict(row=row.row, isbn=row.isbn) for row in rows if row.row is not None]
+        )
+
+
 class DB_UpdateBook(BaseSQLRepository):
-    def _stmt(self, book_id: ID, model: INPUT_UpdateBook):
+    _stmt = (
+        books
+        .update()
+        .where(books.c.id == bindparam("book_id"))
+        .returning(books.c.id)
+    )  # SET строится из переданных параметров-колонок
+
+    async def __call__(self, book_id: ID, model: INPUT_UpdateBook):
         data = model.model_dump(exclude_none=True)
         if len(data) == 0:
             raise NoDataToUpdate
-        return (
-            books
-            .update()
-            .values(**model.model_dump())
-            .where(books.c.id == book_id)
-            .returning(books.c.id)
-        )
-
-    async def __call__(self, book_id: ID, model: INPUT_UpdateBook):
         async with self.engine.connect() as connection:
             try:
-                cursor: CursorResult = await connection.execute(self._stmt(book_id, model))
+                cursor: CursorResult = await connection.execute(
+                    self._stmt,
+                    {"book_id": book_id, **model.model_dump()}
+                )
                 if cursor.rowcount != 1:
                     raise BookNotFound(book_id)
                 await connection.commit()
+                await self.cache.delete(book_cache_key(book_id))
                 return IDModel(id=cursor.scalar())
             except sqlalchemy.exc.IntegrityError as e:
                 if isinstance(e.orig, psycopg.errors.UniqueViolation) \
@@ -62,65 +191,376 @@ class DB_UpdateBook(BaseSQLRepository):
 
 
 class DB_GetBookById(BaseSQLRepository):
-    def _stmt(self, book_id: ID):
-        return (
-            select(books)
-            .where(books.c.id == book_id)
+    _stmt = (
+        select(
+            books.c.id,
+            books.c.title,
+            books.c.description,
+            books.c.author,
+            books.c.year,
+            books.c.isbn,
+            book_quantity.label("quantity"),
+            func.concat(
+                literal_column("books.xmin::text"),
+                select(
+                    func.string_agg(literal_column("book_stock.xmin::text"), aggregate_order_by("-", book_stock.c.slot))
+                )
+                .where(book_stock.c.book_id == books.c.id)
+                .scalar_subquery()
+            ).label("version"),  # меняется при каждом изменении строки книги или ее слотов
+            book_updated_at.label("updated_at")
         )
+        .where(books.c.id == bindparam("book_id"))
+    )
 
     async def __call__(self, book_id: ID):
         async with self.engine.connect() as connection:
-            cursor: CursorResult = await connection.execute(self._stmt(book_id))
+            cursor: CursorResult = await connection.execute(self._stmt, {"book_id": book_id})
         result = cursor.mappings().fetchone()
         if result is None:
             raise BookNotFound(book_id)
-        return OUTPUT_BookFullInfo(**result)
+        return Representation(
+            body=OUTPUT_BookFullInfo(**result).model_dump_json(),
+            etag=f'"{book_id}-{result["version"]}"',
+            last_modified=result["updated_at"]
+        )
+
+
+class DB_GetBooksByIds(BaseSQLRepository):
+    """ Пакетное получение книг одним запросом """
+
+    _stmt = (
+        select(
+            books.c.id,
+            books.c.title,
+            books.c.description,
+            books.c.author,
+            books.c.year,
+            books.c.isbn,
+            book_quantity.label("quantity")
+        )
+        .where(books.c.id == any_(bindparam("ids", type_=ARRAY(Integer))))
+    )  # один параметр-массив вместо IN (...) - форма запроса не зависит от количества ID
+
+    async def __call__(self, book_ids: list[ID]):
+        book_ids = list(dict.fromkeys(book_ids))
+        async with self.engine.connect() as connection:
+            cursor: CursorResult = await connection.execute(self._stmt, {"ids": book_ids})
+        found = {book["id"]: OUTPUT_BookFullInfo(**book) for book in cursor.mappings().fetchall()}
+        return OUTPUT_BookBatch(
+            books=[found[book_id] for book_id in book_ids if book_id in found],
+            missing=[book_id for book_id in book_ids if book_id not in found]
+        )
+
+
+def _book_list_page():
+    return (
+        select(
+            books.c.id,
+            books.c.title,
+            books.c.author,
+            books.c.year,
+            book_is_available.label("is_available")
+        )
+        .order_by(books.c.title, books.c.id)
+        .limit(bindparam("limit", type_=Integer))
+    )
 
 
 class DB_GetBookList(BaseSQLRepository):
-    def _stmt(self, skip: int, limit: int):
-        return (
-            select(
-                books.c.id,
-                books.c.title,
-                books.c.author,
-                books.c.year,
-                (books.c.quantity > 0).label("is_available")
+    _stmt = _book_list_page().offset(bindparam("skip", type_=Integer))
+    _after_stmt = _book_list_page().where(
+        tuple_(books.c.title, books.c.id)
+        > tuple_(bindparam("after_title", type_=String), bindparam("after_id", type_=Integer))
+    )  # keyset: продолжаем сразу после последней (title, id) по индексу books_title_id_idx
+
+    async def __call__(self, skip: int, limit: int, after: tuple[str, ID] | None = None):
+        async with self.engine.connect() as connection:
+            if after is None:
+                cursor: CursorResult = await connection.execute(self._stmt, {"skip": skip, "limit": limit})
+            else:
+                cursor = await connection.execute(
+                    self._after_stmt,
+                    {"after_title": after[0], "after_id": after[1], "limit": limit}
+                )
+        return cursor.fetchall()  # модели строит роут, только если клиенту нужно тело
+
+
+def _book_search_page():
+    """ Кандидаты отбираются по GIN индексам: полнотекстовому (`search_vector`)
+    и триграммным (`title`, `author`, оператор `<%` находит слова с опечатками).
+    Релевантность = ts_rank + лучшая триграммная похожесть, страницы по (rank DESC, id) """
+    query = bindparam("query", type_=String)
+    ts_query = func.websearch_to_tsquery("simple", query)
+    found = (
+        select(
+            books.c.id,
+            books.c.title,
+            books.c.author,
+            books.c.year,
+            book_is_available.label("is_available"),
+            cast(
+                func.ts_rank(books.c.search_vector, ts_query)
+                + func.greatest(
+                    func.word_similarity(query, books.c.title),
+                    func.word_similarity(query, books.c.author)
+                ),
+                Float
+            ).label("rank")
+        )
+        .where(
+            or_(
+                books.c.search_vector.op("@@")(ts_query),
+                query.op("<%")(books.c.title),
+                query.op("<%")(books.c.author)
             )
-            .order_by(books.c.title)
-            .offset(skip)
-            .limit(limit)
         )
+        .subquery("found")
+    )
+    return found, (
+        select(found)
+        .order_by(found.c.rank.desc(), found.c.id)
+        .limit(bindparam("limit", type_=Integer))
+    )
+
+
+class DB_SearchBooks(BaseSQLRepository):
+    """ Поиск книг по названию, автору и описанию """
+
+    _found, _stmt = _book_search_page()
+    _after_stmt = _stmt.where(
+        or_(
+            _found.c.rank < bindparam("after_rank", type_=Float),
+            and_(_found.c.rank == bindparam("after_rank"), _found.c.id > bindparam("after_id", type_=Integer))
+        )
+    )
 
-    async def __call__(self, skip: int, limit: int):
+    async def __call__(self, query: str, limit: int, after: tuple[float, ID] | None = None):
         async with self.engine.connect() as connection:
-            cursor: CursorResult = await connection.execute(self._stmt(skip, limit))
-        result = [OUTPUT_BookShortInfo(**book) for book in cursor.mappings().fetchall()]
-        return result
+            if after is None:
+                cursor: CursorResult = await connection.execute(self._stmt, {"query": query, "limit": limit})
+            else:
+                cursor = await connection.execute(
+                    self._after_stmt,
+                    {"query": query, "limit": limit, "after_rank": after[0], "after_id": after[1]}
+                )
+        return [OUTPUT_BookSearchResult(**book) for book in cursor.mappings().fetchall()]
 
 
-class DB_DeleteBook(BaseSQLRepository):
-    def _status(self, book_id: ID):
-        return (
-            select(count())
-            .where(borrowed_books.c.book_id == book_id)
-            .where(borrowed_books.c.return_date.is_(None))
+class DB_ExportBooks(BaseSQLRepository):
+    """ Выгрузка всего каталога (или изменившегося с отметки `changed_since`) серверным курсором """
+
+    fields = ("id", "title", "description", "author", "year", "isbn", "quantity", "updated_at")
+    _stmt = (
+        select(
+            *[books.c[field] for field in fields if field not in ("quantity", "updated_at")],
+            book_quantity.label("quantity"),
+            book_updated_at.label("updated_at")
         )
+        .order_by(books.c.id)
+    )
+    _changed_since = cast(bindparam("changed_since", type_=String), XID8)  # xid8 из числа не приводится, из текста - да
+    _changed_since_stmt = _stmt.where(
+        books.c.id.in_(
+            select(books.c.id)
+            .where(books.c.change_xid >= _changed_since)
+            .union(select(book_stock.c.book_id).where(book_stock.c.change_xid >= _changed_since))
+        )
+    )  # книга или ее слоты (остаток книги со слотами меняется без строки books)
+
+    async def __call__(self, changed_since: int | None = None):
+        """ Возвращает отметку для следующей выгрузки и поток пачек записей """
+        watermark = await self._watermark()  # до запроса выгрузки: ее снимок позже отметки
+        if changed_since is None:
+            return watermark, self._stream(self._stmt)
+        return watermark, self._stream(self._changed_since_stmt, {"changed_since": str(changed_since)})
+
+
+class DB_SetBookStock(BaseSQLRepository):
+    """ Переключает книгу между обычным остатком (quantity) и слотами book_stock.
+    Остаток собирается из текущего режима и раскладывается заново, выдачи книги ждут окончания переключения,
+    а возврат, чей снимок застал старый режим, повторяется (StaleSnapshot).
+    У книги со слотами quantity в books при выдаче не меняется и хранит, сколько экземпляров всего
+    (в наличии + на руках). Фасеты "в наличии" считают ее по этому числу и поправляются при чтении (_book_facets) """
+
+    _book = (
+        select(books.c.stock_slots, books.c.quantity)
+        .where(books.c.id == bindparam("book_id", type_=Integer))
+        .with_for_update(key_share=True)
+    )  # FOR NO KEY UPDATE: ждут выдачи в обычном режиме, но не проверка внешнего ключа при выдаче из слота
+    _removed = (
+        book_stock
+        .delete()
+        .where(book_stock.c.book_id == bindparam("book_id", type_=Integer))
+        .returning(book_stock.c.quantity)
+        .cte("removed")
+    )  # удаление ждет выдачи, которые держат слоты, и видит их результат
+    _collect = select(func.coalesce(func.sum(_removed.c.quantity), 0))
+    _on_loan = (
+        select(func.count())
+        .where(borrowed_books.c.book_id == bindparam("book_id", type_=Integer))
+        .where(borrowed_books.c.return_date.is_(None))
+    )
+    _slots = book_stock.insert()
+    _update = (
+        books
+        .update()
+        .values(stock_slots=bindparam("slots", type_=Integer), quantity=bindparam("total", type_=Integer))
+        .where(books.c.id == bindparam("book_id", type_=Integer))
+    )
+
+    async def __call__(self, book_id: ID, model: INPUT_BookStock):
+        async with self.engine.connect() as connection:
+            book = (await connection.execute(self._book, {"book_id": book_id})).fetchone()
+            if book is None:
+                raise BookNotFound(book_id)
+            available = (await connection.execute(self._collect, {"book_id": book_id})).scalar()
+            if book.stock_slots == 0:
+                available = book.quantity
+            total = available
+            if model.slots > 0:
+                total += (await connection.execute(self._on_loan, {"book_id": book_id})).scalar()
+                await connection.execute(
+                    self._slots,
+                    [
+                        {
+                            "book_id": book_id,
+                            "slot": slot,
+                            "quantity": available // model.slots + (slot < available % model.slots)
+                        }
+                        for slot in range(model.slots)
+                    ]
+                )  # поровну, остаток деления - в первые слоты
+            await connection.execute(self._update, {"book_id": book_id, "slots": model.slots, "total": total})
+            await connection.commit()
+        await self.cache.delete(book_cache_key(book_id))
+        return OUTPUT_BookStock(book_id=book_id, slots=model.slots, quantity=available)
+
 
-    def _stmt(self, book_id: ID):
-        return (
-            books
-            .delete()
-            .where(books.c.id == book_id)
+def _book_facets():
+    """ Счетчики из book_facets с поправкой "в наличии" для книг со слотами.
+    Триггеры фасетов считают такую книгу в наличии по quantity (всего экземпляров): выдача из слота строку books
+    не меняет. Книги, все слоты которых пусты, вычитаются при чтении - их мало, и ищутся они по частичному индексу """
+    emptied = (
+        select(books.c.author, books.c.year)
+        .where(books.c.stock_slots > 0)
+        .where(books.c.quantity > 0)
+        .where(~book_is_available)
+        .cte("emptied")
+    )
+    emptied_facets = (
+        select(literal("catalog").label("facet"), literal("all").label("value")).select_from(emptied)
+        .union_all(
+            select(literal("author"), emptied.c.author),
+            select(literal("decade"), cast(emptied.c.year // 10 * 10, String)).where(emptied.c.year.isnot(None))
         )
+        .subquery("emptied_facets")
+    )
+    corrections = (
+        select(emptied_facets.c.facet, emptied_facets.c.value, func.count().label("emptied"))
+        .group_by(emptied_facets.c.facet, emptied_facets.c.value)
+        .cte("corrections")
+    )
+    facets = (
+        select(
+            book_facets.c.facet,
+            book_facets.c.value,
+            book_facets.c.total,
+            (book_facets.c.available - func.coalesce(corrections.c.emptied, 0)).label("available")
+        )
+        .select_from(
+            book_facets.outerjoin(
+                corrections,
+                and_(corrections.c.facet == book_facets.c.facet, corrections.c.value == book_facets.c.value)
+            )
+        )
+        .where(book_facets.c.total > 0)
+    )
+    return (
+        facets
+        .where(book_facets.c.facet == "author")
+        .order_by(book_facets.c.total.desc(), book_facets.c.value)
+        .limit(bindparam("authors_limit", type_=Integer))
+        .union_all(facets.where(book_facets.c.facet.in_(["catalog", "decade"])))
+    )
+
+
+class DB_GetBookFacets(BaseSQLRepository):
+    """ Читает готовые счетчики из book_facets, стоимость зависит от количества фасетов и книг со слотами,
+    а не всех книг """
+
+    _stmt = _book_facets()
+
+    async def __call__(self, authors_limit: int):
+        async with self.engine.connect() as connection:
+            cursor: CursorResult = await connection.execute(self._stmt, {"authors_limit": authors_limit})
+        result = OUTPUT_BookFacets(total=0, available=0)
+        for facet in cursor.mappings().fetchall():
+            match facet["facet"]:
+                case "catalog":
+                    result.total, result.available = facet["total"], facet["available"]
+                case "author":
+                    result.authors.append(OUTPUT_FacetCount(**facet))
+                case "decade":
+                    result.decades.append(OUTPUT_FacetCount(**facet))
+        result.decades.sort(key=lambda decade: int(decade.value))
+        return result
+
+
+def _delete_book():
+    """ Удаляет книгу вместе с историей выдач, только если ни один экземпляр не на руках.
+    Результат - одно из: deleted, borrowed, not_found.
+    Выдача, закоммиченная параллельно, ловится внешним ключом (ON DELETE NO ACTION) """
+    book_id = bindparam("book_id", type_=Integer)
+    no_open_loans = ~(
+        select(borrowed_books.c.id)
+        .where(borrowed_books.c.book_id == book_id)
+        .where(borrowed_books.c.return_date.is_(None))
+        .exists()
+    )
+    history = (
+        borrowed_books
+        .delete()
+        .where(borrowed_books.c.book_id == book_id)
+        .where(no_open_loans)
+        .returning(borrowed_books.c.id)
+        .cte("history")
+    )
+    deleted = (
+        books
+        .delete()
+        .where(books.c.id == book_id)
+        .where(no_open_loans)
+        .returning(books.c.id)
+        .cte("deleted")
+    )
+    return (
+        select(
+            case(
+                (select(deleted.c.id).exists(), "deleted"),
+                (select(books.c.id).where(books.c.id == book_id).exists(), "borrowed"),
+                else_="not_found"
+            ).label("status")
+        )
+        .add_cte(history)
+    )
+
+
+class DB_DeleteBook(BaseSQLRepository):
+    _stmt = _delete_book()
 
     async def __call__(self, book_id: ID):
         async with self.engine.connect() as connection:
-            cursor: CursorResult = await connection.execute(self._status(book_id))
-            borrowed_books_count = cursor.scalar()
-            if borrowed_books_count != 0:
-                raise ThereAreBorrowings(book_id)
-            cursor = await connection.execute(self._stmt(book_id))
-            if cursor.rowcount != 1:
-                raise BookNotFound(book_id)
+            try:
+                cursor: CursorResult = await connection.execute(self._stmt, {"book_id": book_id})
+            except sqlalchemy.exc.IntegrityError as e:
+                if isinstance(e.orig, psycopg.errors.ForeignKeyViolation):  # книгу выдали, пока шло удаление
+                    raise ThereAreBorrowings(book_id)
+                raise
+            match cursor.scalar():
+                case "borrowed":
+                    raise ThereAreBorrowings(book_id)
+                case "not_found":
+                    raise BookNotFound(book_id)
             await connection.commit()
+        await self.cache.delete(book_cache_key(book_id))
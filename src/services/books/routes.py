@@ -1,15 +1,25 @@
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Response, Query, Request
+from pydantic import TypeAdapter
 from starlette import status
+from starlette.responses import StreamingResponse
 
+from src.core.conditional import conditional_response, content_etag
+from src.core.pagination import paginate
+from src.core.streaming import CSV_MEDIA_TYPE, NDJSON_MEDIA_TYPE, JSON_MEDIA_TYPE, ExportFormat, \
+    WATERMARK_HEADER
 from src.core.security import TokenManager
 from src.core.types import ID, IDModel
-from src.services.books.dto.input import INPUT_CreateBook, INPUT_UpdateBook
-from src.services.books.dto.output import OUTPUT_BookFullInfo, OUTPUT_BookShortInfo
+from src.services.books.dto.input import INPUT_CreateBook, INPUT_UpdateBook, INPUT_BookIds, INPUT_BookStock
+from src.services.books.dto.output import OUTPUT_BookFullInfo, OUTPUT_BookShortInfo, OUTPUT_BookSearchResult, \
+    OUTPUT_BookImportReport, OUTPUT_BookFacets, OUTPUT_BookBatch, OUTPUT_BookStock
 from src.services.books.service import SERVICE_CreateBook, SERVICE_UpdateBook, SERVICE_GetBookById, SERVICE_DeleteBook, \
-    SERVICE_GetBookList
+    SERVICE_GetBookList, SERVICE_SearchBooks, SERVICE_ImportBooks, SERVICE_ExportBooks, SERVICE_GetBookFacets, \
+    SERVICE_GetBooksByIds, SERVICE_SetBookStock
 
 book_router = APIRouter(prefix="/books", tags=["Книги"])
 
+_book_list = TypeAdapter(list[OUTPUT_BookShortInfo])
+
 
 @book_router.post(
     "/",
@@ -31,26 +41,170 @@ async def create_book(
     return await service(client_id, model)
 
 
+@book_router.post(
+    "/import",
+    status_code=status.HTTP_201_CREATED,
+    summary="Массовый импорт книг",
+    description=f"""
+    Функция загружает книги потоком из тела запроса.
+    Поддерживаются форматы CSV (`{CSV_MEDIA_TYPE}`, первая строка - заголовок с именами полей),
+    NDJSON (`{NDJSON_MEDIA_TYPE}`, один JSON объект на строку) и JSON массив объектов (`{JSON_MEDIA_TYPE}`).
+    Поля те же, что и при добавлении одной книги.
+    Записи с ISBN, который уже есть в каталоге или повторяется в файле, не прерывают загрузку,
+    а попадают в отчет (`conflicts`), невалидные записи - в `invalid`.
+    Номера записей считаются с 1 без учета заголовка, ошибка в самом заголовке CSV приходит с номером 0.
+    Записи не в UTF-8 попадают в `invalid`, BOM в начале файла допускается.
+    Неподдерживаемый формат вернет ошибку 415.
+    """,
+    response_model=OUTPUT_BookImportReport,
+    openapi_extra={
+        "requestBody": {
+            "required": True,
+            "content": {
+                CSV_MEDIA_TYPE: {"schema": {"type": "string"}},
+                NDJSON_MEDIA_TYPE: {"schema": {"type": "string"}},
+                JSON_MEDIA_TYPE: {"schema": {"type": "array", "items": {"type": "object"}}},
+            }
+        }
+    }
+)
+async def import_books(
+        request: Request,
+        service: SERVICE_ImportBooks = Depends(),
+        client_id: ID = Depends(TokenManager.decode)
+):
+    return await service(client_id, request.stream(), request.headers.get("content-type", ""))
+
+
+@book_router.post(
+    "/batch",
+    status_code=status.HTTP_200_OK,
+    summary="Получить несколько книг по ID",
+    description="""
+    Функция возвращает данные сразу нескольких книг (до 1000 ID за раз) одним запросом в базу,
+    например все книги из задолженностей читателя.
+    Книги возвращаются в порядке запроса (повторы ID схлопываются),
+    ID несуществующих книг перечислены в `missing` - ошибки 404 не будет.
+    Авторизация не обязательна.
+    """,
+    response_model=OUTPUT_BookBatch
+)
+async def get_books_by_ids(
+        model: INPUT_BookIds,
+        service: SERVICE_GetBooksByIds = Depends()
+):
+    return await service(model)
+
+
 @book_router.get(
     "/",
     status_code=status.HTTP_200_OK,
     summary="Получить список книг",
     description="""
     Функция возвращает список книг.
-    Есть функционал SKIP/LIMIT для пагинации.
+    Есть функционал SKIP/LIMIT для пагинации (оставлен для старых клиентов).
+    Для больших каталогов используйте курсор: если страница заполнена целиком,
+    в заголовке `X-Next-Cursor` придет курсор следующей страницы, его нужно передать в параметр `after`
+    (при переданном `after` параметр `skip` игнорируется).
+    Невалидный курсор вернет ошибку 400.
     Авторизация не обязательна.
     (читатели могут например в отдельном терминале посмотреть "меню" библиотеки чтобы выбрать себе че нить).
     Так же есть информация о наличии книги (о возможности ее взять) - поле `is_available`.
-    Если `is_available` = true - книга есть в наличии, если false - все экземпляры на руках или такой книги вообще нет
+    Если `is_available` = true - книга есть в наличии, если false - все экземпляры на руках или такой книги вообще нет.
+    Ответ содержит `ETag`, при совпадении с `If-None-Match` вернется 304 без тела.
     """,
     response_model=list[OUTPUT_BookShortInfo]
 )
 async def get_book_list(
+        request: Request,
+        response: Response,
         skip: int = 0,
         limit: int = 50,
+        after: str | None = None,
         service: SERVICE_GetBookList = Depends()
 ):
-    return await service(skip, limit)
+    result = await service(skip, limit, after)
+    paginate(response, result, limit, lambda book: (book.title, book.id))
+    return conditional_response(
+        request,
+        content_etag(*result),
+        lambda: _book_list.dump_json(_book_list.validate_python(result, from_attributes=True)),
+        headers=response.headers
+    )
+
+
+@book_router.get(
+    "/search",
+    status_code=status.HTTP_200_OK,
+    summary="Поиск книг",
+    description="""
+    Функция ищет книги по названию, автору и описанию.
+    Запрос поддерживает синтаксис веб-поиска (`"точная фраза"`, `-исключить`, `or`)
+    и прощает опечатки в названии и авторе.
+    Результаты отсортированы по релевантности (поле `rank`).
+    Пагинация курсором: если страница заполнена целиком, курсор следующей страницы
+    придет в заголовке `X-Next-Cursor`, его нужно передать в параметр `after`.
+    Авторизация не обязательна.
+    """,
+    response_model=list[OUTPUT_BookSearchResult]
+)
+async def search_books(
+        response: Response,
+        q: str = Query(..., min_length=1, max_length=200),
+        limit: int = 20,
+        after: str | None = None,
+        service: SERVICE_SearchBooks = Depends()
+):
+    result = await service(q, limit, after)
+    return paginate(response, result, limit, lambda book: (book.rank, book.id))
+
+
+@book_router.get(
+    "/facets",
+    status_code=status.HTTP_200_OK,
+    summary="Счетчики каталога",
+    description="""
+    Функция возвращает количество книг (и сколько из них в наличии) во всем каталоге,
+    по авторам и по десятилетиям года издания.
+    Счетчики поддерживаются базой при каждом изменении книг, поэтому запрос не пересчитывает каталог
+    (пересчитываются только книги с остатком по слотам, все экземпляры которых на руках).
+    Параметр `authors_limit` ограничивает список авторов самыми крупными.
+    Авторизация не обязательна.
+    """,
+    response_model=OUTPUT_BookFacets
+)
+async def get_book_facets(
+        authors_limit: int = Query(50, ge=0, le=1000),
+        service: SERVICE_GetBookFacets = Depends()
+):
+    return await service(authors_limit)
+
+
+@book_router.get(
+    "/export",
+    status_code=status.HTTP_200_OK,
+    summary="Выгрузить каталог",
+    description="""
+    Функция потоком выгружает весь каталог в формате NDJSON (по умолчанию) или CSV с заголовком.
+    Память сервера не зависит от размера каталога.
+    В заголовке `X-Export-Watermark` придет отметка: с параметром `changed_since` = отметке прошлой выгрузки
+    выгрузятся только книги, добавленные или измененные после нее.
+    Отметка учитывает порядок коммитов, поэтому изменения не теряются, но книгу, которую меняли во время
+    прошлой выгрузки, можно получить повторно: записи нужно сливать по `id`.
+    Удаленные книги в выгрузку не попадают.
+    """,
+    response_class=StreamingResponse
+)
+async def export_books(
+        export_format: ExportFormat = Query(ExportFormat.ndjson, alias="format"),
+        changed_since: int | None = Query(None, ge=0),
+        service: SERVICE_ExportBooks = Depends(),
+        client_id: ID = Depends(TokenManager.decode)
+):
+    watermark, content = await service(export_format, changed_since)
+    return StreamingResponse(
+        content, media_type=export_format.media_type, headers={WATERMARK_HEADER: str(watermark)}
+    )
 
 
 @book_router.put(
@@ -76,6 +230,32 @@ async def update_book(
     return await service(client_id, book_id, model)
 
 
+@book_router.put(
+    "/{book_id}/stock",
+    status_code=status.HTTP_200_OK,
+    summary="Раскладка остатка книги по слотам",
+    description="""
+    Функция переключает режим учета остатка книги.
+    Выдачи и возвраты книги меняют одну строку, и при большом потоке выдач одной книги стойки ждут друг друга.
+    С `slots` больше 0 остаток раскладывается по стольким строкам-слотам: выдача берет любой непустой
+    незаблокированный слот, параллельные выдачи идут одновременно. `slots` = 0 возвращает обычный режим.
+    Повторный вызов разложит остаток заново (например, на другое количество слотов).
+    Количество в наличии в ответах API в обоих режимах одно и то же.
+    У книги со слотами количество через `PUT /books/{book_id}` меняет только общее число экземпляров
+    для счетчиков фасетов, остаток меняется выдачами, возвратами и этой функцией.
+    Возвращает 404 если книга не найдена.
+    """,
+    response_model=OUTPUT_BookStock
+)
+async def set_book_stock(
+        book_id: ID,
+        model: INPUT_BookStock,
+        service: SERVICE_SetBookStock = Depends(),
+        client_id: ID = Depends(TokenManager.decode)
+):
+    return await service(client_id, book_id, model)
+
+
 @book_router.get(
     "/{book_id}",
     status_code=status.HTTP_200_OK,
@@ -85,14 +265,18 @@ async def update_book(
     Авторизация не обязательна 
     (читатели могут например в отдельном терминале посмотреть подробности о книге).
     Возвращает 404 если книга не найдена.
+    Ответ содержит `ETag` и `Last-Modified`: если книга не менялась
+    (`If-None-Match` или `If-Modified-Since`), вернется 304 без тела.
     """,
     response_model=OUTPUT_BookFullInfo
 )
 async def get_book_by_id(
+        request: Request,
         book_id: ID,
         service: SERVICE_GetBookById = Depends()
 ):
-    return await service(book_id)
+    result = await service(book_id)
+    return conditional_response(request, result.etag, lambda: result.body, result.last_modified)
 
 
 @book_router.delete(
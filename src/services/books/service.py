@@ -1,10 +1,18 @@
+from typing import AsyncIterator
+
 from fastapi import Depends
 from loguru import logger
 
+from src.core.conditional import Representation
+from src.core.dependencies import D
+from src.core.infrastructures import Cache
 from src.core.interfaces import BaseService
-from src.core.types import ID
-from src.services.books.dto.input import INPUT_CreateBook, INPUT_UpdateBook
-from src.services.books.repository import DB_CreateBook, DB_UpdateBook, DB_GetBookById, DB_GetBookList, DB_DeleteBook
+from src.core.pagination import Cursor
+from src.core.streaming import read_records, ExportFormat, encode_records
+from src.core.types import ID, RowError
+from src.services.books.dto.input import INPUT_CreateBook, INPUT_UpdateBook, INPUT_BookIds, INPUT_BookStock
+from src.services.books.repository import DB_CreateBook, DB_UpdateBook, DB_GetBookById, DB_GetBookList, DB_DeleteBook, \
+    DB_SearchBooks, DB_ImportBooks, DB_ExportBooks, DB_GetBookFacets, DB_GetBooksByIds, DB_SetBookStock, book_cache_key
 
 
 class SERVICE_CreateBook(BaseService):
@@ -25,6 +33,26 @@ class SERVICE_CreateBook(BaseService):
         return result
 
 
+class SERVICE_ImportBooks(BaseService):
+    def __init__(
+            self,
+            import_books_repository: DB_ImportBooks = Depends()
+    ):
+        super().__init__()
+        self._import_books_repository = import_books_repository
+
+    async def __call__(self, client_id: ID, stream: AsyncIterator[bytes], content_type: str):
+        invalid: list[RowError] = []
+        records = read_records(stream, content_type, INPUT_CreateBook, invalid)
+        result = await self._import_books_repository(records)
+        result.invalid = invalid
+        logger.info(
+            f"Библиотекарь с ID {client_id} импортировал {result.created} книг "
+            f"(конфликтов ISBN: {len(result.conflicts)}, невалидных записей: {len(invalid)})"
+        )
+        return result
+
+
 class SERVICE_UpdateBook(BaseService):
     def __init__(
             self,
@@ -39,16 +67,51 @@ class SERVICE_UpdateBook(BaseService):
         return result
 
 
+class SERVICE_SetBookStock(BaseService):
+    def __init__(
+            self,
+            set_book_stock_repository: DB_SetBookStock = Depends()
+    ):
+        super().__init__()
+        self._set_book_stock_repository = set_book_stock_repository
+
+    async def __call__(self, client_id: ID, book_id: ID, model: INPUT_BookStock):
+        result = await self._set_book_stock_repository(book_id, model)
+        logger.info(f"Библиотекарь с ID {client_id} разложил остаток книги с ID {book_id} на {model.slots} слотов")
+        return result
+
+
 class SERVICE_GetBookById(BaseService):
     def __init__(
             self,
-            get_book_by_id_repository: DB_GetBookById = Depends()
+            get_book_by_id_repository: DB_GetBookById = Depends(),
+            cache: Cache = Depends(D.cache)
     ):
         super().__init__()
         self._get_book_by_id_repository = get_book_by_id_repository
+        self._cache = cache
 
     async def __call__(self, book_id: ID):
+        key = book_cache_key(book_id)
+        cached = await self._cache.get(key)
+        if cached is not None:
+            return Representation.model_validate_json(cached)
+        generation = await self._cache.generation(key)  # до чтения из базы, см. Cache
         result = await self._get_book_by_id_repository(book_id)
+        await self._cache.set(key, result.model_dump_json(), generation)
+        return result
+
+
+class SERVICE_GetBooksByIds(BaseService):
+    def __init__(
+            self,
+            get_books_by_ids_repository: DB_GetBooksByIds = Depends()
+    ):
+        super().__init__()
+        self._get_books_by_ids_repository = get_books_by_ids_repository
+
+    async def __call__(self, model: INPUT_BookIds):
+        result = await self._get_books_by_ids_repository(model.ids)
         return result
 
 
@@ -60,8 +123,49 @@ class SERVICE_GetBookList(BaseService):
         super().__init__()
         self._get_book_list_repository = get_book_list_repository
 
-    async def __call__(self, skip: int, limit: int):
-        result = await self._get_book_list_repository(skip, limit)
+    async def __call__(self, skip: int, limit: int, after: str | None = None):
+        key = Cursor.decode(after, tuple[str, ID]) if after else None
+        result = await self._get_book_list_repository(skip, limit, key)
+        return result
+
+
+class SERVICE_SearchBooks(BaseService):
+    def __init__(
+            self,
+            search_books_repository: DB_SearchBooks = Depends()
+    ):
+        super().__init__()
+        self._search_books_repository = search_books_repository
+
+    async def __call__(self, query: str, limit: int, after: str | None = None):
+        key = Cursor.decode(after, tuple[float, ID]) if after else None
+        result = await self._search_books_repository(query, limit, key)
+        return result
+
+
+class SERVICE_ExportBooks(BaseService):
+    def __init__(
+            self,
+            export_books_repository: DB_ExportBooks = Depends()
+    ):
+        super().__init__()
+        self._export_books_repository = export_books_repository
+
+    async def __call__(self, export_format: ExportFormat, changed_since: int | None):
+        watermark, partitions = await self._export_books_repository(changed_since)
+        return watermark, encode_records(partitions, export_format, DB_ExportBooks.fields)
+
+
+class SERVICE_GetBookFacets(BaseService):
+    def __init__(
+            self,
+            get_book_facets_repository: DB_GetBookFacets = Depends()
+    ):
+        super().__init__()
+        self._get_book_facets_repository = get_book_facets_repository
+
+    async def __call__(self, authors_limit: int):
+        result = await self._get_book_facets_repository(authors_limit)
         return result
 
 
@@ -1,5 +1,6 @@
-from pydantic import BaseModel
-from pydantic.v1 import Field
+import datetime
+
+from pydantic import BaseModel, Field
 
 from src.core.types import ID
 
@@ -11,3 +12,16 @@ class INPUT_CreateBorrowedBook(BaseModel):
 
 class INPUT_ReturnBook(INPUT_CreateBorrowedBook):
     pass
+
+
+class INPUT_BulkBorrowedBooks(BaseModel):
+    reader_id: ID = Field(..., description="ID читателя")
+    book_ids: list[ID] = Field(..., min_length=1, max_length=3, description="ID книг (не больше лимита на руках)")
+
+
+class INPUT_BorrowFilter(BaseModel):
+    reader_id: ID | None = Field(None, description="Только выдачи читателя")
+    book_id: ID | None = Field(None, description="Только выдачи книги")
+    borrowed_from: datetime.datetime | None = Field(None, description="Выданные начиная с этого момента")
+    borrowed_to: datetime.datetime | None = Field(None, description="Выданные до этого момента (не включительно)")
+    no_returned_only: bool = Field(False, description="Только непогашенные")
@@ -0,0 +1,38 @@
+import datetime
+
+from pydantic import BaseModel, Field
+
+from src.core.types import ID
+
+
+class OUTPUT_BulkItem(BaseModel):
+    book_id: ID = Field(..., description="ID книги")
+    borrow_id: ID | None = Field(None, description="ID записи выдачи, если операция прошла")
+    status_code: int = Field(..., description="Код результата, как у одиночной операции")
+    detail: str | None = Field(None, description="Текст ошибки")
+
+
+class OUTPUT_BulkResult(BaseModel):
+    items: list[OUTPUT_BulkItem] = Field(..., description="Результаты в порядке запроса")
+
+
+class OUTPUT_BorrowingReader(BaseModel):
+    id: ID = Field(..., description="ID читателя")
+    name: str = Field(..., description="Имя читателя")
+    email: str = Field(..., description="Email читателя")
+
+
+class OUTPUT_BorrowingBook(BaseModel):
+    id: ID = Field(..., description="ID книги")
+    title: str = Field(..., description="Название книги")
+    author: str = Field(..., description="Автор книги")
+    isbn: str | None = Field(None, description="ISBN книги")
+    year: int | None = Field(None, description="Год издания")
+
+
+class OUTPUT_Borrowing(BaseModel):
+    id: ID = Field(..., description="ID записи выдачи")
+    reader: OUTPUT_BorrowingReader = Field(..., description="Читатель")
+    borrowed_books: list[OUTPUT_BorrowingBook] = Field(..., description="Выданная книга (список из одной книги)")
+    borrow_date: datetime.datetime = Field(..., description="Когда выдана")
+    return_date: datetime.datetime | None = Field(None, description="Когда возвращена")
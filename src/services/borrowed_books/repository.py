@@ -1,180 +1,646 @@
 import datetime
+from functools import lru_cache
 
 import psycopg
 import sqlalchemy
-from sqlalchemy import CursorResult, select, func, Select
+from sqlalchemy import CursorResult, select, func, Select, bindparam, Integer, DateTime, case, tuple_, cast, String, \
+    or_, and_
+from sqlalchemy.dialects.postgresql import ARRAY
 
 from src.core.interfaces import BaseSQLRepository
-from src.core.schemas import borrowed_books, books, readers
+from src.core.schemas import borrowed_books, books, readers, book_stock, BORROWED_LIMIT, XID8
+from src.core.transactions import TransactionPolicy, StaleSnapshot
 from src.core.types import ID, IDModel
 from src.services.books.exc import BookNotFound
-from src.services.borrowed_books.dto.input import INPUT_CreateBorrowedBook, INPUT_ReturnBook
+from src.services.books.repository import book_cache_key, book_quantity, book_is_available
+from src.services.borrowed_books.dto.input import INPUT_CreateBorrowedBook, INPUT_ReturnBook, INPUT_BulkBorrowedBooks, \
+    INPUT_BorrowFilter
+from src.services.borrowed_books.dto.output import OUTPUT_BulkItem, OUTPUT_BulkResult, OUTPUT_Borrowing, \
+    OUTPUT_BorrowingReader, OUTPUT_BorrowingBook
 from src.services.borrowed_books.exc import BorrowedLimitExceeded, ReaderAlreadyHasBook, BorrowNotFound, \
     AllBooksBorrowed
 from src.services.readers.exc import ReaderNotFound
 
 
-class DB_GiveOutBook(BaseSQLRepository):
-    """ Класс отвечает за операцию выдачи книги читателю """
+# Имена параметров не совпадают с колонками borrowed_books:
+# такие имена SQLAlchemy резервирует под VALUES / SET
+READER = bindparam("reader", type_=Integer)
+BOOK = bindparam("book", type_=Integer)
 
-    def _status(self, reader_id: ID, book_id: ID):
-        """ Проверяет есть ли свободные экземпляры книги в наличии у библиотеки,
-        и есть ли экземпляры этой же книги на руках у читателя (нужно для разных ошибок) и возвращает результат.
-        Читатель не может взять одну и ту же книгу больше чем в 1 экземпляре"""
-        check_book = (
-            select(books.c.quantity)
-            .where(books.c.id == book_id)
-            .scalar_subquery()
-        )  # проверка наличия экземпляра у библиотеки
-
-        borrowed_books_list = (
-            select(
-                func.coalesce(
-                    func.json_agg(
-                        func.json_build_object(
-                            "borrowed_id", borrowed_books.c.id,
-                            "borrowed_book_id", borrowed_books.c.book_id
-                        ).label("borrowed_books")
-                    ),
-                    func.json_build_array()
-                ).label("borrowed_books")
-            )
-            .where(borrowed_books.c.reader_id == reader_id)
-            .where(borrowed_books.c.return_date.is_(None))
-            .cte("borrowed_books_list")
-        )  # проверка наличия книги на руках у читателя
+CHECKOUT_POLICY = TransactionPolicy(lock_timeout=3000, retries=3)
+# очередь к строке горячей книги не ждет дольше lock_timeout, а пакетные выдачи разных читателей, взявшие
+# одни книги в разном порядке, после deadlock повторяются: до фиксации эти операции ничего не делают вне базы
 
-        return (
-            select(
-                check_book.label("needed_book_quantity"),
-                borrowed_books_list
-            )
+
+def _slot(book_id, available: bool):
+    """ Слот книги со слотами (book_stock) для выдачи (непустой) или возврата.
+    Берется первый слот, не заблокированный параллельными выдачами (SKIP LOCKED), и только если все подходящие
+    заняты - первый по порядку с ожиданием. Строка слота блокируется до конца транзакции.
+    Блокировка берется до LIMIT: слот, опустевший за время ожидания, пропускается и берется следующий.
+    Слоты, пополненные после начала запроса, его снимок не видит: NULL при остатке в них выдача ловит
+    по остатку из снимка и повторяет (StaleSnapshot).
+    NULL, если у книги нет слотов (обычный остаток в books) """
+    candidates = (
+        select(book_stock.c.slot)
+        .where(book_stock.c.book_id == book_id)
+        .order_by(book_stock.c.slot)
+        .limit(1)
+    )
+    if available:
+        candidates = candidates.where(book_stock.c.quantity > 0)
+    return func.coalesce(
+        candidates.with_for_update(skip_locked=True).scalar_subquery(),
+        candidates.with_for_update().scalar_subquery()  # вычисляется, только если первый ничего не нашел
+    )
+
+
+def _give_out():
+    """ Выдача одним запросом. Экземпляр списывается условным UPDATE (quantity > 0),
+    поэтому параллельные выдачи одной книги не уводят количество в минус.
+    У книги со слотами списывается из свободного слота, а строка books не меняется.
+    Лимит и то, что этой книги у читателя еще нет, проверяются по снимку запроса, а счетчик readers.open_loans
+    увеличивается, только если он все еще равен значению из снимка. Параллельная выдача (или возврат)
+    тому же читателю меняет счетчик: после ожидания блокировки строка читателя перепроверяется и не обновляется,
+    а взятый экземпляр без учтенной выдачи значит, что снимок устарел - вызов повторяется (StaleSnapshot)
+    и видит чужую выдачу. Уникальный индекс тут не помог бы: borrowed_books секционирована по borrow_date.
+    Возвращает ID выдачи и код результата (нужен для разных ошибок) """
+    has_book = (
+        select(borrowed_books.c.id)
+        .where(borrowed_books.c.reader_id == READER)
+        .where(borrowed_books.c.book_id == BOOK)
+        .where(borrowed_books.c.return_date.is_(None))
+        .exists()
+    )
+    reader = (
+        select(readers.c.id, readers.c.open_loans, has_book.label("has_book"))
+        .where(readers.c.id == READER)
+        .cte("reader")
+    )  # состояние читателя: сколько книг на руках и есть ли уже эта
+
+    allowed = (
+        select(reader.c.id)
+        .where(reader.c.open_loans < BORROWED_LIMIT)
+        .where(~reader.c.has_book)
+        .exists()
+    )
+    unstriped = (
+        books
+        .update()
+        .values(quantity=books.c.quantity - 1)
+        .where(books.c.id == BOOK)
+        .where(books.c.stock_slots == 0)
+        .where(books.c.quantity > 0)
+        .where(allowed)
+        .returning(books.c.id)
+    )  # уменьшаем в библиотеке, только если экземпляр есть и читателю можно выдать
+    striped = (
+        book_stock
+        .update()
+        .values(quantity=book_stock.c.quantity - 1)
+        .where(allowed)
+        .where(book_stock.c.book_id == BOOK)
+        .where(book_stock.c.slot == _slot(BOOK, available=True))
+        .where(book_stock.c.quantity > 0)
+        .returning(book_stock.c.book_id.label("id"))
+    )  # или в одном из слотов
+    book = (
+        select(unstriped.cte("unstriped"))
+        .union_all(select(striped.cte("striped")))
+        .cte("book")
+    )
+
+    counted = (
+        readers
+        .update()
+        .values(open_loans=readers.c.open_loans + 1)
+        .where(readers.c.id == READER)
+        .where(readers.c.open_loans == select(reader.c.open_loans).scalar_subquery())
+        .where(select(book.c.id).exists())
+        .returning(readers.c.id)
+        .cte("counted")
+    )  # строка читателя блокируется до конца транзакции; счетчик, измененный после снимка, не трогаем
+
+    loan = (
+        borrowed_books
+        .insert()
+        .from_select(
+            ["reader_id", "book_id", "borrow_date"],
+            select(READER, book.c.id, func.localtimestamp()).where(select(counted.c.id).exists())
         )
+        .returning(borrowed_books.c.id)
+        .cte("loan")
+    )  # увеличиваем долг читателя
+
+    quantity = select(book_quantity).where(books.c.id == BOOK).scalar_subquery()  # до списания
+    return select(
+        select(loan.c.id).scalar_subquery().label("id"),
+        case(
+            (select(loan.c.id).exists(), "ok"),
+            (select(book.c.id).exists(), "contended"),  # экземпляр взят, а счетчик читателя изменился после снимка
+            (quantity.is_(None), "book_not_found"),
+            (quantity == 0, "all_borrowed"),
+            (select(reader.c.open_loans).scalar_subquery() >= BORROWED_LIMIT, "limit_exceeded"),
+            (select(reader.c.has_book).scalar_subquery(), "already_has_book"),
+            (~select(reader.c.id).exists(), "reader_not_found"),
+            (select(books.c.stock_slots).where(books.c.id == BOOK).scalar_subquery() > 0, "contended"),
+            else_="all_borrowed"  # последний экземпляр забрали параллельной выдачей
+        ).label("status")
+    ).add_cte(counted)
+
+
+class DB_GiveOutBook(BaseSQLRepository):
+    """ Класс отвечает за операцию выдачи книги читателю """
+
+    transaction = CHECKOUT_POLICY
 
-    def _save_borrowed_book_stmt(self, reader_id: ID, book_id: ID):
-        """ Уменьшает доступные экземпляры на 1 и отдает книгу читателю, записывая ее ему в долги"""
-        book_cte = (
-            books
-            .update()
-            .values(quantity=books.c.quantity - 1)
-            .where(books.c.id == book_id)
-            .returning(books.c.id)
-            .cte("book_cte")
-        )  # уменьшаем в библиотеке
-
-        return (
-            borrowed_books
-            .insert()
-            .values(reader_id=reader_id, book_id=select(book_cte.c.id).scalar_subquery())
-            .returning(borrowed_books.c.id)
-        )  # увеличиваем долг читателя
+    _stmt = _give_out()
 
     async def __call__(self, model: INPUT_CreateBorrowedBook):
         async with self.engine.connect() as connection:
-            cursor: CursorResult = await connection.execute(self._status(model.reader_id, model.book_id))
-            status = cursor.mappings().fetchone()
-            if status["needed_book_quantity"] is None:  # Если книги нет вообще
-                raise BookNotFound(model.book_id)
-            if status["needed_book_quantity"] == 0:  # Если все экземпляры книги на руках
-                raise AllBooksBorrowed(model.book_id)
-            if len(status["borrowed_books"]) == 3:  # Если читатель уже торчит 3 книги
-                raise BorrowedLimitExceeded(model.reader_id)
-            if model.book_id in [
-                borrowed_book["borrowed_book_id"]
-                for borrowed_book
-                in status["borrowed_books"]
-            ]:  # Если эта книга уже у читателя есть
-                raise ReaderAlreadyHasBook(model.reader_id, model.book_id)
             try:
-                cursor = await connection.execute(self._save_borrowed_book_stmt(model.reader_id, model.book_id))
-                await connection.commit()
-                return IDModel(id=cursor.scalar())
+                cursor: CursorResult = await connection.execute(
+                    self._stmt,
+                    {"reader": model.reader_id, "book": model.book_id}
+                )
             except sqlalchemy.exc.IntegrityError as e:
-                if isinstance(e.orig, psycopg.errors.ForeignKeyViolation):  # Если читатель не найден
+                if isinstance(e.orig, psycopg.errors.ForeignKeyViolation):  # Если читателя удалили параллельно
+                    raise ReaderNotFound(model.reader_id)
+                if isinstance(e.orig, psycopg.errors.CheckViolation):  # Лимит добрали параллельной выдачей
+                    raise BorrowedLimitExceeded(model.reader_id)
+                raise
+            result = cursor.mappings().fetchone()
+            match result["status"]:
+                case "book_not_found":  # Если книги нет вообще
+                    raise BookNotFound(model.book_id)
+                case "all_borrowed":  # Если все экземпляры книги на руках
+                    raise AllBooksBorrowed(model.book_id)
+                case "limit_exceeded":  # Если читатель уже торчит 3 книги
+                    raise BorrowedLimitExceeded(model.reader_id)
+                case "already_has_book":  # Если эта книга уже у читателя есть
+                    raise ReaderAlreadyHasBook(model.reader_id, model.book_id)
+                case "reader_not_found":
                     raise ReaderNotFound(model.reader_id)
+                case "contended":  # Снимок устарел: читателю параллельно выдали или вернули книгу,
+                    raise StaleSnapshot()  # либо экземпляры в слотах разобрали, а пополненных снимок не видит
+            await connection.commit()
+        await self.cache.delete(book_cache_key(model.book_id))
+        return IDModel(id=result["id"])
+
+
+def _return_book():
+    """ Возвращает книгу обратно в библиотеку """
+    # время возврата - по часам базы, как и borrow_date: сдвиг часов приложения не сделает возврат раньше выдачи
+    add_return_date = (
+        borrowed_books
+        .update()
+        .values(return_date=func.localtimestamp())
+        .where(borrowed_books.c.id == bindparam("borrow_id", type_=Integer))
+        .where(borrowed_books.c.return_date.is_(None))
+        .returning(borrowed_books.c.book_id, borrowed_books.c.reader_id)
+        .cte("add_return_date")
+    )  # фиксируем когда читатель отдал книгу (параллельный возврат той же выдачи ничего не изменит)
+
+    uncounted = (
+        readers
+        .update()
+        .values(open_loans=readers.c.open_loans - 1)
+        .where(readers.c.id == select(add_return_date.c.reader_id).scalar_subquery())
+        .cte("uncounted")
+    )  # уменьшаем счетчик книг на руках
+
+    returned_book = select(add_return_date.c.book_id).scalar_subquery()
+    restocked_slot = (
+        book_stock
+        .update()
+        .values(quantity=book_stock.c.quantity + 1)
+        .where(book_stock.c.book_id == returned_book)
+        .where(book_stock.c.slot == _slot(returned_book, available=False))
+        .returning(book_stock.c.book_id)
+        .cte("restocked_slot")
+    )  # у книги со слотами - в любой свободный слот
+    restocked = (
+        books
+        .update()
+        .values(quantity=books.c.quantity + 1)
+        .where(books.c.id == returned_book)
+        .where(books.c.stock_slots == 0)
+        .returning(books.c.id)
+        .cte("restocked")
+    )  # прибавляем экземпляр в библиотеке
+
+    # Книгу, которую переключают между quantity и слотами, снимок запроса видит в старом режиме,
+    # а обновление после ожидания блокировки - уже в новом: экземпляр некуда вернуть, вызов нужно повторить
+    return select(
+        select(add_return_date.c.book_id).exists().label("returned"),
+        or_(select(restocked.c.id).exists(), select(restocked_slot.c.book_id).exists()).label("restocked")
+    ).add_cte(uncounted)
 
 
 class DB_ReturnBook(BaseSQLRepository):
     """ Класс отвечает за операцию возврата книги в библиотеку """
 
-    def _status(self, reader_id: ID, book_id: ID):
-        """ Проверяет есть ли данная книга на руках у читателя """
+    transaction = CHECKOUT_POLICY
 
-        return (
-            select(borrowed_books.c.id)
-            .where(borrowed_books.c.book_id == book_id)
-            .where(borrowed_books.c.reader_id == reader_id)
-            .where(borrowed_books.c.return_date.is_(None))
-        )
-
-    def _stmt(self, borrow_id: ID):
-        """ Возвращает книгу обратно в библиотеку """
-        add_return_date = (
-            borrowed_books
-            .update()
-            .values(return_date=datetime.datetime.now())
-            .where(borrowed_books.c.id == borrow_id)
-            .returning(borrowed_books.c.book_id)
-            .cte("add_return_date")
-        )  # фиксируем когда читатель отдал книгу
-
-        return (
-            books
-            .update()
-            .values(quantity=books.c.quantity + 1)
-            .where(books.c.id == select(add_return_date.c.book_id).scalar_subquery())
-        )  # прибавляем экземпляр в библиотеке
+    _status = (
+        select(borrowed_books.c.id)
+        .where(borrowed_books.c.book_id == BOOK)
+        .where(borrowed_books.c.reader_id == READER)
+        .where(borrowed_books.c.return_date.is_(None))
+    )  # есть ли данная книга на руках у читателя
+    _stmt = _return_book()
 
     async def __call__(self, model: INPUT_ReturnBook):
         async with self.engine.connect() as connection:
-            cursor: CursorResult = await connection.execute(self._status(model.reader_id, model.book_id))
+            cursor: CursorResult = await connection.execute(
+                self._status,
+                {"reader": model.reader_id, "book": model.book_id}
+            )
             borrow_id = cursor.scalar()
             if borrow_id is None:  # если такой задолженности нет (либо читателя не существует)
                 raise BorrowNotFound(model.reader_id, model.book_id)
-            await connection.execute(self._stmt(borrow_id))
+            cursor = await connection.execute(
+                self._stmt,
+                {"borrow_id": borrow_id}
+            )
+            result = cursor.mappings().fetchone()
+            # выдачу вернули параллельно после проверки (повтор ответит 404),
+            # или закоммичено переключение режима остатка
+            if not result["returned"] or not result["restocked"]:
+                raise StaleSnapshot()
             await connection.commit()
+        await self.cache.delete(book_cache_key(model.book_id))
 
 
-class DB_GetBorrowList(BaseSQLRepository):
-    async def __call__(self, skip: int, limit: int, no_returned_only: bool):
+def _requested_books():
+    """ ID книг из запроса без повторов, с позицией первого вхождения """
+    requested = (
+        func.unnest(bindparam("book_ids", type_=ARRAY(Integer)))
+        .table_valued("book_id", with_ordinality="position")
+        .render_derived()
+    )
+    return (
+        select(requested.c.book_id, func.min(requested.c.position).label("position"))
+        .group_by(requested.c.book_id)
+        .cte("requested")
+    )
+
+
+def _bulk_give_out():
+    """ Выдача нескольких книг одним читателю одним запросом.
+    Лимит проверяется один раз на всю пачку: счетчик книг на руках + книги, которые можно выдать.
+    Как и при одиночной выдаче, книги на руках и счетчик берутся из снимка, а счетчик обновляется, только если
+    с тех пор не менялся: иначе выдачи не записываются, а взятые экземпляры значат устаревший снимок (stale).
+    Книги, которые выдать нельзя, не мешают выдаче остальных, для каждой возвращается код результата """
+    requested = _requested_books()
+    held = (
+        select(borrowed_books.c.book_id)
+        .where(borrowed_books.c.reader_id == READER)
+        .where(borrowed_books.c.return_date.is_(None))
+        .cte("held")
+    )  # книги на руках у читателя
+    eligible = (
+        select(requested.c.book_id)
+        .join(books, books.c.id == requested.c.book_id)
+        .where(book_is_available)
+        .where(requested.c.book_id.not_in(select(held.c.book_id)))
+        .cte("eligible")
+    )  # книги, которые можно выдать
+    reader = (
+        select(
+            readers.c.id,
+            readers.c.open_loans,
+            (
+                readers.c.open_loans + select(func.count()).select_from(eligible).scalar_subquery()
+                <= BORROWED_LIMIT
+            ).label("within_limit")
+        )
+        .where(readers.c.id == READER)
+        .cte("reader")
+    )
+    within_limit = select(reader.c.id).where(reader.c.within_limit).exists()
+    unstriped = (
+        books
+        .update()
+        .values(quantity=books.c.quantity - 1)
+        .where(books.c.id == eligible.c.book_id)
+        .where(books.c.stock_slots == 0)
+        .where(books.c.quantity > 0)
+        .where(within_limit)
+        .returning(books.c.id)
+    )  # уменьшаем в библиотеке
+    slots = (
+        select(eligible.c.book_id, _slot(eligible.c.book_id, available=True).label("slot"))
+        .where(within_limit)
+        .cte("slots")
+    )  # CTE вычисляется один раз: по одному заблокированному слоту на книгу со слотами
+    striped = (
+        book_stock
+        .update()
+        .values(quantity=book_stock.c.quantity - 1)
+        .where(book_stock.c.book_id == slots.c.book_id)
+        .where(book_stock.c.slot == slots.c.slot)
+        .where(book_stock.c.quantity > 0)
+        .returning(book_stock.c.book_id.label("id"))
+    )
+    taken = (
+        select(unstriped.cte("unstriped"))
+        .union_all(select(striped.cte("striped")))
+        .cte("taken")
+    )
+    counted = (
+        readers
+        .update()
+        .values(open_loans=readers.c.open_loans + select(func.count()).select_from(taken).scalar_subquery())
+        .where(readers.c.id == READER)
+        .where(readers.c.open_loans == select(reader.c.open_loans).scalar_subquery())
+        .where(select(taken.c.id).exists())
+        .returning(readers.c.id)
+        .cte("counted")
+    )  # счетчик книг на руках; измененный после снимка параллельной выдачей или возвратом не трогаем
+    loans = (
+        borrowed_books
+        .insert()
+        .from_select(
+            ["reader_id", "book_id", "borrow_date"],
+            select(READER, taken.c.id, func.localtimestamp()).where(select(counted.c.id).exists())
+        )
+        .returning(borrowed_books.c.id, borrowed_books.c.book_id)
+        .cte("loans")
+    )  # увеличиваем долг читателя
+    return (
+        select(
+            requested.c.book_id,
+            loans.c.id.label("borrow_id"),
+            case(
+                (loans.c.id.isnot(None), "ok"),
+                (books.c.id.is_(None), "book_not_found"),
+                (requested.c.book_id.in_(select(held.c.book_id)), "already_has_book"),
+                (and_(books.c.stock_slots > 0, requested.c.book_id.in_(select(eligible.c.book_id))), "contended"),
+                else_="all_borrowed"
+            ).label("status"),
+            select(reader.c.id).exists().label("reader_found"),
+            select(reader.c.within_limit).scalar_subquery().label("within_limit"),
+            and_(select(taken.c.id).exists(), ~select(counted.c.id).exists()).label("stale")
+        )
+        .select_from(
+            requested
+            .outerjoin(books, books.c.id == requested.c.book_id)
+            .outerjoin(loans, loans.c.book_id == requested.c.book_id)
+        )
+        .order_by(requested.c.position)
+        .add_cte(counted)
+    )
+
+
+class DB_GiveOutBooks(BaseSQLRepository):
+    """ Класс отвечает за выдачу нескольких книг читателю в одной транзакции """
+
+    transaction = CHECKOUT_POLICY
+
+    _stmt = _bulk_give_out()
+
+    async def __call__(self, model: INPUT_BulkBorrowedBooks):
         async with self.engine.connect() as connection:
-            cursor: CursorResult = await connection.execute(self._stmt(skip, limit, no_returned_only))
-            return cursor.mappings().fetchall()
+            try:
+                cursor: CursorResult = await connection.execute(
+                    self._stmt,
+                    {"reader": model.reader_id, "book_ids": model.book_ids}
+                )
+            except sqlalchemy.exc.IntegrityError as e:
+                if isinstance(e.orig, psycopg.errors.ForeignKeyViolation):  # Если читателя удалили параллельно
+                    raise ReaderNotFound(model.reader_id)
+                if isinstance(e.orig, psycopg.errors.CheckViolation):  # Лимит добрали параллельной выдачей
+                    raise BorrowedLimitExceeded(model.reader_id)
+                raise
+            result = cursor.mappings().fetchall()
+            if not result[0]["reader_found"]:
+                raise ReaderNotFound(model.reader_id)
+            if not result[0]["within_limit"]:
+                raise BorrowedLimitExceeded(model.reader_id)
+            if result[0]["stale"] or any(item["status"] == "contended" for item in result):  # как при одиночной
+                raise StaleSnapshot()
+            await connection.commit()
+        errors = {
+            "book_not_found": lambda book_id: BookNotFound(book_id),
+            "all_borrowed": lambda book_id: AllBooksBorrowed(book_id),
+            "already_has_book": lambda book_id: ReaderAlreadyHasBook(model.reader_id, book_id)
+        }
+        items = []
+        for item in result:
+            if item["status"] == "ok":
+                items.append(OUTPUT_BulkItem(book_id=item["book_id"], borrow_id=item["borrow_id"], status_code=201))
+            else:
+                error = errors[item["status"]](item["book_id"])
+                items.append(
+                    OUTPUT_BulkItem(book_id=item["book_id"], status_code=error.status_code, detail=error.detail)
+                )
+        await self.cache.delete(*[book_cache_key(item.book_id) for item in items if item.borrow_id is not None])
+        return OUTPUT_BulkResult(items=items)
+
+
+def _bulk_return():
+    """ Возврат нескольких книг читателя одним запросом """
+    requested = _requested_books()
+    returned = (
+        borrowed_books
+        .update()
+        .values(return_date=func.localtimestamp())
+        .where(borrowed_books.c.reader_id == READER)
+        .where(borrowed_books.c.return_date.is_(None))
+        .where(borrowed_books.c.book_id.in_(select(requested.c.book_id)))
+        .returning(borrowed_books.c.id, borrowed_books.c.book_id)
+        .cte("returned")
+    )  # фиксируем когда читатель отдал книги, по часам базы, как и при одиночном возврате
+    restocked = (
+        books
+        .update()
+        .values(quantity=books.c.quantity + 1)
+        .where(books.c.id == returned.c.book_id)
+        .where(books.c.stock_slots == 0)
+        .returning(books.c.id)
+        .cte("restocked")
+    )  # прибавляем экземпляры в библиотеке
+    slots = (
+        select(returned.c.book_id, _slot(returned.c.book_id, available=False).label("slot"))
+        .cte("slots")
+    )
+    restocked_slots = (
+        book_stock
+        .update()
+        .values(quantity=book_stock.c.quantity + 1)
+        .where(book_stock.c.book_id == slots.c.book_id)
+        .where(book_stock.c.slot == slots.c.slot)
+        .returning(book_stock.c.book_id)
+        .cte("restocked_slots")
+    )  # у книг со слотами - в свободный слот
+    uncounted = (
+        readers
+        .update()
+        .values(open_loans=readers.c.open_loans - select(func.count()).select_from(returned).scalar_subquery())
+        .where(readers.c.id == READER)
+        .where(select(returned.c.id).exists())
+        .cte("uncounted")
+    )  # уменьшаем счетчик книг на руках
+    return (
+        select(
+            requested.c.book_id,
+            returned.c.id.label("borrow_id"),
+            or_(
+                requested.c.book_id.in_(select(restocked.c.id)),
+                requested.c.book_id.in_(select(restocked_slots.c.book_id))
+            ).label("restocked")  # как и при одиночном возврате, False у книги, режим которой переключили
+        )
+        .select_from(requested.outerjoin(returned, returned.c.book_id == requested.c.book_id))
+        .order_by(requested.c.position)
+        .add_cte(uncounted)
+    )
+
+
+class DB_ReturnBooks(BaseSQLRepository):
+    """ Класс отвечает за возврат нескольких книг читателя в одной транзакции """
 
-    def _stmt(self, skip: int, limit: int, no_returned_only: bool):
-        stmt: Select = (
+    transaction = CHECKOUT_POLICY
+
+    _stmt = _bulk_return()
+
+    async def __call__(self, model: INPUT_BulkBorrowedBooks):
+        async with self.engine.connect() as connection:
+            cursor: CursorResult = await connection.execute(
+                self._stmt,
+                {"reader": model.reader_id, "book_ids": model.book_ids}
+            )
+            result = cursor.mappings().fetchall()
+            if any(item["borrow_id"] is not None and not item["restocked"] for item in result):
+                raise StaleSnapshot()
+            await connection.commit()
+        items = []
+        for item in result:
+            if item["borrow_id"] is not None:
+                items.append(OUTPUT_BulkItem(book_id=item["book_id"], borrow_id=item["borrow_id"], status_code=204))
+            else:
+                error = BorrowNotFound(model.reader_id, item["book_id"])
+                items.append(
+                    OUTPUT_BulkItem(book_id=item["book_id"], status_code=error.status_code, detail=error.detail)
+                )
+        await self.cache.delete(*[book_cache_key(item.book_id) for item in items if item.borrow_id is not None])
+        return OUTPUT_BulkResult(items=items)
+
+
+class DB_ExportBorrowings(BaseSQLRepository):
+    """ Выгрузка истории выдач (или изменившейся с отметки `changed_since`) серверным курсором """
+
+    fields = ("id", "book_id", "reader_id", "borrow_date", "return_date", "updated_at")
+    _stmt = (
+        select(*[borrowed_books.c[field] for field in fields])
+        .order_by(borrowed_books.c.id)
+    )
+    _changed_since_stmt = _stmt.where(
+        borrowed_books.c.change_xid >= cast(bindparam("changed_since", type_=String), XID8)
+    )  # xid8 не приводится из числа, только из текста
+
+    async def __call__(self, changed_since: int | None = None):
+        """ Возвращает отметку для следующей выгрузки и поток пачек записей """
+        watermark = await self._watermark()  # до запроса выгрузки: ее снимок позже отметки
+        if changed_since is None:
+            return watermark, self._stream(self._stmt)
+        return watermark, self._stream(self._changed_since_stmt, {"changed_since": str(changed_since)})
+
+
+class DB_GetBorrowList(BaseSQLRepository):
+    """ Список выдач, новые сначала. Плоские колонки, модели собираются в Python.
+    Страницы по (borrow_date, id) по индексу borrowed_books_borrow_date_id_idx """
+
+    @staticmethod
+    @lru_cache
+    def _stmt(
+            reader: bool,
+            book: bool,
+            borrowed_from: bool,
+            borrowed_to: bool,
+            no_returned_only: bool,
+            after: bool
+    ) -> Select:
+        """ Форма запроса зависит только от набора фильтров, каждая собирается один раз """
+        stmt = (
             select(
                 borrowed_books.c.id,
-                func.json_build_object(
-                    "id", readers.c.id,
-                    "name", readers.c.name,
-                    "email", readers.c.email
-                ).label("reader"),
-                func.coalesce(
-                    func.json_agg(
-                        func.json_build_object(
-                            "id", books.c.id,
-                            "title", books.c.title,
-                            "author", books.c.author,
-                            "isbn", books.c.isbn,
-                            "year", books.c.year
-                        )
-                    ),
-                    func.json_build_array()
-                ).label("borrowed_books"),
                 borrowed_books.c.borrow_date,
-                borrowed_books.c.return_date
+                borrowed_books.c.return_date,
+                readers.c.id.label("reader_id"),
+                readers.c.name.label("reader_name"),
+                readers.c.email.label("reader_email"),
+                books.c.id.label("book_id"),
+                books.c.title,
+                books.c.author,
+                books.c.isbn,
+                books.c.year
             )
             .join(readers, borrowed_books.c.reader_id == readers.c.id)
             .join(books, borrowed_books.c.book_id == books.c.id)
+            .order_by(borrowed_books.c.borrow_date.desc(), borrowed_books.c.id.desc())
+            .limit(bindparam("limit", type_=Integer))
         )
+        if reader:
+            stmt = stmt.where(borrowed_books.c.reader_id == READER)
+        if book:
+            stmt = stmt.where(borrowed_books.c.book_id == BOOK)
+        if borrowed_from:
+            stmt = stmt.where(borrowed_books.c.borrow_date >= bindparam("borrowed_from", type_=DateTime))
+        if borrowed_to:
+            stmt = stmt.where(borrowed_books.c.borrow_date < bindparam("borrowed_to", type_=DateTime))
         if no_returned_only:
             stmt = stmt.where(borrowed_books.c.return_date.is_(None))
-        stmt = stmt.offset(skip).limit(limit)
-        stmt = stmt.group_by(
-            borrowed_books.c.id,
-            readers.c.id,
-            borrowed_books.c.borrow_date,
-            borrowed_books.c.return_date
+        if not after:
+            return stmt.offset(bindparam("skip", type_=Integer))
+        return stmt.where(
+            tuple_(borrowed_books.c.borrow_date, borrowed_books.c.id)
+            < tuple_(bindparam("after_date", type_=DateTime), bindparam("after_id", type_=Integer))
+        )  # keyset: продолжаем сразу после последней (borrow_date, id)
+
+    async def __call__(
+            self,
+            skip: int,
+            limit: int,
+            filters: INPUT_BorrowFilter,
+            after: tuple[datetime.datetime, ID] | None = None
+    ):
+        stmt = self._stmt(
+            filters.reader_id is not None,
+            filters.book_id is not None,
+            filters.borrowed_from is not None,
+            filters.borrowed_to is not None,
+            filters.no_returned_only,
+            after is not None
         )
-        return stmt
+        parameters = {
+            "limit": limit,
+            "reader": filters.reader_id,
+            "book": filters.book_id,
+            "borrowed_from": filters.borrowed_from,
+            "borrowed_to": filters.borrowed_to
+        }
+        if after is None:
+            parameters["skip"] = skip
+        else:
+            parameters["after_date"], parameters["after_id"] = after
+        async with self.engine.connect() as connection:
+            cursor: CursorResult = await connection.execute(stmt, parameters)
+            result = cursor.mappings().fetchall()
+        return [
+            OUTPUT_Borrowing(
+                id=row["id"],
+                reader=OUTPUT_BorrowingReader(id=row["reader_id"], name=row["reader_name"], email=row["reader_email"]),
+                borrowed_books=[
+                    OUTPUT_BorrowingBook(
+                        id=row["book_id"],
+                        title=row["title"],
+                        author=row["author"],
+                        isbn=row["isbn"],
+                        year=row["year"]
+                    )
+                ],
+                borrow_date=row["borrow_date"],
+                return_date=row["return_date"]
+            )
+            for row in result
+        ]
@@ -1,10 +1,16 @@
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Query
 from starlette import status
+from starlette.responses import StreamingResponse, Response
 
+from src.core.pagination import paginate
 from src.core.security import TokenManager
+from src.core.streaming import ExportFormat, WATERMARK_HEADER
 from src.core.types import ID, IDModel
-from src.services.borrowed_books.dto.input import INPUT_CreateBorrowedBook, INPUT_ReturnBook
-from src.services.borrowed_books.service import SERVICE_GiveOutBook, SERVICE_ReturnBook, SERVICE_GetBorrowList
+from src.services.borrowed_books.dto.input import INPUT_CreateBorrowedBook, INPUT_ReturnBook, INPUT_BulkBorrowedBooks, \
+    INPUT_BorrowFilter
+from src.services.borrowed_books.dto.output import OUTPUT_BulkResult, OUTPUT_Borrowing
+from src.services.borrowed_books.service import SERVICE_GiveOutBook, SERVICE_ReturnBook, SERVICE_GetBorrowList, \
+    SERVICE_ExportBorrowings, SERVICE_GiveOutBooks, SERVICE_ReturnBooks
 
 borrowed_book_router = APIRouter(prefix="/borrowed_books", tags=["Выданные книги"])
 
@@ -51,23 +57,98 @@ async def return_book(
     return await service(client_id, model)
 
 
+@borrowed_book_router.post(
+    "/bulk",
+    status_code=status.HTTP_200_OK,
+    summary="Выдать несколько книг",
+    description="""
+    Функция выдает читателю несколько книг в одной транзакции.
+    Лимит в 3 книги проверяется один раз на всю пачку:
+    если книг на руках вместе с выдаваемыми больше 3х вернет ошибку 400 и не выдаст ничего.
+    Если читатель не найден вернет ошибку 404.
+    Остальные ошибки (нет книги, все экземпляры на руках, книга уже у читателя) не мешают выдаче других книг
+    и возвращаются для каждой книги отдельно, с теми же кодами, что у одиночной выдачи.
+    """,
+    response_model=OUTPUT_BulkResult
+)
+async def give_out_books(
+        model: INPUT_BulkBorrowedBooks,
+        service: SERVICE_GiveOutBooks = Depends(),
+        client_id: ID = Depends(TokenManager.decode)
+):
+    return await service(client_id, model)
+
+
+@borrowed_book_router.patch(
+    "/bulk",
+    status_code=status.HTTP_200_OK,
+    summary="Вернуть несколько книг",
+    description="""
+    Функция забирает у читателя несколько книг в одной транзакции.
+    Для каждой книги возвращает результат: 204 если книга возвращена, 404 если такой задолженности нет.
+    """,
+    response_model=OUTPUT_BulkResult
+)
+async def return_books(
+        model: INPUT_BulkBorrowedBooks,
+        service: SERVICE_ReturnBooks = Depends(),
+        client_id: ID = Depends(TokenManager.decode)
+):
+    return await service(client_id, model)
+
+
 @borrowed_book_router.get(
     "/",
     status_code=status.HTTP_200_OK,
     summary="Список задолженностей",
     description="""
-    Функция возвращает список задолженностей.
+    Функция возвращает список выдач, новые сначала.
     С включенной опцией `no_returned_only` возвращает только непогашенные.
     С выключенной возвращает все записи.
-    Есть функционал пагинации SKIP/LIMIT.
     По умолчанию опция выключена.
+    Фильтры `reader_id`, `book_id` и период выдачи `borrowed_from` - `borrowed_to` (конец не включается)
+    необязательны и комбинируются.
+    Есть функционал SKIP/LIMIT для пагинации (оставлен для старых клиентов).
+    Для длинной истории используйте курсор: если страница заполнена целиком,
+    в заголовке `X-Next-Cursor` придет курсор следующей страницы, его нужно передать в параметр `after`
+    (при переданном `after` параметр `skip` игнорируется).
+    Невалидный курсор вернет ошибку 400.
     """,
-    dependencies=[Depends(TokenManager.decode)]
+    dependencies=[Depends(TokenManager.decode)],
+    response_model=list[OUTPUT_Borrowing]
 )
 async def get_borrow_list(
+        response: Response,
         skip: int = 0,
         limit: int = 50,
-        no_returned_only: bool = False,
+        after: str | None = None,
+        filters: INPUT_BorrowFilter = Depends(),
         service: SERVICE_GetBorrowList = Depends()
 ):
-    return await service(skip, limit, no_returned_only)
+    result = await service(skip, limit, filters, after)
+    return paginate(response, result, limit, lambda borrowing: (borrowing.borrow_date, borrowing.id))
+
+
+@borrowed_book_router.get(
+    "/export",
+    status_code=status.HTTP_200_OK,
+    summary="Выгрузить историю выдач",
+    description="""
+    Функция потоком выгружает все записи о выдачах в формате NDJSON (по умолчанию) или CSV с заголовком.
+    Память сервера не зависит от размера истории.
+    В заголовке `X-Export-Watermark` придет отметка: с параметром `changed_since` = отметке прошлой выгрузки
+    выгрузятся только записи, созданные или измененные (возврат книги) после нее.
+    Запись, которую меняли во время прошлой выгрузки, можно получить повторно: записи нужно сливать по `id`.
+    """,
+    dependencies=[Depends(TokenManager.decode)],
+    response_class=StreamingResponse
+)
+async def export_borrowings(
+        export_format: ExportFormat = Query(ExportFormat.ndjson, alias="format"),
+        changed_since: int | None = Query(None, ge=0),
+        service: SERVICE_ExportBorrowings = Depends()
+):
+    watermark, content = await service(export_format, changed_since)
+    return StreamingResponse(
+        content, media_type=export_format.media_type, headers={WATERMARK_HEADER: str(watermark)}
+    )
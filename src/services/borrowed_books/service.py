@@ -1,10 +1,16 @@
+import datetime
+
 from fastapi import Depends
 from loguru import logger
 
 from src.core.interfaces import BaseService
+from src.core.pagination import Cursor
+from src.core.streaming import ExportFormat, encode_records
 from src.core.types import ID
-from src.services.borrowed_books.dto.input import INPUT_CreateBorrowedBook, INPUT_ReturnBook
-from src.services.borrowed_books.repository import DB_GiveOutBook, DB_ReturnBook, DB_GetBorrowList
+from src.services.borrowed_books.dto.input import INPUT_CreateBorrowedBook, INPUT_ReturnBook, INPUT_BulkBorrowedBooks, \
+    INPUT_BorrowFilter
+from src.services.borrowed_books.repository import DB_GiveOutBook, DB_ReturnBook, DB_GetBorrowList, \
+    DB_ExportBorrowings, DB_GiveOutBooks, DB_ReturnBooks
 
 
 class SERVICE_GiveOutBook(BaseService):
@@ -36,6 +42,34 @@ class SERVICE_ReturnBook(BaseService):
         return result
 
 
+class SERVICE_GiveOutBooks(BaseService):
+    def __init__(
+            self,
+            give_out_books_repository: DB_GiveOutBooks = Depends()
+    ):
+        super().__init__()
+        self._give_out_books_repository = give_out_books_repository
+
+    async def __call__(self, client_id: ID, model: INPUT_BulkBorrowedBooks):
+        result = await self._give_out_books_repository(model)
+        given = [item.book_id for item in result.items if item.borrow_id is not None]
+        logger.info(f"Библиотекарь с ID {client_id} выдал читателю с ID {model.reader_id} книги с ID {given}")
+        return result
+
+
+class SERVICE_ReturnBooks(BaseService):
+    def __init__(
+            self,
+            return_books_repository: DB_ReturnBooks = Depends()
+    ):
+        super().__init__()
+        self._return_books_repository = return_books_repository
+
+    async def __call__(self, client_id: ID, model: INPUT_BulkBorrowedBooks):
+        result = await self._return_books_repository(model)
+        return result
+
+
 class SERVICE_GetBorrowList(BaseService):
     def __init__(
             self,
@@ -44,6 +78,20 @@ class SERVICE_GetBorrowList(BaseService):
         super().__init__()
         self._get_borrow_list_repository = get_borrow_list_repository
 
-    async def __call__(self, skip: int, limit: int, no_returned_only: bool):
-        result = await self._get_borrow_list_repository(skip, limit, no_returned_only)
+    async def __call__(self, skip: int, limit: int, filters: INPUT_BorrowFilter, after: str | None = None):
+        key = Cursor.decode(after, tuple[datetime.datetime, ID]) if after else None
+        result = await self._get_borrow_list_repository(skip, limit, filters, key)
         return result
+
+
+class SERVICE_ExportBorrowings(BaseService):
+    def __init__(
+            self,
+            export_borrowings_repository: DB_ExportBorrowings = Depends()
+    ):
+        super().__init__()
+        self._export_borrowings_repository = export_borrowings_repository
+
+    async def __call__(self, export_format: ExportFormat, changed_since: int | None):
+        watermark, partitions = await self._export_borrowings_repository(changed_since)
+        return watermark, encode_records(partitions, export_format, DB_ExportBorrowings.fields)
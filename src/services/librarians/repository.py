@@ -10,18 +10,16 @@ from src.services.librarians.exc import LibrarianAlreadyExists
 
 
 class DB_CreateLibrarian(BaseSQLRepository):
-    def _stmt(self, model: INPUT_CreateLibrarian):
-        return (
-            librarians
-            .insert()
-            .values(**model.model_dump())
-            .returning(librarians.c.id)
-        )
+    _stmt = (
+        librarians
+        .insert()
+        .returning(librarians.c.id)
+    )  # значения колонок передаются параметрами при выполнении
 
     async def __call__(self, model: INPUT_CreateLibrarian):
         async with self.engine.connect() as connection:
             try:
-                cursor: CursorResult = await connection.execute(self._stmt(model))
+                cursor: CursorResult = await connection.execute(self._stmt, model.model_dump())
                 await connection.commit()
                 return IDModel(id=cursor.scalar())
             except sqlalchemy.exc.IntegrityError as e:
@@ -15,6 +15,6 @@ class SERVICE_CreateLibrarian(BaseService):
         self._create_librarian_repository = create_librarian_repository
 
     async def __call__(self, model: INPUT_CreateLibrarian):
-        model.password = PasswordManager.hash(model.password)
+        model.password = await PasswordManager.hash(model.password)
         result = await self._create_librarian_repository(model)
         return result
@@ -0,0 +1,33 @@
+from fastapi import APIRouter, Depends
+from starlette import status
+
+from src.core.security import TokenManager
+from src.services.metrics.service import SERVICE_GetMetrics
+
+metrics_router = APIRouter(prefix="/metrics", tags=["Метрики"])
+
+
+@metrics_router.get(
+    "/",
+    status_code=status.HTTP_200_OK,
+    summary="Метрики процесса",
+    description="""
+    Функция возвращает счетчики и датчики текущего воркера
+    (например `cache.hits`, `cache.misses`, `cache.evictions`, `cache.size`,
+    `cache.stale_writes` - прочитанное из базы не записано в кэш, потому что ключ сбросили во время чтения).
+    Конкуренция в базе: `sql.contention.<ошибка>` - сколько раз запрос получил deadlock, ошибку сериализации,
+    не дождался блокировки или проиграл гонку параллельной транзакции (`StaleSnapshot`),
+    `sql.retries.<репозиторий>` - повторы по политике транзакций,
+    `sql.retries_exhausted.<репозиторий>` - повторы кончились, клиент получил 503.
+    Пул проверки паролей: `password_pool.workers` - потоков, `password_pool.busy` - занято,
+    `password_pool.queued` - ждут поток, `password_pool.rejected` - отказано (очередь полна, клиент получил 503).
+    Проверенные токены: `token_cache.hits`, `token_cache.misses`, `token_cache.evictions`, `token_cache.size`.
+    Счетчики считаются с момента запуска воркера.
+    """,
+    dependencies=[Depends(TokenManager.decode)],
+    response_model=dict[str, float]
+)
+async def get_metrics(
+        service: SERVICE_GetMetrics = Depends()
+):
+    return await service()
@@ -0,0 +1,7 @@
+from src.core.interfaces import BaseService
+from src.core.metrics import metrics
+
+
+class SERVICE_GetMetrics(BaseService):
+    async def __call__(self):
+        return metrics.snapshot()
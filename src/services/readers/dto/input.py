@@ -1,3 +1,5 @@
+import datetime
+
 from pydantic import BaseModel, Field, EmailStr
 
 
@@ -9,3 +11,8 @@ class INPUT_CreateReader(BaseModel):
 class INPUT_UpdateReader(BaseModel):
     name: str | None = Field(None, max_length=100, description="Имя читателя")
     email: EmailStr | None = Field(None, max_length=360, description="Email читателя")
+
+
+class INPUT_BorrowingPeriod(BaseModel):
+    borrowed_from: datetime.datetime | None = Field(None, description="Выданные начиная с этого момента")
+    borrowed_to: datetime.datetime | None = Field(None, description="Выданные до этого момента (не включительно)")
@@ -2,7 +2,7 @@ import datetime
 
 from pydantic import BaseModel, Field, EmailStr
 
-from src.core.types import ID
+from src.core.types import ID, RowError
 
 
 class BorrowingBook(BaseModel):
@@ -18,4 +18,29 @@ class OUTPUT_ReaderShortInfo(BaseModel):
 
 
 class OUTPUT_ReaderFullInfo(OUTPUT_ReaderShortInfo):
-    borrowings: list[BorrowingBook] = Field(description="Задолженности")
+    borrowings: list[BorrowingBook] = Field(description="Задолженности (книги на руках)")
+
+
+class OUTPUT_ReaderBorrowing(BaseModel):
+    id: ID = Field(..., description="Идентификатор выдачи")
+    book_id: ID = Field(..., description="Идентификатор книги")
+    title: str = Field(..., description="Название книги")
+    author: str = Field(..., description="Автор книги")
+    borrow_date: datetime.datetime = Field(..., description="Дата выдачи")
+    return_date: datetime.datetime | None = Field(None, description="Дата возврата, если книгу вернули")
+
+
+class OUTPUT_ImportedReader(BaseModel):
+    row: int = Field(..., description="Номер записи в загруженном файле")
+    id: ID = Field(..., description="Идентификатор созданного читателя")
+
+
+class OUTPUT_ImportDuplicate(BaseModel):
+    row: int = Field(..., description="Номер записи в загруженном файле")
+    email: str = Field(..., description="Email, который уже зарегистрирован или повторяется в файле")
+
+
+class OUTPUT_ReaderImportReport(BaseModel):
+    created: list[OUTPUT_ImportedReader] = Field([], description="Созданные читатели")
+    duplicates: list[OUTPUT_ImportDuplicate] = Field([], description="Пропущенные записи с занятым email")
+    invalid: list[RowError] = Field([], description="Пропущенные невалидные записи")
@@ -1,30 +1,34 @@
+import datetime
+from functools import lru_cache
+from typing import AsyncIterator
+
 import psycopg
 import sqlalchemy
-from sqlalchemy import CursorResult, select, exists, and_, func
+from sqlalchemy import CursorResult, select, func, bindparam, Integer, String, case, DateTime, tuple_, true, Select
+from sqlalchemy.dialects.postgresql import insert, ARRAY
 
 from src.core.exc import NoDataToUpdate
 from src.core.interfaces import BaseSQLRepository
-from src.core.schemas import readers, borrowed_books
+from src.core.schemas import readers, borrowed_books, books
 from src.core.types import IDModel, ID
 from src.services.books.dto.input import HasBorrowings
-from src.services.readers.dto.input import INPUT_CreateReader, INPUT_UpdateReader
-from src.services.readers.dto.output import OUTPUT_ReaderShortInfo
+from src.services.readers.dto.input import INPUT_CreateReader, INPUT_UpdateReader, INPUT_BorrowingPeriod
+from src.services.readers.dto.output import OUTPUT_ReaderShortInfo, OUTPUT_ReaderBorrowing, \
+    OUTPUT_ReaderImportReport, OUTPUT_ImportedReader, OUTPUT_ImportDuplicate
 from src.services.readers.exc import ReaderAlreadyExists, ReaderNotFound, ReaderHasDebts
 
 
 class DB_CreateReader(BaseSQLRepository):
-    def _stmt(self, model: INPUT_CreateReader):
-        return (
-            readers
-            .insert()
-            .values(**model.model_dump())
-            .returning(readers.c.id)
-        )
+    _stmt = (
+        readers
+        .insert()
+        .returning(readers.c.id)
+    )  # значения колонок передаются параметрами при выполнении
 
     async def __call__(self, model: INPUT_CreateReader):
         async with self.engine.connect() as connection:
             try:
-                cursor: CursorResult = await connection.execute(self._stmt(model))
+                cursor: CursorResult = await connection.execute(self._stmt, model.model_dump())
                 await connection.commit()
                 return IDModel(id=cursor.scalar())
             except sqlalchemy.exc.IntegrityError as e:
@@ -32,23 +36,99 @@ class DB_CreateReader(BaseSQLRepository):
                     raise ReaderAlreadyExists(model.email)
 
 
+def _bulk_create():
+    """ Регистрирует пачку читателей одним запросом, занятые email пропускаются.
+    Для каждой записи пачки возвращает ID созданного читателя или NULL, если email занят
+    (уже зарегистрирован или встречался в пачке раньше) """
+    batch = (
+        func.unnest(
+            bindparam("rows", type_=ARRAY(Integer)),
+            bindparam("names", type_=ARRAY(String)),
+            bindparam("emails", type_=ARRAY(String))
+        )
+        .table_valued("row", "name", "email")
+        .render_derived()
+    )
+    numbered = (
+        select(
+            batch.c.row,
+            batch.c.name,
+            batch.c.email,
+            func.row_number().over(partition_by=batch.c.email, order_by=batch.c.row).label("occurrence")
+        )
+        .cte("batch")
+    )
+    inserted = (
+        insert(readers)
+        .from_select(
+            ["name", "email"],
+            select(numbered.c.name, numbered.c.email).where(numbered.c.occurrence == 1).order_by(numbered.c.row)
+        )
+        .on_conflict_do_nothing(index_elements=[readers.c.email])
+        .returning(readers.c.id, readers.c.email)
+        .cte("inserted")
+    )
+    return (
+        select(numbered.c.row, numbered.c.email, inserted.c.id)
+        .outerjoin(inserted, (inserted.c.email == numbered.c.email) & (numbered.c.occurrence == 1))
+        .order_by(numbered.c.row)
+    )
+
+
+class DB_CreateReaders(BaseSQLRepository):
+    """ Массовая регистрация читателей (например, учеников в начале учебного года).
+    Записи пишутся пачками по `chunk` одним INSERT ... ON CONFLICT DO NOTHING, каждая пачка - своя транзакция:
+    блокировки держатся недолго, а сбой посреди файла не откатывает уже зарегистрированных """
+
+    chunk = 1000
+    _stmt = _bulk_create()
+
+    async def _write(self, connection, batch: list[tuple[int, INPUT_CreateReader]], report: OUTPUT_ReaderImportReport):
+        cursor: CursorResult = await connection.execute(
+            self._stmt,
+            {
+                "rows": [row for row, _ in batch],
+                "names": [model.name for _, model in batch],
+                "emails": [model.email for _, model in batch]
+            }
+        )
+        results = cursor.fetchall()
+        await connection.commit()
+        for result in results:
+            if result.id is None:
+                report.duplicates.append(OUTPUT_ImportDuplicate(row=result.row, email=result.email))
+            else:
+                report.created.append(OUTPUT_ImportedReader(row=result.row, id=result.id))
+
+    async def __call__(self, records: AsyncIterator[tuple[int, INPUT_CreateReader]]):
+        report = OUTPUT_ReaderImportReport()
+        batch: list[tuple[int, INPUT_CreateReader]] = []
+        async with self.engine.connect() as connection:
+            async for row, model in records:
+                batch.append((row, model))
+                if len(batch) == self.chunk:
+                    await self._write(connection, batch, report)
+                    batch = []
+            if batch:
+                await self._write(connection, batch, report)
+        return report
+
+
 class DB_UpdateReader(BaseSQLRepository):
-    def _stmt(self, reader_id: ID, model: INPUT_UpdateReader):
+    _stmt = (
+        readers
+        .update()
+        .where(readers.c.id == bindparam("reader_id"))
+        .returning(readers.c.id)
+    )  # SET строится из переданных параметров-колонок
+
+    async def __call__(self, reader_id: ID, model: INPUT_UpdateReader):
         data = model.model_dump(exclude_none=True)
         if len(data) == 0:
             raise NoDataToUpdate
-        return (
-            readers
-            .update()
-            .values(**data)
-            .where(readers.c.id == reader_id)
-            .returning(readers.c.id)
-        )
-
-    async def __call__(self, reader_id: ID, model: INPUT_UpdateReader):
         async with self.engine.connect() as connection:
             try:
-                cursor: CursorResult = await connection.execute(self._stmt(reader_id, model))
+                cursor: CursorResult = await connection.execute(self._stmt, {"reader_id": reader_id, **data})
                 if cursor.rowcount != 0:
                     raise ReaderNotFound(reader_id)
                 await connection.commit()
@@ -59,31 +139,31 @@ class DB_UpdateReader(BaseSQLRepository):
 
 
 class DB_GetReaderById(BaseSQLRepository):
-    def _stmt(self, reader_id: ID):
-        return (
-            select(
-                readers,
-                func.coalesce(
-                    select(
-                        func.json_agg(
-                            func.json_build_object(
-                                "id", borrowed_books.c.id,
-                                "book_id", borrowed_books.c.book_id,
-                                "borrow_date", borrowed_books.c.borrow_date
-                            )
+    _stmt = (
+        select(
+            readers,
+            func.coalesce(
+                select(
+                    func.json_agg(
+                        func.json_build_object(
+                            "id", borrowed_books.c.id,
+                            "book_id", borrowed_books.c.book_id,
+                            "borrow_date", borrowed_books.c.borrow_date
                         )
                     )
-                    .where(borrowed_books.c.reader_id == readers.c.id)
-                    .scalar_subquery(),
-                    func.json_build_array()
-                ).label("borrowings")
-            )
-            .where(readers.c.id == reader_id)
+                )
+                .where(borrowed_books.c.reader_id == readers.c.id)
+                .where(borrowed_books.c.return_date.is_(None))
+                .scalar_subquery(),
+                func.json_build_array()
+            ).label("borrowings")
         )
+        .where(readers.c.id == bindparam("reader_id"))
+    )  # только книги на руках (не больше лимита), история - DB_GetReaderBorrowings
 
     async def __call__(self, reader_id: ID):
         async with self.engine.connect() as connection:
-            cursor: CursorResult = await connection.execute(self._stmt(reader_id))
+            cursor: CursorResult = await connection.execute(self._stmt, {"reader_id": reader_id})
         result = cursor.mappings().fetchone()
         if result is None:
             raise ReaderNotFound(reader_id)
@@ -91,65 +171,236 @@ class DB_GetReaderById(BaseSQLRepository):
         # return OUTPUT_ReaderFullInfo(**result)
 
 
-class DB_GetReaderList(BaseSQLRepository):
-    def _stmt(self, borrowings: HasBorrowings | None, skip: int, limit: int):
-        stmt = (
+class DB_GetReaderBorrowings(BaseSQLRepository):
+    """ История выдач читателя, новые сначала. Страницы по (borrow_date, id)
+    по индексу borrowed_books_reader_borrow_date_id_idx, без сортировки всей истории читателя """
+
+    @staticmethod
+    @lru_cache
+    def _stmt(borrowed_from: bool, borrowed_to: bool, after: bool) -> Select:
+        """ Форма запроса зависит только от набора фильтров, каждая собирается один раз """
+        page = (
             select(
-                readers.c.id,
-                readers.c.name,
-                readers.c.email
+                borrowed_books.c.id,
+                borrowed_books.c.book_id,
+                books.c.title,
+                books.c.author,
+                borrowed_books.c.borrow_date,
+                borrowed_books.c.return_date
             )
+            .join(books, books.c.id == borrowed_books.c.book_id)
+            .where(borrowed_books.c.reader_id == readers.c.id)
+            .order_by(borrowed_books.c.borrow_date.desc(), borrowed_books.c.id.desc())
+            .limit(bindparam("limit", type_=Integer))
         )
-        match borrowings:
-            case HasBorrowings.only_with:
-                stmt = stmt.join(borrowed_books, borrowed_books.c.reader_id == readers.c.id)
-                stmt = stmt.where(borrowed_books.c.return_date.is_(None))
-            case HasBorrowings.only_without:
-                stmt = stmt.where(
-                    ~exists().where(
-                        and_(
-                            borrowed_books.c.reader_id == readers.c.id,
-                            borrowed_books.c.return_date.is_(None)
-                        )
-                    )
-                )
-        stmt = (
-            stmt
-            .offset(skip)
-            .limit(limit)
+        if borrowed_from:
+            page = page.where(borrowed_books.c.borrow_date >= bindparam("borrowed_from", type_=DateTime))
+        if borrowed_to:
+            page = page.where(borrowed_books.c.borrow_date < bindparam("borrowed_to", type_=DateTime))
+        if after:
+            page = page.where(
+                tuple_(borrowed_books.c.borrow_date, borrowed_books.c.id)
+                < tuple_(bindparam("after_date", type_=DateTime), bindparam("after_id", type_=Integer))
+            )  # keyset: продолжаем сразу после последней (borrow_date, id)
+        page = page.lateral("page")
+        return (
+            select(readers.c.id.label("reader_id"), *page.c)
+            .select_from(readers.outerjoin(page, true()))
+            .where(readers.c.id == bindparam("reader_id", type_=Integer))
+            .order_by(page.c.borrow_date.desc(), page.c.id.desc())
+        )  # строка читателя есть всегда: пустая страница отличается от несуществующего читателя
+
+    async def __call__(
+            self,
+            reader_id: ID,
+            limit: int,
+            period: INPUT_BorrowingPeriod,
+            after: tuple[datetime.datetime, ID] | None = None
+    ):
+        stmt = self._stmt(period.borrowed_from is not None, period.borrowed_to is not None, after is not None)
+        parameters = {
+            "reader_id": reader_id,
+            "limit": limit,
+            "borrowed_from": period.borrowed_from,
+            "borrowed_to": period.borrowed_to
+        }
+        if after is not None:
+            parameters["after_date"], parameters["after_id"] = after
+        async with self.engine.connect() as connection:
+            cursor: CursorResult = await connection.execute(stmt, parameters)
+            result = cursor.mappings().fetchall()
+        if len(result) == 0:
+            raise ReaderNotFound(reader_id)
+        return [OUTPUT_ReaderBorrowing(**row) for row in result if row["id"] is not None]
+
+
+def _reader_list(borrowings: HasBorrowings | None, after: bool) -> Select:
+    """ Читатели по (name, id) по индексу readers_name_id_idx. Фильтр по книгам на руках - полусоединение
+    EXISTS / NOT EXISTS по borrowed_books_open_reader_book_idx: читатель с несколькими книгами не повторяется """
+    stmt = (
+        select(
+            readers.c.id,
+            readers.c.name,
+            readers.c.email
         )
-        return stmt
+        .order_by(readers.c.name, readers.c.id)
+        .limit(bindparam("limit", type_=Integer))
+    )
+    has_open_loans = (
+        select(borrowed_books.c.id)
+        .where(borrowed_books.c.reader_id == readers.c.id)
+        .where(borrowed_books.c.return_date.is_(None))
+        .exists()
+    )
+    match borrowings:
+        case HasBorrowings.only_with:
+            stmt = stmt.where(has_open_loans)
+        case HasBorrowings.only_without:
+            stmt = stmt.where(~has_open_loans)
+    if not after:
+        return stmt.offset(bindparam("skip", type_=Integer))
+    return stmt.where(
+        tuple_(readers.c.name, readers.c.id)
+        > tuple_(bindparam("after_name", type_=String), bindparam("after_id", type_=Integer))
+    )  # keyset: продолжаем сразу после последней (name, id)
 
-    async def __call__(self, borrowings: HasBorrowings | None, skip: int, limit: int):
+
+class DB_GetReaderList(BaseSQLRepository):
+    _stmts = {
+        (borrowings, after): _reader_list(borrowings, after)
+        for borrowings in (None, *HasBorrowings)
+        for after in (False, True)
+    }  # по одной форме запроса на значение фильтра и вид пагинации
+
+    async def __call__(
+            self,
+            borrowings: HasBorrowings | None,
+            skip: int,
+            limit: int,
+            after: tuple[str, ID] | None = None
+    ):
+        parameters = {"limit": limit}
+        if after is None:
+            parameters["skip"] = skip
+        else:
+            parameters["after_name"], parameters["after_id"] = after
         async with self.engine.connect() as connection:
-            cursor: CursorResult = await connection.execute(self._stmt(borrowings, skip, limit))
+            cursor: CursorResult = await connection.execute(self._stmts[borrowings, after is not None], parameters)
         result = cursor.mappings().fetchall()
         result = [OUTPUT_ReaderShortInfo(**reader) for reader in result]
         return result
 
 
-class DB_DeleteReader(BaseSQLRepository):
-    def _status(self, reader_id: ID):
-        return (
-            select(borrowed_books.c.id)
-            .where(borrowed_books.c.reader_id == reader_id)
-            .where(borrowed_books.c.return_date.is_(None))
-        )
+def _like_escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
 
-    def _stmt(self, reader_id: ID):
-        return (
-            readers
-            .delete()
-            .where(readers.c.id == reader_id)
+
+reader_email_key = func.lower(readers.c.email).collate("C")
+reader_name_key = func.lower(readers.c.name).collate("C")
+reader_name_tail_key = func.lower(
+    func.substr(readers.c.name, func.strpos(readers.c.name, " ") + 1)
+).collate("C")  # имя без первого слова: его начало - начало второго слова (фамилии или имени)
+
+
+def _reader_search(condition, key=None) -> Select:
+    """ Одна ступень подсказок: совпадения в порядке индекса по (key, id), первые limit без сортировки всех """
+    return (
+        select(readers.c.id, readers.c.name, readers.c.email)
+        .where(condition)
+        .order_by(*([] if key is None else [key]), readers.c.id)
+        .limit(bindparam("limit", type_=Integer))
+    )
+
+
+class DB_SearchReaders(BaseSQLRepository):
+    """ Поиск читателей для подсказок при вводе. Совпадения идут ступенями:
+    начало email, начало имени, начало второго слова имени - диапазоны btree-индексов (lower(...) COLLATE "C", id)
+    в их порядке, и только если их не хватило на limit - часть имени от 3 символов (меньше триграммы не бывает)
+    в порядке id. Порядок полный, поэтому выдача - настоящие первые limit и не меняется от запроса к запросу.
+    Ступени выполняются по очереди и останавливаются, как только набран limit.
+    Порядок id у части имени выбран ради плана: частую подстроку первичный ключ находит за несколько десятков строк
+    (имена не связаны с порядком регистрации), редкую - триграммный readers_name_trgm_idx с сортировкой немногих.
+    В алфавитном порядке частая подстрока, чьи совпадения собраны в одном месте алфавита, читала бы весь индекс.
+    Миллисекунды гарантированы только началам: при завышенной оценке частоты подстроки первичный ключ
+    читает сотни тысяч строк (benchmarks/bench_reader_search.py) """
+
+    _stmts = (
+        _reader_search(reader_email_key.like(bindparam("prefix", type_=String)), reader_email_key),
+        _reader_search(reader_name_key.like(bindparam("prefix", type_=String)), reader_name_key),
+        _reader_search(reader_name_tail_key.like(bindparam("prefix", type_=String)), reader_name_tail_key),
+        _reader_search(readers.c.name.ilike(bindparam("substring", type_=String)))
+    )
+
+    async def __call__(self, query: str, limit: int):
+        escaped = _like_escape(query)
+        parameters = {"prefix": escaped.lower() + "%", "substring": "%" + escaped + "%"}
+        stmts = self._stmts if len(query) >= 3 else self._stmts[:-1]
+        found: dict[ID, OUTPUT_ReaderShortInfo] = {}
+        async with self.engine.connect() as connection:
+            for stmt in stmts:
+                # читатель мог совпасть и на прошлой ступени: такие повторы не должны занимать место в limit
+                parameters["limit"] = limit + len(found)
+                cursor: CursorResult = await connection.execute(stmt, parameters)
+                for reader in cursor.mappings().fetchall():
+                    found.setdefault(reader["id"], OUTPUT_ReaderShortInfo(**reader))
+                if len(found) >= limit:
+                    break
+        return list(found.values())[:limit]
+
+
+def _delete_reader():
+    """ Удаляет читателя вместе с историей выдач, только если у него нет книг на руках.
+    Результат - одно из: deleted, has_debts, not_found.
+    Выдача, закоммиченная параллельно, ловится внешним ключом (ON DELETE NO ACTION) """
+    reader_id = bindparam("reader_id", type_=Integer)
+    no_open_loans = ~(
+        select(borrowed_books.c.id)
+        .where(borrowed_books.c.reader_id == reader_id)
+        .where(borrowed_books.c.return_date.is_(None))
+        .exists()
+    )
+    history = (
+        borrowed_books
+        .delete()
+        .where(borrowed_books.c.reader_id == reader_id)
+        .where(no_open_loans)
+        .returning(borrowed_books.c.id)
+        .cte("history")
+    )
+    deleted = (
+        readers
+        .delete()
+        .where(readers.c.id == reader_id)
+        .where(no_open_loans)
+        .returning(readers.c.id)
+        .cte("deleted")
+    )
+    return (
+        select(
+            case(
+                (select(deleted.c.id).exists(), "deleted"),
+                (select(readers.c.id).where(readers.c.id == reader_id).exists(), "has_debts"),
+                else_="not_found"
+            ).label("status")
         )
+        .add_cte(history)
+    )
+
+
+class DB_DeleteReader(BaseSQLRepository):
+    _stmt = _delete_reader()
 
     async def __call__(self, reader_id: ID):
         async with self.engine.connect() as connection:
-            cursor: CursorResult = await connection.execute(self._status(reader_id))
-            borrowed = cursor.mappings().fetchall()
-            if len(borrowed) != 0:
-                raise ReaderHasDebts(reader_id)
-            cursor = await connection.execute(self._stmt(reader_id))
-            if cursor.rowcount != 1:
-                raise ReaderNotFound(reader_id)
+            try:
+                cursor: CursorResult = await connection.execute(self._stmt, {"reader_id": reader_id})
+            except sqlalchemy.exc.IntegrityError as e:
+                if isinstance(e.orig, psycopg.errors.ForeignKeyViolation):  # книгу выдали, пока шло удаление
+                    raise ReaderHasDebts(reader_id)
+                raise
+            match cursor.scalar():
+                case "has_debts":
+                    raise ReaderHasDebts(reader_id)
+                case "not_found":
+                    raise ReaderNotFound(reader_id)
             await connection.commit()
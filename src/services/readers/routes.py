@@ -1,13 +1,17 @@
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Query, Request
 from starlette import status
+from starlette.responses import Response
 
+from src.core.pagination import paginate
 from src.core.security import TokenManager
+from src.core.streaming import CSV_MEDIA_TYPE, NDJSON_MEDIA_TYPE, JSON_MEDIA_TYPE
 from src.core.types import ID, IDModel
 from src.services.books.dto.input import HasBorrowings
-from src.services.readers.dto.input import INPUT_CreateReader, INPUT_UpdateReader
-from src.services.readers.dto.output import OUTPUT_ReaderShortInfo
+from src.services.readers.dto.input import INPUT_CreateReader, INPUT_UpdateReader, INPUT_BorrowingPeriod
+from src.services.readers.dto.output import OUTPUT_ReaderShortInfo, OUTPUT_ReaderBorrowing, OUTPUT_ReaderImportReport
 from src.services.readers.service import SERVICE_CreateReader, SERVICE_GetReaderList, SERVICE_UpdateReader, \
-    SERVICE_GetReaderById, SERVICE_DeleteReader
+    SERVICE_GetReaderById, SERVICE_DeleteReader, SERVICE_GetReaderBorrowings, SERVICE_SearchReaders, \
+    SERVICE_ImportReaders
 
 readers_router = APIRouter(prefix="/readers", tags=["Управление читателями"])
 
@@ -31,6 +35,43 @@ async def create_reader(
     return await service(client_id, model)
 
 
+@readers_router.post(
+    "/import",
+    status_code=status.HTTP_201_CREATED,
+    summary="Массовая регистрация читателей",
+    description=f"""
+    Функция регистрирует читателей потоком из тела запроса (например, учеников в начале учебного года).
+    Поддерживаются форматы CSV (`{CSV_MEDIA_TYPE}`, первая строка - заголовок с именами полей),
+    NDJSON (`{NDJSON_MEDIA_TYPE}`, один JSON объект на строку) и JSON массив объектов (`{JSON_MEDIA_TYPE}`).
+    Поля те же, что и при добавлении одного читателя.
+    Записи сохраняются пачками, каждая пачка - отдельная транзакция.
+    Записи с email, который уже зарегистрирован или повторяется в файле, не прерывают загрузку,
+    а попадают в отчет (`duplicates`), невалидные записи - в `invalid`.
+    Для созданных читателей в `created` возвращаются номер записи и ID.
+    Номера записей считаются с 1 без учета заголовка, ошибка в самом заголовке CSV приходит с номером 0.
+    Записи не в UTF-8 попадают в `invalid`, BOM в начале файла допускается.
+    Неподдерживаемый формат вернет ошибку 415.
+    """,
+    response_model=OUTPUT_ReaderImportReport,
+    openapi_extra={
+        "requestBody": {
+            "required": True,
+            "content": {
+                CSV_MEDIA_TYPE: {"schema": {"type": "string"}},
+                NDJSON_MEDIA_TYPE: {"schema": {"type": "string"}},
+                JSON_MEDIA_TYPE: {"schema": {"type": "array", "items": {"type": "object"}}},
+            }
+        }
+    }
+)
+async def import_readers(
+        request: Request,
+        service: SERVICE_ImportReaders = Depends(),
+        client_id: ID = Depends(TokenManager.decode)
+):
+    return await service(client_id, request.stream(), request.headers.get("content-type", ""))
+
+
 @readers_router.get(
     "/",
     status_code=status.HTTP_200_OK,
@@ -41,17 +82,50 @@ async def create_reader(
         с опцией `only with borrowings` вернет только тех читателей, у кого есть книги на руках,
         с опцией `only without borrowings` вернет только тех читателей, у кого нет книг на руках,
         с выключенной опцией вернет всех читателей.
+    Читатели упорядочены по имени (при равных именах - по ID).
+    Есть функционал SKIP/LIMIT для пагинации (оставлен для старых клиентов).
+    Для больших списков используйте курсор: если страница заполнена целиком,
+    в заголовке `X-Next-Cursor` придет курсор следующей страницы, его нужно передать в параметр `after`
+    (при переданном `after` параметр `skip` игнорируется).
+    Невалидный курсор вернет ошибку 400.
     """,
     dependencies=[Depends(TokenManager.decode)],
     response_model=list[OUTPUT_ReaderShortInfo]
 )
 async def get_reader_list(
+        response: Response,
         borrowings: HasBorrowings | None = None,
         skip: int = 0,
         limit: int = 50,
+        after: str | None = None,
         service: SERVICE_GetReaderList = Depends()
 ):
-    return await service(borrowings, skip, limit)
+    result = await service(borrowings, skip, limit, after)
+    return paginate(response, result, limit, lambda reader: (reader.name, reader.id))
+
+
+@readers_router.get(
+    "/search",
+    status_code=status.HTTP_200_OK,
+    summary="Поиск читателей",
+    description="""
+    Функция ищет читателей для подсказок при вводе, без учета регистра.
+    Возвращает не больше `limit` первых совпадений в порядке: начало email, начало имени,
+    начало второго слова имени (внутри каждой группы - по алфавиту и ID), затем часть имени от 3 символов
+    (по ID, раньше записавшиеся выше). Часть имени ищется, только если начал не хватило, и отвечает медленнее:
+    для подсказок рассчитаны начала.
+    Порядок полный: один и тот же запрос на тех же данных дает тот же ответ.
+    Курсора нет, для уточнения нужно продолжить ввод.
+    """,
+    dependencies=[Depends(TokenManager.decode)],
+    response_model=list[OUTPUT_ReaderShortInfo]
+)
+async def search_readers(
+        q: str = Query(..., min_length=1, max_length=100),
+        limit: int = Query(10, ge=1, le=50),
+        service: SERVICE_SearchReaders = Depends()
+):
+    return await service(q, limit)
 
 
 @readers_router.put(
@@ -82,7 +156,8 @@ async def update_reader(
     status_code=status.HTTP_200_OK,
     summary="Получить данные читателя",
     description="""
-    Функция возвращает данные читателя с задолженностями.
+    Функция возвращает данные читателя с задолженностями (только книги на руках).
+    Вся история выдач - `GET /readers/{reader_id}/borrowings`.
     Если читатель не найден вернет ошибку 404.
     """,
     dependencies=[Depends(TokenManager.decode)],
@@ -94,6 +169,33 @@ async def get_reader_by_id(
     return await service(reader_id)
 
 
+@readers_router.get(
+    "/{reader_id}/borrowings",
+    status_code=status.HTTP_200_OK,
+    summary="История выдач читателя",
+    description="""
+    Функция возвращает историю выдач читателя (и возвращенные книги, и книги на руках), новые сначала.
+    Период выдачи `borrowed_from` - `borrowed_to` (конец не включается) необязателен.
+    Если страница заполнена целиком, в заголовке `X-Next-Cursor` придет курсор следующей страницы,
+    его нужно передать в параметр `after`.
+    Невалидный курсор вернет ошибку 400.
+    Если читатель не найден вернет ошибку 404.
+    """,
+    dependencies=[Depends(TokenManager.decode)],
+    response_model=list[OUTPUT_ReaderBorrowing]
+)
+async def get_reader_borrowings(
+        reader_id: ID,
+        response: Response,
+        limit: int = 50,
+        after: str | None = None,
+        period: INPUT_BorrowingPeriod = Depends(),
+        service: SERVICE_GetReaderBorrowings = Depends()
+):
+    result = await service(reader_id, limit, period, after)
+    return paginate(response, result, limit, lambda borrowing: (borrowing.borrow_date, borrowing.id))
+
+
 @readers_router.delete(
     "/{reader_id}",
     status_code=status.HTTP_204_NO_CONTENT,
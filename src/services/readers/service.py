@@ -1,13 +1,21 @@
+import datetime
+from typing import AsyncIterator
+
 from fastapi import Depends
 from loguru import logger
 
 from src.core.interfaces import BaseService
-from src.core.types import ID
-from src.services.readers.dto.input import INPUT_CreateReader, INPUT_UpdateReader
+from src.core.pagination import Cursor
+from src.core.streaming import read_records
+from src.core.types import ID, RowError
+from src.services.readers.dto.input import INPUT_CreateReader, INPUT_UpdateReader, INPUT_BorrowingPeriod
 from src.services.readers.repository import (
     DB_CreateReader,
+    DB_CreateReaders,
     DB_GetReaderById,
+    DB_GetReaderBorrowings,
     DB_GetReaderList,
+    DB_SearchReaders,
     DB_UpdateReader,
     DB_DeleteReader
 )
@@ -27,6 +35,26 @@ class SERVICE_CreateReader(BaseService):
         return result
 
 
+class SERVICE_ImportReaders(BaseService):
+    def __init__(
+            self,
+            repository: DB_CreateReaders = Depends()
+    ):
+        super().__init__()
+        self._repository = repository
+
+    async def __call__(self, client_id: ID, stream: AsyncIterator[bytes], content_type: str):
+        invalid: list[RowError] = []
+        records = read_records(stream, content_type, INPUT_CreateReader, invalid)
+        result = await self._repository(records)
+        result.invalid = invalid
+        logger.info(
+            f"Библиотекарь с ID {client_id} зарегистрировал {len(result.created)} читателей "
+            f"(занятых email: {len(result.duplicates)}, невалидных записей: {len(invalid)})"
+        )
+        return result
+
+
 class SERVICE_UpdateReader(BaseService):
     def __init__(
             self,
@@ -53,6 +81,19 @@ class SERVICE_GetReaderById(BaseService):
         return await self._repository(reader_id)
 
 
+class SERVICE_GetReaderBorrowings(BaseService):
+    def __init__(
+            self,
+            repository: DB_GetReaderBorrowings = Depends()
+    ):
+        super().__init__()
+        self._repository = repository
+
+    async def __call__(self, reader_id: ID, limit: int, period: INPUT_BorrowingPeriod, after: str | None = None):
+        key = Cursor.decode(after, tuple[datetime.datetime, ID]) if after else None
+        return await self._repository(reader_id, limit, period, key)
+
+
 class SERVICE_GetReaderList(BaseService):
     def __init__(
             self,
@@ -61,8 +102,21 @@ class SERVICE_GetReaderList(BaseService):
         super().__init__()
         self._repository = repository
 
-    async def __call__(self, borrowings, skip: int, limit: int):
-        return await self._repository(borrowings, skip, limit)
+    async def __call__(self, borrowings, skip: int, limit: int, after: str | None = None):
+        key = Cursor.decode(after, tuple[str, ID]) if after else None
+        return await self._repository(borrowings, skip, limit, key)
+
+
+class SERVICE_SearchReaders(BaseService):
+    def __init__(
+            self,
+            repository: DB_SearchReaders = Depends()
+    ):
+        super().__init__()
+        self._repository = repository
+
+    async def __call__(self, query: str, limit: int):
+        return await self._repository(query, limit)
 
 
 class SERVICE_DeleteReader(BaseService):
@@ -1,4 +1,4 @@
-from sqlalchemy import CursorResult, select
+from sqlalchemy import CursorResult, select, bindparam
 
 from src.core.interfaces import BaseSQLRepository
 from src.core.schemas import librarians
@@ -6,10 +6,11 @@ from src.services.security.exc import InvalidLoginOrPassword
 
 
 class SQL_DB_GetUserByLogin(BaseSQLRepository):
+    _stmt = select(librarians.c.id, librarians.c.password).where(librarians.c.login == bindparam("login"))
+
     async def __call__(self, login: str):
-        stmt = select(librarians.c.id, librarians.c.password).where(librarians.c.login == login)
         async with self.engine.connect() as connection:
-            cursor: CursorResult = await connection.execute(stmt)
+            cursor: CursorResult = await connection.execute(self._stmt, {"login": login})
         result = cursor.mappings().fetchone()
         if not result:
             raise InvalidLoginOrPassword
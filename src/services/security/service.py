@@ -16,7 +16,7 @@ class SERVICE_Auth(BaseService):
     async def __call__(self, model: INPUT_AuthData):
         result = await self.repository.__call__(model.login)
         if result is not None:
-            if not PasswordManager.verify(model.password, result["password"]):
+            if not await PasswordManager.verify(model.password, result["password"]):
                 raise InvalidLoginOrPassword
             access_token = TokenManager.create({"id": str(result["id"])}, TokenTypes.ACCESS)
             refresh_token = TokenManager.create({"id": str(result["id"])}, TokenTypes.REFRESH)
@@ -1,16 +1,41 @@
+import asyncio
+import datetime
+import json
+import threading
+import time
 from asyncio import gather
 
+import jwt
 import pytest
+from fastapi import HTTPException
 from httpx import ASGITransport, AsyncClient, Response
+from sqlalchemy import select, func
 
 from src.app import app
+from src.core.exc import ExpiredSignatureError
+from src.core.infrastructures import database, cache
+from src.core.metrics import metrics
+from src.core.schemas import books, book_stock, borrowed_books
+from src.core.streaming import INVALID_ENCODING
+from src.core.security import BlockingPool, TokenManager, TokenTypes
+from src.core.transactions import TransactionPolicy
 from src.core.types import IDModel
-from src.services.books.dto.input import INPUT_CreateBook
+from src.maintenance.exc import PartitionHasOpenLoans
+from src.maintenance.open_loans import check_open_loans, find_duplicate_loans, Duplicate
+from src.maintenance.partitions import list_partitions, create_partitions, archive_partitions, OpenLoans, \
+    ARCHIVE_SCHEMA
+from src.services.books.dto.input import INPUT_CreateBook, HasBorrowings
+from src.services.books.repository import DB_DeleteBook, DB_GetBookById
+from src.services.books.service import SERVICE_GetBookById
 from src.services.borrowed_books.dto.input import INPUT_CreateBorrowedBook
-from src.services.borrowed_books.exc import BorrowedLimitExceeded, ThereAreBorrowings, AllBooksBorrowed
+from src.services.borrowed_books.exc import BorrowedLimitExceeded, ThereAreBorrowings, AllBooksBorrowed, \
+    ReaderAlreadyHasBook
+from src.services.borrowed_books.repository import DB_GiveOutBook, DB_ReturnBook, DB_GetBorrowList
 from src.services.librarians.dto.input import INPUT_CreateLibrarian
 from src.services.librarians.exc import LibrarianAlreadyExists
 from src.services.readers.dto.input import INPUT_CreateReader
+from src.services.readers.repository import DB_GetReaderList, DB_DeleteReader, DB_GetReaderBorrowings, \
+    DB_SearchReaders, DB_CreateReaders
 
 
 @pytest.fixture(scope="module", autouse=True)
@@ -209,3 +234,1187 @@ async def test_give_out_the_missing_book(get_token, get_client):
     )
     assert response.status_code == 400
     assert response.json() == {"detail": AllBooksBorrowed(book_id).detail}
+
+
+@pytest.mark.asyncio
+async def test_book_list_cursor_pagination(get_client):
+    """Курсорная пагинация отдает те же книги, что и SKIP/LIMIT, без повторов"""
+    full = (await get_client.get("/books/", params={"limit": 100})).json()
+    pages, after = [], None
+    while True:
+        params = {"limit": 2} if after is None else {"limit": 2, "after": after}
+        response = await get_client.get("/books/", params=params)
+        pages.extend(response.json())
+        after = response.headers.get("X-Next-Cursor")
+        if after is None:
+            break
+    assert pages == full
+    response = await get_client.get("/books/", params={"after": "not a cursor"})
+    assert response.status_code == 400
+
+
+@pytest.mark.asyncio
+async def test_search_books_with_typo(get_client):
+    """Поиск находит книгу по автору с опечаткой и по слову из описания"""
+    response = await get_client.get("/books/search", params={"q": "Шумахр"})
+    assert response.status_code == 200
+    assert [book["title"] for book in response.json()] == ["Мастер и маргарин"]
+    response = await get_client.get("/books/search", params={"q": "фломастер"})
+    assert [book["title"] for book in response.json()] == ["Мастер и маргарин"]
+
+
+@pytest.mark.asyncio
+async def test_import_books(get_token, get_client):
+    """Импорт CSV: дубликаты ISBN и невалидные записи попадают в отчет, остальное загружается"""
+    body = (
+        "title,author,year,isbn,quantity,description\n"
+        "Imported one,Some Author,2001,978-0001,2,\n"
+        '"Imported, two",Some Author,,978-0002,1,"multi\nline"\n'
+        "Imported dup,Some Author,2003,978-0001,1,\n"
+        ",No Title,2004,,1,\n"
+    )
+    response = await get_client.post(
+        "/books/import",
+        headers={"Authorization": f"bearer {get_token}", "Content-Type": "text/csv"},
+        content=body
+    )
+    assert response.status_code == 201
+    report = response.json()
+    assert report["created"] == 2
+    assert report["conflicts"] == [{"row": 3, "isbn": "978-0001"}]
+    assert [error["row"] for error in report["invalid"]] == [4]
+    response = await get_client.post(
+        "/books/import",
+        headers={"Authorization": f"bearer {get_token}", "Content-Type": "application/x-ndjson"},
+        content='{"title": "Imported three", "author": "Some Author", "isbn": "978-0002"}\n{broken\n'
+    )
+    report = response.json()
+    assert report["created"] == 0
+    assert report["conflicts"] == [{"row": 1, "isbn": "978-0002"}]
+    assert [error["row"] for error in report["invalid"]] == [2]
+
+
+@pytest.mark.asyncio
+async def test_book_cache_invalidated_by_loan(get_token, get_client):
+    """Повторное чтение книги идет из кэша, выдача книги сбрасывает кэш"""
+    headers = {"Authorization": f"bearer {get_token}"}
+    before = (await get_client.get("/metrics/", headers=headers)).json()
+    assert (await get_client.get("/books/4")).json()["quantity"] == 1
+    assert (await get_client.get("/books/4")).json()["quantity"] == 1
+    after = (await get_client.get("/metrics/", headers=headers)).json()
+    assert after["cache.hits"] - before.get("cache.hits", 0) == 1
+    response = await get_client.post(
+        "/borrowed_books/",
+        headers=headers,
+        json=INPUT_CreateBorrowedBook(reader_id=2, book_id=4).model_dump()
+    )
+    assert response.status_code == 201
+    assert (await get_client.get("/books/4")).json()["quantity"] == 0
+
+
+@pytest.mark.asyncio
+async def test_conditional_get_books(get_client):
+    """Неизменившиеся книга и страница каталога отдаются как 304 без тела"""
+    response = await get_client.get("/books/4")
+    response = await get_client.get("/books/4", headers={"If-None-Match": response.headers["ETag"]})
+    assert response.status_code == 304
+    assert response.content == b""
+    response = await get_client.get(
+        "/books/4",
+        headers={"If-Modified-Since": response.headers["Last-Modified"]}
+    )
+    assert response.status_code == 304
+    unknown_zone = response.headers["Last-Modified"].replace("GMT", "-0000")  # наивное время у parsedate
+    response = await get_client.get("/books/4", headers={"If-Modified-Since": unknown_zone})
+    assert response.status_code == 304
+    response = await get_client.get("/books/4", headers={"If-Modified-Since": "Sat, 01 Jan 2000 00:00:00 -0000"})
+    assert response.status_code == 200
+    response = await get_client.get("/books/", params={"limit": 2})
+    assert response.status_code == 200
+    response = await get_client.get(
+        "/books/",
+        params={"limit": 2},
+        headers={"If-None-Match": response.headers["ETag"]}
+    )
+    assert response.status_code == 304
+    assert "X-Next-Cursor" in response.headers
+
+
+@pytest.mark.asyncio
+async def test_export_catalog_and_borrowings(get_token, get_client):
+    """Выгрузка отдает каждую запись ровно один раз, `changed_since` отсекает старые"""
+    headers = {"Authorization": f"bearer {get_token}"}
+    response = await get_client.get("/books/export", headers=headers)
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    exported = [json.loads(line) for line in response.text.splitlines()]
+    catalog = (await get_client.get("/books/", params={"limit": 1000})).json()
+    assert sorted(book["id"] for book in exported) == sorted(book["id"] for book in catalog)
+    response = await get_client.get(
+        "/books/export",
+        headers=headers,
+        params={"format": "csv", "changed_since": response.headers["X-Export-Watermark"]}
+    )
+    assert response.text.splitlines() == ["id,title,description,author,year,isbn,quantity,updated_at"]
+    response = await get_client.get("/borrowed_books/export", headers=headers)
+    assert len(response.text.splitlines()) == 4
+
+
+@pytest.mark.asyncio
+async def test_export_watermark_keeps_changes_committed_after_export(get_token, get_client):
+    """Изменение из транзакции, начатой до выгрузки и закоммиченной после, попадает в следующую выгрузку"""
+    headers = {"Authorization": f"bearer {get_token}"}
+    book_id = (await get_client.get("/books/", params={"limit": 1})).json()[0]["id"]
+    async with database().connect() as connection:
+        await connection.execute(books.update().where(books.c.id == book_id).values(year=1868))
+        response = await get_client.get("/books/export", headers=headers)
+        assert 1868 not in [json.loads(line)["year"] for line in response.text.splitlines()]
+        await connection.commit()
+    response = await get_client.get(
+        "/books/export",
+        headers=headers,
+        params={"changed_since": response.headers["X-Export-Watermark"]}
+    )
+    assert [(book["id"], book["year"]) for book in map(json.loads, response.text.splitlines())] == [(book_id, 1868)]
+
+
+@pytest.mark.asyncio
+async def test_book_facets_follow_loans(get_token, get_client):
+    """Счетчики фасетов совпадают с каталогом и меняются при выдаче последнего экземпляра"""
+    catalog = (await get_client.get("/books/", params={"limit": 1000})).json()
+    facets = (await get_client.get("/books/facets")).json()
+    assert facets["total"] == len(catalog)
+    assert facets["available"] == sum(book["is_available"] for book in catalog)
+    quantities = [(await get_client.get(f"/books/{book['id']}")).json()["quantity"] for book in catalog]
+    book_id = next(book["id"] for book, quantity in zip(catalog, quantities) if quantity == 1)
+    response = await get_client.post(
+        "/borrowed_books/",
+        headers={"Authorization": f"bearer {get_token}"},
+        json=INPUT_CreateBorrowedBook(reader_id=2, book_id=book_id).model_dump()
+    )
+    assert response.status_code == 201
+    after = (await get_client.get("/books/facets")).json()
+    assert after["available"] == facets["available"] - 1
+
+
+@pytest.mark.asyncio
+async def test_get_books_batch(get_client):
+    """Пакетный запрос возвращает книги в порядке запроса и перечисляет отсутствующие"""
+    response = await get_client.post("/books/batch", json={"ids": [3, 100500, 1, 3]})
+    assert response.status_code == 200
+    result = response.json()
+    assert [book["id"] for book in result["books"]] == [3, 1]
+    assert result["missing"] == [100500]
+
+
+@pytest.mark.asyncio
+async def test_repeated_queries_reuse_compiled_statements(get_token, get_client):
+    """Повторные запросы с другими параметрами не компилируют SQL заново"""
+    headers = {"Authorization": f"bearer {get_token}"}
+    await get_client.get("/books/", params={"limit": 2})
+    before = (await get_client.get("/metrics/", headers=headers)).json()
+    for skip in range(3):
+        assert (await get_client.get("/books/", params={"skip": skip, "limit": 2})).status_code == 200
+    after = (await get_client.get("/metrics/", headers=headers)).json()
+    assert after["sql.compiled_cache.hits"] - before["sql.compiled_cache.hits"] >= 3
+    assert after["sql.compiled_cache.misses"] == before["sql.compiled_cache.misses"]
+
+
+@pytest.mark.asyncio
+async def test_delete_races_with_loan(get_token, get_client):
+    """Удаление книги или читателя, параллельное выдаче: успешна ровно одна из операций"""
+    headers = {"Authorization": f"bearer {get_token}"}
+    for attempt in range(10):
+        reader = await get_client.post(
+            "/readers/",
+            headers=headers,
+            json=INPUT_CreateReader(name="race reader", email=f"race{attempt}@library.org").model_dump()
+        )
+        book = await get_client.post(
+            "/books/",
+            headers=headers,
+            json=INPUT_CreateBook(title=f"Race {attempt}", author="Race", quantity=1).model_dump()
+        )
+        reader_id, book_id = reader.json()["id"], book.json()["id"]
+        loan = INPUT_CreateBorrowedBook(reader_id=reader_id, book_id=book_id).model_dump()
+        target = f"/books/{book_id}" if attempt % 2 else f"/readers/{reader_id}"
+        deleted, given = await gather(
+            get_client.delete(target, headers=headers),
+            get_client.post("/borrowed_books/", headers=headers, json=loan)
+        )
+        # выдача, опоздавшая к удаленной книге, получает 404 или 400 (экземпляров нет)
+        assert (deleted.status_code, given.status_code) in ((204, 404), (204, 400), (400, 201))
+        if given.status_code == 201:
+            response = await get_client.patch("/borrowed_books/", headers=headers, json=loan)
+            assert response.status_code == 204
+            response = await get_client.delete(target, headers=headers)
+            assert response.status_code == 204  # история выдач удаляется вместе с записью
+            assert (await get_client.delete(target, headers=headers)).status_code == 404
+
+
+@pytest.mark.asyncio
+async def test_concurrent_checkouts_of_hot_title(get_token, get_client):
+    """Параллельные выдачи последних экземпляров: выдано ровно столько, сколько было, количество не уходит в минус"""
+    headers = {"Authorization": f"bearer {get_token}"}
+    book = await get_client.post(
+        "/books/",
+        headers=headers,
+        json=INPUT_CreateBook(title="Hot title", author="Hot", quantity=2).model_dump()
+    )
+    book_id = book.json()["id"]
+    readers = [
+        await get_client.post(
+            "/readers/",
+            headers=headers,
+            json=INPUT_CreateReader(name="hot reader", email=f"hot{number}@library.org").model_dump()
+        )
+        for number in range(6)
+    ]
+    responses = await gather(*[
+        get_client.post(
+            "/borrowed_books/",
+            headers=headers,
+            json=INPUT_CreateBorrowedBook(reader_id=reader.json()["id"], book_id=book_id).model_dump()
+        )
+        for reader in readers
+    ])
+    assert sorted(response.status_code for response in responses) == [201, 201, 400, 400, 400, 400]
+    assert all(
+        response.json() == {"detail": AllBooksBorrowed(book_id).detail}
+        for response in responses if response.status_code == 400
+    )
+    assert (await get_client.get(f"/books/{book_id}")).json()["quantity"] == 0
+
+
+@pytest.mark.asyncio
+async def test_bulk_give_out_and_return(get_token, get_client):
+    """Пакетная выдача и возврат: результат по каждой книге, лимит проверяется на всю пачку"""
+    headers = {"Authorization": f"bearer {get_token}"}
+    reader = await get_client.post(
+        "/readers/",
+        headers=headers,
+        json=INPUT_CreateReader(name="bulk reader", email="bulk@library.org").model_dump()
+    )
+    reader_id = reader.json()["id"]
+    book_ids = [
+        (await get_client.post(
+            "/books/",
+            headers=headers,
+            json=INPUT_CreateBook(title=f"Bulk {number}", author="Bulk", quantity=quantity).model_dump()
+        )).json()["id"]
+        for number, quantity in enumerate((1, 1, 0, 1, 1))
+    ]
+    first, second, empty, third, fourth = book_ids
+    response = await get_client.post(
+        "/borrowed_books/bulk",
+        headers=headers,
+        json={"reader_id": reader_id, "book_ids": [first, second, empty]}
+    )
+    assert response.status_code == 200
+    assert [(item["book_id"], item["status_code"]) for item in response.json()["items"]] \
+           == [(first, 201), (second, 201), (empty, 400)]
+    response = await get_client.post(
+        "/borrowed_books/bulk",
+        headers=headers,
+        json={"reader_id": reader_id, "book_ids": [first, 100500]}
+    )
+    assert [item["status_code"] for item in response.json()["items"]] == [400, 404]
+    response = await get_client.post(
+        "/borrowed_books/bulk",
+        headers=headers,
+        json={"reader_id": reader_id, "book_ids": [third, fourth]}
+    )
+    assert response.status_code == 400
+    assert response.json() == {"detail": BorrowedLimitExceeded(reader_id).detail}
+    assert (await get_client.get(f"/books/{third}")).json()["quantity"] == 1
+    response = await get_client.patch(
+        "/borrowed_books/bulk",
+        headers=headers,
+        json={"reader_id": reader_id, "book_ids": [second, first, third]}
+    )
+    assert [(item["book_id"], item["status_code"]) for item in response.json()["items"]] \
+           == [(second, 204), (first, 204), (third, 404)]
+    assert [(await get_client.get(f"/books/{book_id}")).json()["quantity"] for book_id in (first, second)] == [1, 1]
+
+
+async def explain(stmt, *settings: str, **parameters) -> str:
+    """План запроса без выполнения. Последовательное сканирование выключено:
+    на тестовых данных оно дешевле любого индекса, а проверяется, что индекс подходит запросу"""
+    sql = stmt.params(**parameters).compile(dialect=database().dialect, compile_kwargs={"literal_binds": True})
+    async with database().connect() as connection:
+        for setting in ("enable_seqscan = off", *settings):
+            await connection.exec_driver_sql(f"SET LOCAL {setting}")
+        cursor = await connection.exec_driver_sql(f"EXPLAIN {sql}")
+        plan = "\n".join(cursor.scalars().all())
+        await connection.rollback()
+    return plan
+
+
+async def partition_indexes(index: str) -> set[str]:
+    """Индекс секционированной таблицы в плане виден под именами своих копий в секциях"""
+    async with database().connect() as connection:
+        cursor = await connection.exec_driver_sql(
+            "SELECT inhrelid::regclass::text FROM pg_inherits WHERE inhparent = %(index)s::regclass",
+            {"index": index}
+        )
+        return {index, *cursor.scalars().all()}
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "stmt, parameters, indexes",
+    [
+        (DB_GiveOutBook._stmt, {"reader": 1, "book": 1},
+         {"borrowed_books_open_reader_book_idx", "borrowed_books_open_book_idx"}),
+        (DB_ReturnBook._status, {"reader": 1, "book": 1},
+         {"borrowed_books_open_reader_book_idx", "borrowed_books_open_book_idx"}),
+        (DB_DeleteReader._stmt, {"reader_id": 1}, {"borrowed_books_open_reader_book_idx"}),
+        (DB_DeleteBook._stmt, {"book_id": 1}, {"borrowed_books_open_book_idx"}),
+    ]
+)
+async def test_open_loans_queries_use_partial_indexes(stmt, parameters, indexes):
+    """Проверки открытых выдач идут по частичным индексам, а не по всей истории"""
+    plan = await explain(stmt, **parameters)
+    names = set.union(*[await partition_indexes(index) for index in indexes])
+    assert any(name in plan for name in names), plan
+
+
+@pytest.mark.asyncio
+async def test_borrow_list_cursor_pagination(get_token, get_client):
+    """Курсор по (borrow_date, id) проходит все выдачи без повторов, фильтры сужают выборку"""
+    headers = {"Authorization": f"bearer {get_token}"}
+    everything = (await get_client.get("/borrowed_books/", headers=headers, params={"limit": 1000})).json()
+    assert [(loan["borrow_date"], loan["id"]) for loan in everything] \
+           == sorted(((loan["borrow_date"], loan["id"]) for loan in everything), reverse=True)
+    pages, after = [], None
+    while True:
+        params = {"limit": 3} | ({"after": after} if after else {})
+        response = await get_client.get("/borrowed_books/", headers=headers, params=params)
+        pages.extend(loan["id"] for loan in response.json())
+        after = response.headers.get("X-Next-Cursor")
+        if after is None:
+            break
+    assert pages == [loan["id"] for loan in everything]
+    loan = everything[0]
+    assert set(loan) == {"id", "reader", "borrowed_books", "borrow_date", "return_date"}
+    assert len(loan["borrowed_books"]) == 1
+    filtered = (await get_client.get(
+        "/borrowed_books/",
+        headers=headers,
+        params={
+            "reader_id": loan["reader"]["id"],
+            "book_id": loan["borrowed_books"][0]["id"],
+            "borrowed_from": loan["borrow_date"],
+            "limit": 1000
+        }
+    )).json()
+    assert [item["id"] for item in filtered] == [loan["id"]]
+    open_only = (await get_client.get(
+        "/borrowed_books/", headers=headers, params={"no_returned_only": True, "limit": 1000}
+    )).json()
+    assert open_only == [item for item in everything if item["return_date"] is None]
+    response = await get_client.get("/borrowed_books/", headers=headers, params={"after": "garbage"})
+    assert response.status_code == 400
+
+
+@pytest.mark.asyncio
+async def test_borrow_list_page_uses_index():
+    """Страница по курсору читается проходом индекса (borrow_date, id), без сортировки всей истории"""
+    stmt = DB_GetBorrowList._stmt(False, False, False, False, False, True)
+    plan = await explain(stmt, limit=50, after_date=datetime.datetime(2100, 1, 1), after_id=0)
+    index = "borrowed_books_borrow_date_id_idx"
+    assert all(name in plan for name in await partition_indexes(index) - {index}), plan
+    assert "Sort  (" not in plan, plan  # секции сливаются Merge Append без сортировки
+
+
+@pytest.mark.asyncio
+async def test_archive_partitions_keeps_open_loans():
+    """Архивирование уносит историю, невозвращенные книги остаются в borrowed_books. Все в откатываемой транзакции"""
+    async with database().connect() as connection:
+        transaction = await connection.begin()
+        before = await list_partitions(connection)
+        upper = max(partition.upper for partition in before if not partition.is_default)
+        assert await create_partitions(connection, upper.year) == [f"borrowed_books_y{upper.year}"]
+        assert await create_partitions(connection, upper.year) == []
+        open_loans = sum(partition.open_loans for partition in before)
+        history = before[0]
+        assert history.lower is None and history.rows > history.open_loans > 0
+        with pytest.raises(PartitionHasOpenLoans):
+            await archive_partitions(connection, history.upper, OpenLoans.refuse)
+        assert await archive_partitions(connection, history.upper) == [history]
+        after = await list_partitions(connection)
+        assert history.name not in {partition.name for partition in after}
+        assert sum(partition.open_loans for partition in after) == open_loans
+        assert after[-1].is_default and after[-1].open_loans >= history.open_loans
+        archived = (await connection.exec_driver_sql(
+            f"SELECT count(*), count(return_date) FROM {ARCHIVE_SCHEMA}.{history.name}"
+        )).one()
+        assert tuple(archived) == (history.rows - history.open_loans,) * 2
+        await transaction.rollback()
+
+
+@pytest.mark.asyncio
+async def test_concurrent_checkouts_respect_reader_limit(get_token, get_client):
+    """Параллельные выдачи одному читателю: счетчик open_loans не дает взять больше лимита"""
+    headers = {"Authorization": f"bearer {get_token}"}
+    reader_id = (await get_client.post(
+        "/readers/",
+        headers=headers,
+        json=INPUT_CreateReader(name="greedy reader", email="greedy@library.org").model_dump()
+    )).json()["id"]
+    book_ids = [
+        (await get_client.post(
+            "/books/",
+            headers=headers,
+            json=INPUT_CreateBook(title=f"Limit {number}", author="Limit", quantity=1).model_dump()
+        )).json()["id"]
+        for number in range(6)
+    ]
+    responses = await gather(*[
+        get_client.post(
+            "/borrowed_books/",
+            headers=headers,
+            json=INPUT_CreateBorrowedBook(reader_id=reader_id, book_id=book_id).model_dump()
+        )
+        for book_id in book_ids
+    ])
+    assert sorted(response.status_code for response in responses) == [201, 201, 201, 400, 400, 400]
+    assert all(
+        response.json() == {"detail": BorrowedLimitExceeded(reader_id).detail}
+        for response in responses if response.status_code == 400
+    )
+    assert (await get_client.get(f"/readers/{reader_id}", headers=headers)).json()["open_loans"] == 3
+    given = [book_id for book_id, response in zip(book_ids, responses) if response.status_code == 201]
+    await get_client.patch(
+        "/borrowed_books/bulk", headers=headers, json={"reader_id": reader_id, "book_ids": given[:2]}
+    )
+    await get_client.patch(
+        "/borrowed_books/",
+        headers=headers,
+        json=INPUT_CreateBorrowedBook(reader_id=reader_id, book_id=given[2]).model_dump()
+    )
+    assert (await get_client.get(f"/readers/{reader_id}", headers=headers)).json()["open_loans"] == 0
+    async with database().begin() as connection:
+        assert await check_open_loans(connection) == []
+
+
+async def open_loans(reader_id: int, book_id: int) -> int:
+    """Сколько выдач этой книги читателю не возвращено"""
+    async with database().connect() as connection:
+        return (await connection.execute(
+            select(func.count())
+            .where(borrowed_books.c.reader_id == reader_id)
+            .where(borrowed_books.c.book_id == book_id)
+            .where(borrowed_books.c.return_date.is_(None))
+        )).scalar()
+
+
+@pytest.mark.asyncio
+async def test_concurrent_checkouts_of_same_book_give_one_loan(get_token, get_client):
+    """Параллельные выдачи одной книги одному читателю: проходит одна, вторая видит выданную книгу"""
+    headers = {"Authorization": f"bearer {get_token}"}
+    reader_id = (await get_client.post(
+        "/readers/",
+        headers=headers,
+        json=INPUT_CreateReader(name="double reader", email="double@library.org").model_dump()
+    )).json()["id"]
+    book_id = (await get_client.post(
+        "/books/",
+        headers=headers,
+        json=INPUT_CreateBook(title="Twice", author="Twice", quantity=3).model_dump()
+    )).json()["id"]
+    loan = INPUT_CreateBorrowedBook(reader_id=reader_id, book_id=book_id).model_dump()
+    responses = await gather(*[get_client.post("/borrowed_books/", headers=headers, json=loan) for _ in range(2)])
+    assert sorted(response.status_code for response in responses) == [201, 400]
+    assert await open_loans(reader_id, book_id) == 1
+    assert (await get_client.patch("/borrowed_books/", headers=headers, json=loan)).status_code == 204
+
+    async with database().connect() as connection:  # первая выдача ждет фиксации, вторая - ее блокировку
+        await connection.execute(DB_GiveOutBook._stmt, {"reader": reader_id, "book": book_id})
+        taken = asyncio.create_task(get_client.post("/borrowed_books/", headers=headers, json=loan))
+        await asyncio.wait_for(wait_for_lock_waiters(), 5)
+        await connection.commit()
+    response = await taken
+    assert response.status_code == 400
+    assert response.json() == {"detail": ReaderAlreadyHasBook(reader_id, book_id).detail}
+    assert await open_loans(reader_id, book_id) == 1
+    assert (await get_client.get(f"/books/{book_id}")).json()["quantity"] == 2
+    async with database().begin() as connection:
+        assert await check_open_loans(connection) == []
+
+
+@pytest.mark.asyncio
+async def test_concurrent_bulk_and_single_checkouts_give_one_loan(get_token, get_client):
+    """Пакетная выдача параллельно с одиночной той же книги тому же читателю: выдача одна"""
+    headers = {"Authorization": f"bearer {get_token}"}
+    reader_id = (await get_client.post(
+        "/readers/",
+        headers=headers,
+        json=INPUT_CreateReader(name="bulk double reader", email="bulk.double@library.org").model_dump()
+    )).json()["id"]
+    book_id, other_id = [
+        (await get_client.post(
+            "/books/",
+            headers=headers,
+            json=INPUT_CreateBook(title=f"Twice bulk {number}", author="Twice", quantity=3).model_dump()
+        )).json()["id"]
+        for number in range(2)
+    ]
+    loan = INPUT_CreateBorrowedBook(reader_id=reader_id, book_id=book_id).model_dump()
+    bulk = {"reader_id": reader_id, "book_ids": [book_id, other_id]}
+    single, batch = await gather(
+        get_client.post("/borrowed_books/", headers=headers, json=loan),
+        get_client.post("/borrowed_books/bulk", headers=headers, json=bulk)
+    )
+    statuses = [item["status_code"] for item in batch.json()["items"]]
+    assert sorted([single.status_code, statuses[0]]) == [201, 400] and statuses[1] == 201
+    assert await open_loans(reader_id, book_id) == 1
+    await get_client.patch("/borrowed_books/bulk", headers=headers, json=bulk)
+
+    async with database().connect() as connection:  # одиночная выдача ждет фиксации, пакетная - ее блокировку
+        await connection.execute(DB_GiveOutBook._stmt, {"reader": reader_id, "book": book_id})
+        batch = asyncio.create_task(get_client.post("/borrowed_books/bulk", headers=headers, json=bulk))
+        await asyncio.wait_for(wait_for_lock_waiters(), 5)
+        await connection.commit()
+    assert [item["status_code"] for item in (await batch).json()["items"]] == [400, 201]
+    assert await open_loans(reader_id, book_id) == 1
+    assert (await get_client.get(f"/readers/{reader_id}", headers=headers)).json()["open_loans"] == 2
+    async with database().begin() as connection:
+        assert await check_open_loans(connection) == []
+        assert await find_duplicate_loans(connection) == []
+    async with database().connect() as connection:  # повтор, записанный в обход репозиториев, сверка находит
+        await connection.execute(
+            borrowed_books.insert().values(reader_id=reader_id, book_id=book_id, borrow_date=func.localtimestamp())
+        )
+        assert await find_duplicate_loans(connection) == [Duplicate(reader_id=reader_id, book_id=book_id, loans=2)]
+        await connection.rollback()
+
+
+@pytest.mark.asyncio
+async def test_concurrent_returns_of_same_loan_return_once(get_token, get_client):
+    """Параллельные возвраты одной выдачи: экземпляр возвращается один раз, второй возврат получает 404"""
+    headers = {"Authorization": f"bearer {get_token}"}
+    reader_id = (await get_client.post(
+        "/readers/",
+        headers=headers,
+        json=INPUT_CreateReader(name="hasty reader", email="hasty@library.org").model_dump()
+    )).json()["id"]
+    book_id = (await get_client.post(
+        "/books/",
+        headers=headers,
+        json=INPUT_CreateBook(title="Returned twice", author="Twice", quantity=1).model_dump()
+    )).json()["id"]
+    loan = INPUT_CreateBorrowedBook(reader_id=reader_id, book_id=book_id).model_dump()
+    assert (await get_client.post("/borrowed_books/", headers=headers, json=loan)).status_code == 201
+    responses = await gather(*[get_client.patch("/borrowed_books/", headers=headers, json=loan) for _ in range(2)])
+    assert sorted(response.status_code for response in responses) == [204, 404]
+
+    borrow_id = (await get_client.post("/borrowed_books/", headers=headers, json=loan)).json()["id"]
+    async with database().connect() as connection:  # первый возврат ждет фиксации, второй - блокировку выдачи
+        await connection.execute(DB_ReturnBook._stmt, {"borrow_id": borrow_id})
+        returned = asyncio.create_task(get_client.patch("/borrowed_books/", headers=headers, json=loan))
+        await asyncio.wait_for(wait_for_lock_waiters(), 5)
+        await connection.commit()
+    assert (await returned).status_code == 404
+    assert (await get_client.get(f"/books/{book_id}")).json()["quantity"] == 1
+    assert (await get_client.get(f"/readers/{reader_id}", headers=headers)).json()["open_loans"] == 0
+
+
+@pytest.mark.asyncio
+async def test_reader_borrowings_history(get_token, get_client):
+    """Карточка читателя - только книги на руках, история выдач - отдельно, страницами по курсору"""
+    headers = {"Authorization": f"bearer {get_token}"}
+    reader_id = (await get_client.post(
+        "/readers/",
+        headers=headers,
+        json=INPUT_CreateReader(name="old-timer", email="old-timer@library.org").model_dump()
+    )).json()["id"]
+    for number in range(3):
+        book_id = (await get_client.post(
+            "/books/",
+            headers=headers,
+            json=INPUT_CreateBook(title=f"History {number}", author="History", quantity=1).model_dump()
+        )).json()["id"]
+        loan = INPUT_CreateBorrowedBook(reader_id=reader_id, book_id=book_id).model_dump()
+        await get_client.post("/borrowed_books/", headers=headers, json=loan)
+        if number < 2:
+            await get_client.patch("/borrowed_books/", headers=headers, json=loan)
+    loans = (await get_client.get("/borrowed_books/", headers=headers, params={"reader_id": reader_id})).json()
+    assert [loan["return_date"] is None for loan in loans] == [True, False, False]
+    reader = (await get_client.get(f"/readers/{reader_id}", headers=headers)).json()
+    assert sorted(loan["id"] for loan in reader["borrowings"]) \
+           == sorted(loan["id"] for loan in loans if loan["return_date"] is None)
+    pages, after = [], None
+    while True:
+        params = {"limit": 2} | ({"after": after} if after else {})
+        response = await get_client.get(f"/readers/{reader_id}/borrowings", headers=headers, params=params)
+        pages.extend(response.json())
+        after = response.headers.get("X-Next-Cursor")
+        if after is None:
+            break
+    assert [(loan["id"], loan["book_id"], loan["return_date"]) for loan in pages] \
+           == [(loan["id"], loan["borrowed_books"][0]["id"], loan["return_date"]) for loan in loans]
+    period = {"borrowed_from": loans[-1]["borrow_date"], "borrowed_to": loans[0]["borrow_date"]}
+    response = await get_client.get(f"/readers/{reader_id}/borrowings", headers=headers, params=period)
+    assert [loan["id"] for loan in response.json()] == [loan["id"] for loan in loans[1:]]
+    newcomer = (await get_client.post(
+        "/readers/",
+        headers=headers,
+        json=INPUT_CreateReader(name="newcomer", email="newcomer@library.org").model_dump()
+    )).json()["id"]
+    assert (await get_client.get(f"/readers/{newcomer}/borrowings", headers=headers)).json() == []
+    assert (await get_client.get("/readers/100500/borrowings", headers=headers)).status_code == 404
+
+
+@pytest.mark.asyncio
+async def test_reader_borrowings_page_uses_index():
+    """Страница истории читателя читается проходом индекса (reader_id, borrow_date, id), без сортировки"""
+    stmt = DB_GetReaderBorrowings._stmt(False, False, True)
+    plan = await explain(
+        stmt,
+        "enable_sort = off",  # на паре строк сортировка дешевле, проверяется, что без нее план есть
+        reader_id=1,
+        limit=50,
+        after_date=datetime.datetime(2100, 1, 1),
+        after_id=0
+    )
+    index = "borrowed_books_reader_borrow_date_id_idx"
+    assert all(name in plan for name in await partition_indexes(index) - {index}), plan
+    page = plan[plan.index("->  Limit"):]
+    assert "Sort  (" not in page, plan  # сортируется только готовая страница, а не история читателя
+
+
+@pytest.mark.asyncio
+async def test_striped_stock_checkouts(get_token, get_client):
+    """Остаток книги в слотах: параллельные выдачи расходятся по слотам и не выдают больше, чем есть"""
+    headers = {"Authorization": f"bearer {get_token}"}
+    book_id = (await get_client.post(
+        "/books/",
+        headers=headers,
+        json=INPUT_CreateBook(title="Bestseller", author="Hot", quantity=8).model_dump()
+    )).json()["id"]
+    response = await get_client.put(f"/books/{book_id}/stock", headers=headers, json={"slots": 4})
+    assert response.json() == {"book_id": book_id, "slots": 4, "quantity": 8}
+    available = (await get_client.get("/books/facets")).json()["available"]
+    export = await get_client.get("/books/export", headers=headers)
+    modified = (await DB_GetBookById()(book_id)).last_modified
+    reader_ids = [
+        (await get_client.post(
+            "/readers/",
+            headers=headers,
+            json=INPUT_CreateReader(name=f"fan {number}", email=f"fan{number}@library.org").model_dump()
+        )).json()["id"]
+        for number in range(10)
+    ]
+    responses = await gather(*[
+        get_client.post(
+            "/borrowed_books/",
+            headers=headers,
+            json=INPUT_CreateBorrowedBook(reader_id=reader_id, book_id=book_id).model_dump()
+        )
+        for reader_id in reader_ids
+    ])
+    assert sorted(response.status_code for response in responses) == [201] * 8 + [400] * 2
+    assert all(
+        response.json() == {"detail": AllBooksBorrowed(book_id).detail}
+        for response in responses if response.status_code == 400
+    )
+    assert (await get_client.get(f"/books/{book_id}")).json()["quantity"] == 0
+    assert (await get_client.get("/books/facets")).json()["available"] == available - 1  # все слоты пусты
+    response = await get_client.get(
+        "/books/export",
+        headers=headers,
+        params={"changed_since": export.headers["X-Export-Watermark"]}
+    )
+    assert [(book["id"], book["quantity"]) for book in map(json.loads, response.text.splitlines())] == [(book_id, 0)]
+    assert (await DB_GetBookById()(book_id)).last_modified > modified  # выдачи меняли только слоты
+    given = [reader_id for reader_id, response in zip(reader_ids, responses) if response.status_code == 201]
+    for reader_id in given[:3]:
+        await get_client.patch(
+            "/borrowed_books/",
+            headers=headers,
+            json=INPUT_CreateBorrowedBook(reader_id=reader_id, book_id=book_id).model_dump()
+        )
+    await get_client.patch("/borrowed_books/bulk", headers=headers, json={"reader_id": given[3], "book_ids": [book_id]})
+    assert (await get_client.get(f"/books/{book_id}")).json()["quantity"] == 4
+    response = await get_client.post(
+        "/borrowed_books/bulk", headers=headers, json={"reader_id": given[0], "book_ids": [book_id]}
+    )
+    assert [item["status_code"] for item in response.json()["items"]] == [201]
+    response = await get_client.put(f"/books/{book_id}/stock", headers=headers, json={"slots": 0})
+    assert response.json() == {"book_id": book_id, "slots": 0, "quantity": 3}
+    assert (await get_client.get(f"/books/{book_id}")).json()["quantity"] == 3
+    assert (await get_client.put("/books/100500/stock", headers=headers, json={"slots": 2})).status_code == 404
+
+
+async def wait_for_lock_waiters():
+    """Ждет, пока чей-то запрос не встанет в очередь за блокировкой"""
+    async with database().connect() as connection:
+        while not (await connection.exec_driver_sql("SELECT count(*) FROM pg_locks WHERE NOT granted")).scalar():
+            await asyncio.sleep(0.01)
+
+
+@pytest.mark.asyncio
+async def test_return_during_stock_switch_keeps_copy(get_token, get_client):
+    """Возврат, начатый во время переключения остатка на слоты и обратно, не теряет экземпляр"""
+    headers = {"Authorization": f"bearer {get_token}"}
+    book_id = (await get_client.post(
+        "/books/",
+        headers=headers,
+        json=INPUT_CreateBook(title="Switching", author="Switching", quantity=2).model_dump()
+    )).json()["id"]
+    reader_id = (await get_client.post(
+        "/readers/",
+        headers=headers,
+        json=INPUT_CreateReader(name="switch reader", email="switch@library.org").model_dump()
+    )).json()["id"]
+    loan = INPUT_CreateBorrowedBook(reader_id=reader_id, book_id=book_id).model_dump()
+    assert (await get_client.post("/borrowed_books/", headers=headers, json=loan)).status_code == 201
+    before = metrics.snapshot()
+
+    async with database().connect() as connection:  # переключение на слоты, как в PUT /books/{book_id}/stock
+        await connection.execute(select(books.c.id).where(books.c.id == book_id).with_for_update(key_share=True))
+        await connection.execute(book_stock.insert().values(book_id=book_id, slot=0, quantity=1))
+        await connection.execute(books.update().where(books.c.id == book_id).values(stock_slots=1, quantity=2))
+        returned = asyncio.create_task(get_client.patch("/borrowed_books/", headers=headers, json=loan))
+        await asyncio.wait_for(wait_for_lock_waiters(), 5)
+        await connection.commit()
+    assert (await returned).status_code == 204
+    assert (await get_client.get(f"/books/{book_id}")).json()["quantity"] == 2
+
+    assert (await get_client.post("/borrowed_books/", headers=headers, json=loan)).status_code == 201
+    async with database().connect() as connection:  # и обратно
+        await connection.execute(select(books.c.id).where(books.c.id == book_id).with_for_update(key_share=True))
+        await connection.execute(book_stock.delete().where(book_stock.c.book_id == book_id))
+        await connection.execute(books.update().where(books.c.id == book_id).values(stock_slots=0, quantity=1))
+        returned = asyncio.create_task(get_client.patch(
+            "/borrowed_books/bulk", headers=headers, json={"reader_id": reader_id, "book_ids": [book_id]}
+        ))
+        await asyncio.wait_for(wait_for_lock_waiters(), 5)
+        await connection.commit()
+    assert [item["status_code"] for item in (await returned).json()["items"]] == [204]
+    assert (await get_client.get(f"/books/{book_id}")).json()["quantity"] == 2
+    after = metrics.snapshot()
+    for repository in ("DB_ReturnBook", "DB_ReturnBooks"):
+        assert after[f"sql.retries.{repository}"] - before.get(f"sql.retries.{repository}", 0) == 1
+
+
+@pytest.mark.asyncio
+async def test_slot_checkout_sees_copy_restocked_while_waiting(get_token, get_client):
+    """Пока выдача ждала занятый слот, экземпляр вернули в другой, невидимый ее снимку: выдача повторяется"""
+    headers = {"Authorization": f"bearer {get_token}"}
+    book_id = (await get_client.post(
+        "/books/",
+        headers=headers,
+        json=INPUT_CreateBook(title="Restocked", author="Restocked", quantity=1).model_dump()
+    )).json()["id"]
+    await get_client.put(f"/books/{book_id}/stock", headers=headers, json={"slots": 2})  # слоты 1 и 0
+    reader_id = (await get_client.post(
+        "/readers/",
+        headers=headers,
+        json=INPUT_CreateReader(name="waiting reader", email="waiting@library.org").model_dump()
+    )).json()["id"]
+    loan = INPUT_CreateBorrowedBook(reader_id=reader_id, book_id=book_id).model_dump()
+    async with database().connect() as connection:  # параллельно выдали из первого слота и вернули во второй
+        for slot, quantity in ((0, 0), (1, 1)):
+            await connection.execute(
+                book_stock.update()
+                .where(book_stock.c.book_id == book_id)
+                .where(book_stock.c.slot == slot)
+                .values(quantity=quantity)
+            )
+        taken = asyncio.create_task(get_client.post("/borrowed_books/", headers=headers, json=loan))
+        await asyncio.wait_for(wait_for_lock_waiters(), 5)
+        await connection.commit()
+    assert (await taken).status_code == 201
+    assert (await get_client.get(f"/books/{book_id}")).json()["quantity"] == 0
+
+
+class LockedGiveOut(DB_GiveOutBook):
+    transaction = TransactionPolicy(lock_timeout=50, retries=2, backoff=0.01)
+
+
+@pytest.mark.asyncio
+async def test_lock_timeout_retries_then_503(get_token, get_client):
+    """Не дождались блокировки: вызов повторяется по политике, затем 503 вместо 500"""
+    headers = {"Authorization": f"bearer {get_token}"}
+    book_id = (await get_client.post(
+        "/books/",
+        headers=headers,
+        json=INPUT_CreateBook(title="Locked", author="Locked", quantity=1).model_dump()
+    )).json()["id"]
+    reader_id = (await get_client.post(
+        "/readers/",
+        headers=headers,
+        json=INPUT_CreateReader(name="patient reader", email="patient@library.org").model_dump()
+    )).json()["id"]
+    model = INPUT_CreateBorrowedBook(reader_id=reader_id, book_id=book_id)
+    before = metrics.snapshot()
+    async with database().connect() as connection:
+        await connection.execute(select(books.c.id).where(books.c.id == book_id).with_for_update())
+        with pytest.raises(HTTPException) as error:
+            await LockedGiveOut()(model)
+        await connection.rollback()
+    assert error.value.status_code == 503
+    after = metrics.snapshot()
+    assert after["sql.retries.LockedGiveOut"] - before.get("sql.retries.LockedGiveOut", 0) == 2
+    assert after["sql.retries_exhausted.LockedGiveOut"] - before.get("sql.retries_exhausted.LockedGiveOut", 0) == 1
+    assert after["sql.contention.LockNotAvailable"] - before.get("sql.contention.LockNotAvailable", 0) == 3
+    assert await LockedGiveOut()(model)
+
+
+@pytest.mark.asyncio
+async def test_reader_list_semi_join_and_cursor(get_token, get_client):
+    """Читатель с несколькими книгами на руках в списке один раз, страницы по курсору (name, id) без пропусков"""
+    headers = {"Authorization": f"bearer {get_token}"}
+    reader_id = (await get_client.post(
+        "/readers/",
+        headers=headers,
+        json=INPUT_CreateReader(name="bookworm", email="bookworm@library.org").model_dump()
+    )).json()["id"]
+    for number in range(2):
+        book_id = (await get_client.post(
+            "/books/",
+            headers=headers,
+            json=INPUT_CreateBook(title=f"Worm {number}", author="Worm", quantity=1).model_dump()
+        )).json()["id"]
+        await get_client.post(
+            "/borrowed_books/",
+            headers=headers,
+            json=INPUT_CreateBorrowedBook(reader_id=reader_id, book_id=book_id).model_dump()
+        )
+    for borrowings in HasBorrowings:
+        params = {"borrowings": borrowings.value, "limit": 1000}
+        ids = [reader["id"] for reader in (await get_client.get("/readers/", headers=headers, params=params)).json()]
+        assert len(ids) == len(set(ids))
+        assert (reader_id in ids) == (borrowings is HasBorrowings.only_with)
+    everyone = (await get_client.get("/readers/", headers=headers, params={"limit": 1000})).json()
+    assert [(reader["name"], reader["id"]) for reader in everyone] \
+           == sorted((reader["name"], reader["id"]) for reader in everyone)
+    pages, after = [], None
+    while True:
+        params = {"limit": 3} | ({"after": after} if after else {})
+        response = await get_client.get("/readers/", headers=headers, params=params)
+        pages.extend(response.json())
+        after = response.headers.get("X-Next-Cursor")
+        if after is None:
+            break
+    assert pages == everyone
+    assert (await get_client.get("/readers/", headers=headers, params={"after": "garbage"})).status_code == 400
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("borrowings", list(HasBorrowings))
+async def test_reader_list_page_uses_indexes(borrowings):
+    """Страница читателей - проход readers_name_id_idx без сортировки, на каждого читателя - проба
+    частичного индекса открытых выдач (на тестовых данных хеш-соединение и материализация дешевле, они выключены)"""
+    stmt = DB_GetReaderList._stmts[borrowings, True]
+    plan = await explain(
+        stmt,
+        "enable_hashjoin = off",
+        "enable_mergejoin = off",
+        "enable_material = off",
+        "enable_sort = off",
+        limit=10,
+        after_name="",
+        after_id=0
+    )
+    assert "readers_name_id_idx" in plan, plan
+    assert "Sort  (" not in plan, plan
+    assert any(name in plan for name in await partition_indexes("borrowed_books_open_reader_book_idx")), plan
+
+
+@pytest.mark.asyncio
+async def test_search_readers(get_token, get_client):
+    """Подсказки: начало email без учета регистра выше совпадения по имени, спецсимволы LIKE - обычные символы"""
+    headers = {"Authorization": f"bearer {get_token}"}
+
+    async def search(q: str, **params) -> list[dict]:
+        response = await get_client.get("/readers/search", headers=headers, params={"q": q, **params})
+        assert response.status_code == 200
+        return response.json()
+
+    assert (await search("BIG@"))[0]["email"] == "big@gang.bang"
+    assert "stephen hawking" in [reader["name"] for reader in await search("hawk")]
+    fans = await search("fan", limit=3)
+    assert [reader["email"] for reader in fans] == ["fan0@library.org", "fan1@library.org", "fan2@library.org"]
+    assert await search("%") == []
+    assert await search("_an") == []
+    assert (await get_client.get("/readers/search", headers=headers, params={"q": ""})).status_code == 422
+
+
+@pytest.mark.asyncio
+async def test_search_readers_order_is_total(get_token, get_client):
+    """Ступени подсказок: начало email, начало имени, начало второго слова, часть имени; внутри ступени - по id"""
+    headers = {"Authorization": f"bearer {get_token}"}
+    for name, email in (
+            ("Oleg Agrinov", "x3@desk.org"),
+            ("Ivan Grin", "x1@desk.org"),
+            ("Grinberg Olga", "x2@desk.org"),
+            ("grinch", "grin@desk.org"),
+            ("Grinberg Olga", "x4@desk.org")
+    ):
+        response = await get_client.post(
+            "/readers/",
+            headers=headers,
+            json=INPUT_CreateReader(name=name, email=email).model_dump()
+        )
+        assert response.status_code == 201
+
+    async def search(q: str, **params) -> list[str]:
+        response = await get_client.get("/readers/search", headers=headers, params={"q": q, **params})
+        assert response.status_code == 200
+        return [reader["email"] for reader in response.json()]
+
+    expected = ["grin@desk.org", "x2@desk.org", "x4@desk.org", "x1@desk.org", "x3@desk.org"]
+    assert await search("GRIN") == expected
+    assert await search("grin") == expected
+    assert await search("grin", limit=3) == expected[:3]
+    assert "x3@desk.org" not in await search("gr", limit=50)  # часть из середины слова - от 3 символов
+
+
+@pytest.mark.asyncio
+async def test_search_readers_uses_indexes():
+    """Начала email, имени и второго слова - диапазоны индексов в их порядке: первые limit без сортировки"""
+    email, name, name_tail, _ = DB_SearchReaders._stmts
+    for stmt, index in (
+            (email, "readers_email_lower_id_idx"),
+            (name, "readers_name_lower_id_idx"),
+            (name_tail, "readers_name_tail_lower_id_idx")
+    ):
+        plan = await explain(stmt, prefix="hawk%", limit=10)
+        assert index in plan, plan
+        assert "Sort" not in plan, plan
+
+
+@pytest.mark.asyncio
+async def test_import_readers(get_token, get_client):
+    """Массовая регистрация: занятые и повторные email и невалидные записи в отчете, остальные созданы"""
+    headers = {"Authorization": f"bearer {get_token}"}
+    await get_client.post(
+        "/readers/",
+        headers=headers,
+        json=INPUT_CreateReader(name="old student", email="student0@school.org").model_dump()
+    )
+    response = await get_client.post(
+        "/readers/import",
+        headers={**headers, "Content-Type": "text/csv"},
+        content=(
+            "name,email\n"
+            "student one,student1@school.org\n"
+            "student zero,student0@school.org\n"
+            "student two,student2@school.org\n"
+            "student one again,student1@school.org\n"
+            "no email,\n"
+        )
+    )
+    assert response.status_code == 201
+    report = response.json()
+    assert [created["row"] for created in report["created"]] == [1, 3]
+    assert report["duplicates"] == [
+        {"row": 2, "email": "student0@school.org"},
+        {"row": 4, "email": "student1@school.org"}
+    ]
+    assert [error["row"] for error in report["invalid"]] == [5]
+    reader = (await get_client.get(f"/readers/{report['created'][1]['id']}", headers=headers)).json()
+    assert (reader["name"], reader["email"]) == ("student two", "student2@school.org")
+    response = await get_client.post(
+        "/readers/import",
+        headers=headers,
+        json=[{"name": "student three", "email": "student3@school.org"}, 42]
+    )
+    report = response.json()
+    assert [created["row"] for created in report["created"]] == [1]
+    assert report["invalid"] == [{"row": 2, "detail": "Ожидается JSON объект"}]
+
+
+class SmallChunkCreateReaders(DB_CreateReaders):
+    chunk = 2
+
+
+@pytest.mark.asyncio
+async def test_import_readers_commits_per_chunk():
+    """Каждая пачка - своя транзакция: повтор email во второй пачке находится среди уже сохраненных"""
+
+    async def records():
+        for row, email in enumerate(["pupil1", "pupil2", "pupil1", "pupil3", "pupil3"], start=1):
+            yield row, INPUT_CreateReader(name=email, email=f"{email}@school.org")
+
+    report = await SmallChunkCreateReaders()(records())
+    assert [created.row for created in report.created] == [1, 2, 4]
+    assert [(duplicate.row, duplicate.email) for duplicate in report.duplicates] \
+           == [(3, "pupil1@school.org"), (5, "pupil3@school.org")]
+    assert len({created.id for created in report.created}) == 3
+
+
+@pytest.mark.asyncio
+async def test_logins_do_not_block_event_loop(get_token, get_client):
+    """bcrypt считается в пуле потоков: пока идут входы, остальные запросы воркера отвечают сразу"""
+    credentials = dict(username="ioann.grozny@porn.hub", password="SuperSecretpaSSword")
+    logins = [asyncio.create_task(get_client.post("/security/", data=credentials)) for _ in range(4)]
+    async with asyncio.timeout(5):
+        while metrics.snapshot()["password_pool.busy"] == 0:
+            await asyncio.sleep(0.001)
+    started = time.perf_counter()
+    response = await get_client.get("/metrics/", headers={"Authorization": f"bearer {get_token}"})
+    elapsed = time.perf_counter() - started
+    assert response.status_code == 200
+    assert response.json()["password_pool.busy"] > 0
+    assert not all(login.done() for login in logins)
+    assert elapsed < 0.1
+    assert [response.status_code for response in await gather(*logins)] == [200] * 4
+
+
+@pytest.mark.asyncio
+async def test_blocking_pool_rejects_over_queue_limit():
+    """Очередь пула ограничена: лишний вызов сразу получает 503, а не ждет"""
+    pool = BlockingPool("test_pool", workers=1, queue=1)
+    results = await gather(*(pool.run(time.sleep, 0.05) for _ in range(3)), return_exceptions=True)
+    assert results[:2] == [None, None]
+    assert isinstance(results[2], HTTPException) and results[2].status_code == 503
+    assert metrics.snapshot()["test_pool.rejected"] == 1
+
+
+@pytest.mark.asyncio
+async def test_blocking_pool_keeps_slot_of_cancelled_call_until_thread_finishes():
+    """Отмена ждущего вызова не освобождает место, пока поток еще считает, а снятый из очереди - освобождает"""
+    pool = BlockingPool("cancel_pool", workers=1, queue=1)
+    started, finish = threading.Event(), threading.Event()
+
+    def work():
+        started.set()
+        finish.wait(5)
+
+    running = asyncio.create_task(pool.run(work))
+    queued = asyncio.create_task(pool.run(time.sleep, 0))
+    await asyncio.to_thread(started.wait, 5)
+    running.cancel()
+    queued.cancel()
+    await gather(running, queued, return_exceptions=True)
+    assert (metrics.snapshot()["cancel_pool.busy"], metrics.snapshot()["cancel_pool.queued"]) == (1, 0)
+    waiting = asyncio.create_task(pool.run(sum, [1, 2]))  # место в очереди свободно, поток - нет
+    await asyncio.sleep(0)
+    with pytest.raises(HTTPException):
+        await pool.run(time.sleep, 0)
+    finish.set()
+    assert await waiting == 3
+    for _ in range(100):
+        if metrics.snapshot()["cancel_pool.busy"] == 0:
+            break
+        await asyncio.sleep(0.01)
+    assert metrics.snapshot()["cancel_pool.busy"] == 0
+
+
+@pytest.mark.asyncio
+async def test_token_cache_respects_exp_and_revocation(get_client):
+    """Повторный токен берется из кэша, но не переживает свой exp и отзыв"""
+    token = TokenManager.create({"id": "1"}, TokenTypes.ACCESS)
+    before = metrics.snapshot()
+    assert [await TokenManager.decode(token) for _ in range(3)] == [1, 1, 1]
+    after = metrics.snapshot()
+    assert after["token_cache.misses"] - before.get("token_cache.misses", 0) == 1
+    assert after["token_cache.hits"] - before.get("token_cache.hits", 0) == 2
+    TokenManager.revoke(token)
+    with pytest.raises(HTTPException) as error:
+        await TokenManager.decode(token)
+    assert error.value.status_code == 401
+    assert (await get_client.get("/metrics/", headers={"Authorization": f"bearer {token}"})).status_code == 401
+    short_lived = jwt.encode({"id": "1", "exp": int(time.time()) + 1}, TokenManager._TOKEN_SECRET_KEY, "HS256")
+    assert await TokenManager.decode(short_lived) == 1
+    await asyncio.sleep(int(time.time()) + 2 - time.time())
+    with pytest.raises(HTTPException) as error:
+        await TokenManager.decode(short_lived)
+    assert error.value.detail == ExpiredSignatureError().detail
+
+
+@pytest.mark.asyncio
+async def test_import_rejects_invalid_utf8(get_token, get_client):
+    """Не UTF-8 - невалидная запись в отчете, а не 500; BOM перед заголовком CSV не мешает"""
+    headers = {"Authorization": f"bearer {get_token}"}
+    body = (
+        "\ufeffname,email\nутф ученик,utf1@school.org\n".encode()
+        + "cp1251 ученик,cp@school.org\n".encode("cp1251")
+    )
+    response = await get_client.post("/readers/import", headers={**headers, "Content-Type": "text/csv"}, content=body)
+    assert response.status_code == 201
+    report = response.json()
+    assert [created["row"] for created in report["created"]] == [1]
+    assert report["invalid"] == [{"row": 2, "detail": INVALID_ENCODING}]
+    response = await get_client.post(
+        "/readers/import",
+        headers={**headers, "Content-Type": "application/x-ndjson"},
+        content=b'{"name": "\xff", "email": "bad@school.org"}\n'
+    )
+    assert response.json()["invalid"] == [{"row": 1, "detail": INVALID_ENCODING}]
+    response = await get_client.post(
+        "/readers/import",
+        headers={**headers, "Content-Type": "application/json"},
+        content=b'[{"name": "\xff"}]'
+    )
+    assert response.json()["invalid"] == [{"row": 1, "detail": INVALID_ENCODING}]
+    response = await get_client.post(
+        "/books/import",
+        headers={**headers, "Content-Type": "text/csv"},
+        content=b"\xfftitle,author\nx,y\n"
+    )
+    assert response.json()["invalid"] == [{"row": 0, "detail": f"Заголовок: {INVALID_ENCODING}"}]
+
+
+@pytest.mark.asyncio
+async def test_import_books_reports_concurrently_taken_isbn(get_token, get_client):
+    """ISBN, занятый параллельной транзакцией во время импорта, попадает в conflicts, а не теряется из отчета"""
+    async with database().connect() as connection:
+        await connection.execute(books.insert().values(title="Racer", author="Racer", quantity=1, isbn="978-race"))
+        importing = asyncio.create_task(get_client.post(
+            "/books/import",
+            headers={"Authorization": f"bearer {get_token}", "Content-Type": "application/x-ndjson"},
+            content='{"title": "Late", "author": "Late", "isbn": "978-race"}\n'
+                    '{"title": "Late", "author": "Late", "isbn": "978-race"}\n'
+                    '{"title": "Other", "author": "Late", "isbn": "978-other"}\n'
+        ))
+        await asyncio.sleep(0.2)  # импорт ждет исхода чужой вставки того же ISBN
+        await connection.commit()
+    report = (await importing).json()
+    assert report["created"] == 1
+    assert report["conflicts"] == [{"row": 1, "isbn": "978-race"}, {"row": 2, "isbn": "978-race"}]
+
+
+class PausedGetBook(DB_GetBookById):
+    """ Читает книгу и ждет разрешения вернуть результат: между чтением и записью в кэш проходит выдача """
+    read = asyncio.Event()
+    release = asyncio.Event()
+
+    async def __call__(self, book_id):
+        result = await super().__call__(book_id)
+        PausedGetBook.read.set()
+        await PausedGetBook.release.wait()
+        return result
+
+
+@pytest.mark.asyncio
+async def test_book_cache_does_not_store_value_read_before_invalidation(get_token, get_client):
+    """Карточка, прочитанная до выдачи, не попадает в кэш после сброса ключа выдачей"""
+    headers = {"Authorization": f"bearer {get_token}"}
+    PausedGetBook.read, PausedGetBook.release = asyncio.Event(), asyncio.Event()
+    book_id = (await get_client.post(
+        "/books/",
+        headers=headers,
+        json=INPUT_CreateBook(title="Cached", author="Cached", quantity=2).model_dump()
+    )).json()["id"]
+    reader_id = (await get_client.post(
+        "/readers/",
+        headers=headers,
+        json=INPUT_CreateReader(name="cache reader", email="cache.reader@library.org").model_dump()
+    )).json()["id"]
+    before = metrics.snapshot().get("cache.stale_writes", 0)
+    reading = asyncio.create_task(SERVICE_GetBookById(PausedGetBook(), cache)(book_id))
+    await PausedGetBook.read.wait()
+    response = await get_client.post(
+        "/borrowed_books/",
+        headers=headers,
+        json=INPUT_CreateBorrowedBook(reader_id=reader_id, book_id=book_id).model_dump()
+    )
+    assert response.status_code == 201
+    PausedGetBook.release.set()
+    assert json.loads((await reading).body)["quantity"] == 2  # сам запрос получил то, что прочитал
+    assert metrics.snapshot()["cache.stale_writes"] - before == 1
+    assert (await get_client.get(f"/books/{book_id}", headers=headers)).json()["quantity"] == 1